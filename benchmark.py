@@ -0,0 +1,529 @@
+import sys
+import os
+import time
+import json
+import random
+import platform
+import argparse
+import tempfile
+import py_compile
+import tracemalloc
+import subprocess
+
+import compilerdesign
+
+#Signature shared by the synthetic specs below
+SIGNATURE = """variables: x y z
+constants: C D
+predicates: P[2] Q[1]
+equality: ==
+connectives: AND OR IMPLIES IFF NOT
+quantifiers: E A
+"""
+
+#Build a spec whose formula is roughly size bytes long: a right-nested chain of conjunctions over predicate applications
+def synthetic_spec(size):
+    unit = "( P(x,y) AND "
+    count = max(1, size // (len(unit) + 2))
+    lines = ["formula: A x E y "]
+    #Break the formula over lines of about 100 conjunctions each
+    for start in range(0, count, 100):
+        lines.append(unit * min(100, count - start) + "\n")
+    lines.append("Q(x)" + " )" * count + "\n")
+    return SIGNATURE + "".join(lines)
+
+#Run func repeat times and return the best wall time in seconds
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+#Throughput of the formula tokenizer and of parse_input on multi-megabyte formulas
+def bench_tokenizer(args):
+    for megabytes in args.sizes:
+        text = synthetic_spec(int(megabytes * 1024 * 1024))
+        size = len(text.encode()) / (1024 * 1024)
+        scan = best_of(lambda: sum(1 for _ in compilerdesign.tokenize(text)), args.repeat)
+        parse = best_of(lambda: compilerdesign.parse_input(text), args.repeat)
+        print("%8.1f MB   tokenize with positions %8.1f MB/s   parse_input %8.1f MB/s" % (size, size / scan, size / parse))
+
+#Build a spec declaring count variables and count constants
+def signature_spec(count):
+    variables = " ".join("v%d" % i for i in range(count))
+    constants = " ".join("c%d" % i for i in range(count))
+    return SIGNATURE.replace("variables: x y z", "variables: " + variables).replace("constants: C D", "constants: " + constants) + "formula: Q(x)\n"
+
+#Scaling of check_validity with the size of the signature
+def bench_validity(args):
+    for count in args.sizes:
+        parsed = compilerdesign.parse_input(signature_spec(count))
+        elapsed = best_of(lambda: compilerdesign.check_validity(parsed), args.repeat)
+        print("%9d variables + constants   check_validity %8.3f s   %6.0f ns/symbol" % (count, elapsed, elapsed * 1e9 / (2 * count)))
+
+#Build a spec declaring predicates binary predicates whose formula is a chain of count predicate applications
+def predicate_spec(count, predicates):
+    declared = " ".join("R%d[2]" % i for i in range(predicates))
+    formula = "".join("( R%d(x,y) AND " % (i % predicates) for i in range(count)) + "Q(x)" + " )" * count
+    return SIGNATURE.replace("predicates: P[2] Q[1]", "predicates: " + declared + " Q[1]") + "formula: " + formula + "\n"
+
+#Formula checks before and after they were folded into the parser: check_formula followed by a Parser without arity
+#checks, against a single Parser run checking arity as it goes
+def bench_formula(args):
+    for count in args.sizes:
+        parsed = compilerdesign.parse_input(predicate_spec(count, args.predicates))
+        compilerdesign.check_validity(parsed)
+        names = [entry[0] for entry in parsed[2]]
+        arities = dict(parsed[2])
+        signature = (parsed[0], parsed[1], parsed[4], names, parsed[5], parsed[3])
+        before = best_of(lambda: (compilerdesign.check_formula(parsed), compilerdesign.Parser(list(parsed[6]), *signature)), args.repeat)
+        after = best_of(lambda: compilerdesign.Parser(list(parsed[6]), *signature, arities), args.repeat)
+        print("%7d applications of %5d predicates   check_formula + Parser %8.3f s   Parser with arity checks %8.3f s" % (count, args.predicates, before, after))
+
+#Grammar rendering for a batch of specs sharing one signature: rebuilt for every spec against built once and reused
+def bench_grammar(args):
+    for count in args.sizes:
+        parsed = compilerdesign.parse_input(signature_spec(count))
+        def rebuilt():
+            for _ in range(args.specs):
+                compilerdesign.Grammar(compilerdesign.signature_key(parsed)).render("spec.txt")
+        def memoized():
+            compilerdesign._grammars.clear()
+            for _ in range(args.specs):
+                compilerdesign.render_grammar(parsed, "spec.txt")
+        before = best_of(rebuilt, args.repeat)
+        after = best_of(memoized, args.repeat)
+        print("%9d variables + constants, %4d specs   rebuilt %8.3f s   memoized %8.3f s" % (count, args.specs, before, after))
+
+#Parse tree export on large trees: anytree's DotExporter against the native DOT, JSON and S-expression writers
+def bench_serialize(args):
+    from anytree.exporter import DotExporter
+    for megabytes in args.sizes:
+        result = compilerdesign.compile_spec(synthetic_spec(int(megabytes * 1024 * 1024)))
+        tree = result.tree
+        timings = []
+        if len(tree) <= args.anytree_limit:
+            exporter = lambda: sum(1 for _ in DotExporter(tree.to_anytree(), nodeattrfunc=lambda n: 'label="%s"' % (n.id)))
+            #anytree walks the tree recursively and gives up on deeply nested formulas
+            try:
+                timings.append("anytree DotExporter %8.3f s" % best_of(exporter, args.repeat))
+            except RecursionError:
+                timings.append("anytree DotExporter RecursionError")
+        for fmt in ("dot", "json", "sexp"):
+            write = getattr(tree, compilerdesign.TREE_FORMATS[fmt][0])
+            timings.append("%s %8.3f s" % (fmt, best_of(lambda: write(NullOutput()), args.repeat)))
+        print("%10d nodes   " % len(tree) + "   ".join(timings))
+
+#File object discarding what is written, so serializers are timed without the disk
+class NullOutput():
+    def write(self, text):
+        return len(text)
+
+#Parameters of generate_spec: signature size, formula length in atoms, maximum nesting depth, probability that a
+#formula is quantified, predicate arity and the seed of the generator
+SPEC_PARAMETERS = {"variables": 20, "constants": 10, "predicates": 10, "arity": 2, "length": 1000, "depth": 50, "quantifiers": 0.2, "seed": 0}
+
+#Cases of the phases suite, as changes to SPEC_PARAMETERS
+SUITE = {
+    "small": {"length": 10, "depth": 5},
+    "long": {"length": 100000, "depth": 40},
+    "deep": {"length": 5000, "depth": 5000, "quantifiers": 0.05},
+    "quantified": {"length": 10000, "quantifiers": 0.8},
+    "wide-signature": {"variables": 100000, "constants": 100000, "predicates": 10000, "length": 1000},
+    "high-arity": {"arity": 50, "length": 10000},
+}
+
+#Build a random spec. Formulas are expanded left to right from an explicit stack, so deep nesting needs no
+#recursion: a formula below the depth limit is quantified with probability quantifiers, otherwise negated or split
+#into a binary connective while atoms remain to be placed; all others are atoms, predicate applications or equalities
+def generate_spec(variables, constants, predicates, arity, length, depth, quantifiers, seed):
+    rng = random.Random(seed)
+    variable_names = ["v%d" % i for i in range(variables)]
+    constant_names = ["c%d" % i for i in range(constants)]
+    predicate_names = ["R%d" % i for i in range(predicates)]
+    connectives = ["AND", "OR", "IMPLIES", "IFF"]
+    terms = variable_names + constant_names
+    tokens = []
+    #Formulas not yet expanded count as one atom each
+    atoms = 1
+    stack = [0]
+    while stack:
+        item = stack.pop()
+        if item.__class__ == str:
+            tokens.append(item)
+            continue
+        if item < depth:
+            choice = rng.random()
+            if choice < quantifiers:
+                tokens.append(rng.choice(("E", "A")))
+                tokens.append(rng.choice(variable_names))
+                stack.append(item + 1)
+                continue
+            if atoms < length:
+                if choice < quantifiers + (1 - quantifiers) * 0.1:
+                    tokens.append("NOT")
+                    stack.append(item + 1)
+                else:
+                    atoms += 1
+                    tokens.append("(")
+                    stack.extend((")", item + 1, rng.choice(connectives), item + 1))
+                continue
+        if rng.random() < 0.1:
+            tokens.extend(("(", rng.choice(terms), "==", rng.choice(terms), ")"))
+        else:
+            tokens.append(rng.choice(predicate_names) + "(" + ",".join(rng.choice(variable_names) for _ in range(arity)) + ")")
+    lines = ["variables: " + " ".join(variable_names),
+        "constants: " + " ".join(constant_names),
+        "predicates: " + " ".join("%s[%d]" % (name, arity) for name in predicate_names),
+        "equality: ==",
+        "connectives: AND OR IMPLIES IFF NOT",
+        "quantifiers: E A",
+        "formula:"]
+    #Spread the formula over lines of 100 tokens
+    for start in range(0, len(tokens), 100):
+        lines.append(" ".join(tokens[start:start+100]))
+    return "\n".join(lines) + "\n"
+
+#Time each phase of compiling the spec at path separately, best of repeat; returns seconds by phase
+def time_phases(path, repeat):
+    lines = compilerdesign.read_input(path)
+    parsed = compilerdesign.parse_input(lines)
+    compilerdesign.check_validity(parsed)
+    names = [entry[0] for entry in parsed[2]]
+    arities = dict(parsed[2])
+    signature = (parsed[0], parsed[1], parsed[4], names, parsed[5], parsed[3])
+    grammar_file = path[:-4] + "-outputgrammar.txt"
+    def grammar():
+        #Time building the grammar, not the lookup of a memoized one
+        compilerdesign._grammars.clear()
+        compilerdesign.generate_grammar(parsed, grammar_file, path)
+        os.remove(grammar_file)
+    phases = {
+        "read_input": lambda: compilerdesign.read_input(path),
+        "parse_input": lambda: compilerdesign.parse_input(lines),
+        "check_validity": lambda: compilerdesign.check_validity(parsed),
+        "check_formula": lambda: compilerdesign.check_formula(parsed),
+        "Parser": lambda: compilerdesign.Parser(list(parsed[6]), *signature, arities),
+        "generate_grammar": grammar,
+    }
+    return {phase: best_of(func, repeat) for phase, func in phases.items()}
+
+#Commit the benchmarks ran on, if they ran in a git checkout
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#Time every phase on the cases of the suite and optionally save the results as JSON
+def bench_phases(args):
+    overrides = {name: getattr(args, name) for name in SPEC_PARAMETERS if getattr(args, name) != None}
+    results = {"commit": git_commit(), "python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": args.repeat, "cases": {}}
+    #Compile quietly; the phases report errors of invalid specs through the log
+    compilerdesign._context.verbose = False
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.case or list(SUITE):
+            parameters = dict(SPEC_PARAMETERS, **SUITE[name])
+            parameters.update(overrides)
+            text = generate_spec(**parameters)
+            path = os.path.join(directory, name + ".txt")
+            with open(path, "w") as spec:
+                spec.write(text)
+            phases = time_phases(path, args.repeat)
+            results["cases"][name] = {"parameters": parameters, "bytes": len(text), "phases": phases}
+            print("%-16s %9d bytes   " % (name, len(text)) + "   ".join("%s %.4f s" % item for item in phases.items()))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=1)
+            output.write("\n")
+    return 0
+
+#Compare two saved phases results; phases slower by more than threshold (a fraction) and by more than min_seconds
+#are regressions
+def bench_compare(args):
+    with open(args.baseline) as baseline:
+        before = json.load(baseline)
+    with open(args.current) as current:
+        after = json.load(current)
+    regressions = 0
+    for name, case in after["cases"].items():
+        if name not in before["cases"]:
+            continue
+        for phase, seconds in case["phases"].items():
+            previous = before["cases"][name]["phases"].get(phase)
+            if previous == None:
+                continue
+            ratio = seconds / previous if previous else 1.0
+            flag = ""
+            if ratio > 1 + args.threshold and seconds - previous > args.min_seconds:
+                flag = "   REGRESSION"
+                regressions += 1
+            print("%-16s %-16s %10.4f s -> %10.4f s   x%.2f%s" % (name, phase, previous, seconds, ratio, flag))
+    print(str(regressions) + " regressions above " + str(int(args.threshold * 100)) + "%")
+    return 1 if regressions else 0
+
+#Checking many formulas against one signature: a spec per formula, each repeating the signature, against one
+#multi-formula spec holding them all
+def bench_multi(args):
+    spec = generate_spec(**dict(SPEC_PARAMETERS, variables=args.signature, constants=args.signature, length=args.length))
+    header, _, formula = spec.partition("formula:")
+    formula = " ".join(formula.split())
+    for count in args.sizes:
+        def separate():
+            #Forget checked signatures, as separate runs would
+            compilerdesign._signatures.clear()
+            for _ in range(count):
+                compilerdesign.compile_spec(header + "formula: " + formula + "\n")
+                compilerdesign._signatures.clear()
+        multi = header + "formulas:\n" + (formula + "\n") * count
+        def together():
+            compilerdesign._signatures.clear()
+            for _ in compilerdesign.compile_formulas(multi):
+                pass
+        print("%6d formulas   a spec each %8.3f s   one multi-formula spec %8.3f s" % (count, best_of(separate, args.repeat), best_of(together, args.repeat)))
+
+#Parse time of a formula with errors planted in every step-th atom, next to the clean formula; with recovery every
+#error is reported in the same single pass
+def bench_recovery(args):
+    spec = generate_spec(**dict(SPEC_PARAMETERS, length=args.length))
+    header, _, formula = spec.partition("formula:")
+    tokens = formula.split()
+    for step in args.steps:
+        broken = list(tokens)
+        if step:
+            atoms = [index for index, token in enumerate(broken) if "(" in token and token != "("]
+            for index in atoms[::step]:
+                broken[index] = "U" + broken[index]
+        text = header + "formula: " + " ".join(broken) + "\n"
+        result = compilerdesign.compile_spec(text)
+        elapsed = best_of(lambda: compilerdesign.compile_spec(text), args.repeat)
+        print("error every %6s atoms %6d diagnostics %8.3f s" % (step or "-", len(result.diagnostics), elapsed))
+
+#Edit-to-result latency of changing one atom in the middle of a formula: compiling the edited spec in full against
+#reparsing it from the previous result
+def bench_edit(args):
+    for length in args.lengths:
+        spec = generate_spec(**dict(SPEC_PARAMETERS, length=length))
+        header, _, formula = spec.partition("formula:")
+        tokens = formula.split()
+        atoms = [index for index, token in enumerate(tokens) if "(" in token and token != "("]
+        edited = list(tokens)
+        edited[atoms[len(atoms) // 2]] = "( " + tokens[atoms[len(atoms) // 2]] + " AND " + tokens[atoms[0]] + " )"
+        #reparse reuses the formula lines that did not change, so the layout decides how much is tokenized again
+        per_line = args.per_line or len(tokens)
+        texts = [header + "formula: " + "\n".join(" ".join(version[start:start+per_line]) for start in range(0, len(version), per_line)) + "\n" for version in (tokens, edited)]
+        full = best_of(lambda: compilerdesign.compile_spec(texts[1]), args.repeat)
+        #Alternate between the two versions, each reparsed from the result of the other
+        results = [compilerdesign.compile_spec(texts[0]), 0]
+        def incremental():
+            results[1] = 1 - results[1]
+            results[0] = compilerdesign.reparse(results[0], texts[results[1]])
+        reparsed = best_of(incremental, args.repeat)
+        print("%8d atoms   full compile %8.3f s   reparse %8.3f s   reparse phase %8.6f s" % (length, full, reparsed, results[0].timings.get("reparse", 0)))
+
+#Memory held by the parse trees of many formulas over a small signature, kept as a ParseTree each against shared in
+#one FormulaDAG, measured with tracemalloc
+def bench_share(args):
+    parameters = dict(SPEC_PARAMETERS, variables=args.symbols, constants=args.symbols, predicates=args.symbols, arity=1, length=args.length)
+    header = generate_spec(**parameters).partition("formula:")[0]
+    formulas = [" ".join(generate_spec(**dict(parameters, seed=seed)).partition("formula:")[2].split()) for seed in range(args.count)]
+    text = header + "formulas:\n" + "\n".join(formulas) + "\n"
+    for name, dag in (("parse trees", None), ("shared", compilerdesign.FormulaDAG())):
+        tracemalloc.start()
+        start = time.perf_counter()
+        results = [result.tree or result.root for result in compilerdesign.compile_formulas(text, dag=dag) if result.ok]
+        elapsed = time.perf_counter() - start
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if dag == None:
+            nodes = sum(len(tree) for tree in results)
+        else:
+            nodes = len(dag)
+        print("%-12s %6d formulas %10d nodes %10.1f MB %8.3f s" % (name, len(results), nodes, held / 1e6, elapsed))
+        del results
+
+#Scope analysis of formulas nested depth quantifiers deep, binding a few variables over and over, next to parsing them
+def bench_scopes(args):
+    variables = ["x%d" % i for i in range(args.variables)]
+    header = SIGNATURE.replace("variables: x y z", "variables: " + " ".join(variables)).replace("Q[1]", "Q[1] R[%d]" % args.variables)
+    for depth in args.depths:
+        prefix = " ".join(("A " if level % 2 else "E ") + variables[level % args.variables] for level in range(depth))
+        result = compilerdesign.compile_spec(header + "formula: " + prefix + " R(" + ",".join(variables) + ")\n")
+        elapsed = best_of(lambda: compilerdesign.check_scopes(result.tree), args.repeat)
+        print("%8d quantifiers %8d nodes   parse %8.3f s   scopes %8.3f s" % (depth, len(result.tree), result.timings["parse"], elapsed))
+
+#CNF conversion of generated formulas, and of chains of IFF whose CNF by distribution doubles with every link, with
+#the size of the DIMACS output and the peak memory of the conversion
+def bench_cnf(args):
+    import normalforms
+    cases = [("%d atoms" % length, generate_spec(**dict(SPEC_PARAMETERS, length=length))) for length in args.lengths]
+    for links in args.chain:
+        cases.append(("IFF chain of %d" % links, SIGNATURE + "formula: " + "( " * links + "Q(x)" + "".join(" IFF Q(%s) )" % "xyz"[link % 3] for link in range(links)) + "\n"))
+    for name, spec in cases:
+        result = compilerdesign.compile_spec(spec)
+        output = NullOutput()
+        tracemalloc.start()
+        start = time.perf_counter()
+        formula = normalforms.Formula(result.parsed)
+        prefix, matrix = formula.prenex(formula.nnf(formula.name_iffs(formula.add_tree(result.tree)), split=True, iff=True))
+        variables, clauses = formula.write_dimacs(output, prefix, matrix)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-20s %8d tree nodes %8d variables %8d clauses %8.3f s %8.1f MB" % (name, len(result.tree), variables, clauses, elapsed, peak / 1e6))
+
+#Start-up cost of short runs in a fresh process: a run failing validation and a grammar-only run, with the compiler
+#run as a script (compiled from source every time) and as a module (from cached bytecode), next to the bare
+#interpreter, importing the compiler and a failing run of the compiler at baseline, a git revision. Each run is
+#checked once for its exit status and output before it is timed; one that fails, such as a baseline missing its
+#dependencies, is skipped
+def bench_startup(args):
+    package = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(package, "compilerdesign.py")
+    environment = dict(os.environ, PYTHONPATH=package + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    failure = "Incorrect cardinality"
+    with tempfile.TemporaryDirectory() as directory:
+        valid = os.path.join(directory, "valid.txt")
+        with open(valid, "w") as output:
+            output.write(generate_spec(**dict(SPEC_PARAMETERS, length=10)))
+        invalid = os.path.join(directory, "invalid.txt")
+        with open(invalid, "w") as output:
+            output.write("variables: x\nformula: P(x)\n")
+        #Runs as (name, command, exit status, text expected in its output)
+        runs = [("python -c pass", [sys.executable, "-c", "pass"], 0, "")]
+        #The compiler at baseline, as a script as it was then run; it exited normally after a validation failure
+        baseline = args.baseline or subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=package, capture_output=True, text=True).stdout.split("\n")[0]
+        source = subprocess.run(["git", "show", baseline + ":compilerdesign.py"], cwd=package, capture_output=True)
+        if baseline and source.returncode == 0:
+            old = os.path.join(directory, "baseline", "compilerdesign.py")
+            os.mkdir(os.path.dirname(old))
+            with open(old, "wb") as output:
+                output.write(source.stdout)
+            runs.append(("validation failure, " + baseline[:10], [sys.executable, old, invalid], 0, failure))
+        else:
+            print("baseline %s not found; not timed" % (baseline or "revision"))
+        runs += [
+            ("import compilerdesign", [sys.executable, "-c", "import compilerdesign"], 0, ""),
+            ("validation failure, script", [sys.executable, script, invalid], 1, failure),
+            ("validation failure, -m", [sys.executable, "-m", "compilerdesign", invalid], 1, failure),
+            ("grammar only, script", [sys.executable, script, valid, "--render", "none"], 0, "Parsing successful"),
+            ("grammar only, -m", [sys.executable, "-m", "compilerdesign", valid, "--render", "none"], 0, "Parsing successful"),
+        ]
+        #Write the bytecode cache before timing, even where PYTHONDONTWRITEBYTECODE is set
+        py_compile.compile(script)
+        for name, command, code, expected in runs:
+            check = subprocess.run(command, cwd=directory, env=environment, capture_output=True, text=True)
+            if check.returncode != code or expected not in check.stdout:
+                error = (check.stderr.strip().splitlines() or ["output lacks " + repr(expected)])[-1]
+                print("%-32s skipped; exit status %d, expected %d: %s" % (name, check.returncode, code, error))
+                continue
+            elapsed = best_of(lambda: subprocess.run(command, cwd=directory, env=environment, capture_output=True), args.repeat)
+            print("%-32s %8.1f ms" % (name, elapsed * 1000))
+
+#Latency of compiling a spec: a fresh process per spec against requests to a warm compile server
+def bench_server(args):
+    spec = generate_spec(**dict(SPEC_PARAMETERS, length=args.length))
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compilerdesign.py")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "spec.txt")
+        with open(path, "w") as output:
+            output.write(spec)
+        cold = best_of(lambda: subprocess.run([sys.executable, script, path, "--render", "none"], cwd=directory, capture_output=True), args.repeat)
+        server = subprocess.Popen([sys.executable, script, "serve", "--workers", "1"], cwd=directory, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        request = json.dumps({"spec": spec, "tree": None}) + "\n"
+        def warm():
+            server.stdin.write(request)
+            server.stdin.flush()
+            server.stdout.readline()
+        warm()
+        latency = best_of(warm, args.repeat)
+        server.stdin.close()
+        server.wait()
+    print("%6d atoms   new process %8.1f ms   warm server %8.2f ms" % (args.length, cold * 1000, latency * 1000))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the FO formula compiler")
+    commands = parser.add_subparsers(dest="command", required=True)
+    tokenizer = commands.add_parser("tokenizer", help="tokenizer and parse_input throughput")
+    tokenizer.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="formula sizes in MB")
+    tokenizer.add_argument("--repeat", type=int, default=3)
+    tokenizer.set_defaults(func=bench_tokenizer)
+    validity = commands.add_parser("validity", help="check_validity symbol table scaling")
+    validity.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000], help="number of variables and of constants")
+    validity.add_argument("--repeat", type=int, default=3)
+    validity.set_defaults(func=bench_validity)
+    formula = commands.add_parser("formula", help="predicate arity and parenthese checks")
+    formula.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="number of predicate applications")
+    formula.add_argument("--predicates", type=int, default=1000, help="number of declared predicates")
+    formula.add_argument("--repeat", type=int, default=3)
+    formula.set_defaults(func=bench_formula)
+    grammar = commands.add_parser("grammar", help="grammar rendering with a shared signature")
+    grammar.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="number of variables and of constants")
+    grammar.add_argument("--specs", type=int, default=100, help="specs sharing the signature")
+    grammar.add_argument("--repeat", type=int, default=3)
+    grammar.set_defaults(func=bench_grammar)
+    serialize = commands.add_parser("serialize", help="parse tree DOT, JSON and S-expression export")
+    serialize.add_argument("--sizes", type=float, nargs="+", default=[0.1, 1, 4], help="formula sizes in MB")
+    serialize.add_argument("--anytree-limit", type=int, default=200000, help="largest tree also exported with anytree")
+    serialize.add_argument("--repeat", type=int, default=3)
+    serialize.set_defaults(func=bench_serialize)
+    multi = commands.add_parser("multi", help="many formulas against one signature")
+    multi.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="number of formulas")
+    multi.add_argument("--signature", type=int, default=10000, help="number of variables and of constants")
+    multi.add_argument("--length", type=int, default=20, help="atoms per formula")
+    multi.add_argument("--repeat", type=int, default=3)
+    multi.set_defaults(func=bench_multi)
+    recovery = commands.add_parser("recovery", help="parsing formulas with many errors in one pass")
+    recovery.add_argument("--length", type=int, default=20000, help="atoms in the formula")
+    recovery.add_argument("--steps", type=int, nargs="+", default=[0, 1000, 10, 1], help="plant an error every step atoms; 0 for none")
+    recovery.add_argument("--repeat", type=int, default=3)
+    recovery.set_defaults(func=bench_recovery)
+    edit = commands.add_parser("edit", help="reparsing an edited formula against compiling it in full")
+    edit.add_argument("--lengths", type=int, nargs="+", default=[1000, 10000, 100000], help="atoms in the formula")
+    edit.add_argument("--repeat", type=int, default=3)
+    edit.add_argument("--per-line", type=int, default=16, help="formula tokens per line, 0 for the whole formula on one line (default: 16)")
+    edit.set_defaults(func=bench_edit)
+    share = commands.add_parser("share", help="parse trees of many formulas against one shared formula DAG")
+    share.add_argument("--count", type=int, default=1000, help="number of formulas")
+    share.add_argument("--length", type=int, default=200, help="atoms per formula")
+    share.add_argument("--symbols", type=int, default=3, help="variables, constants and predicates in the signature")
+    share.set_defaults(func=bench_share)
+    scopes = commands.add_parser("scopes", help="free variable and scope analysis of deeply nested quantifiers")
+    scopes.add_argument("--depths", type=int, nargs="+", default=[1000, 10000, 100000], help="quantifiers in the formula")
+    scopes.add_argument("--variables", type=int, default=5, help="variables bound by the quantifiers")
+    scopes.add_argument("--repeat", type=int, default=3)
+    scopes.set_defaults(func=bench_scopes)
+    cnf = commands.add_parser("cnf", help="Tseitin CNF conversion to DIMACS")
+    cnf.add_argument("--lengths", type=int, nargs="+", default=[1000, 10000, 100000], help="atoms of generated formulas")
+    cnf.add_argument("--chain", type=int, nargs="+", default=[20, 1000], help="links of IFF chains")
+    cnf.set_defaults(func=bench_cnf)
+    startup = commands.add_parser("startup", help="start-up time of validation-only and grammar-only runs")
+    startup.add_argument("--repeat", type=int, default=10)
+    startup.add_argument("--baseline", default=None, metavar="REV", help="git revision of the compiler to compare against (default: the first commit)")
+    startup.set_defaults(func=bench_startup)
+    server = commands.add_parser("server", help="compile latency of a new process against a warm compile server")
+    server.add_argument("--length", type=int, default=20, help="atoms in the formula")
+    server.add_argument("--repeat", type=int, default=5)
+    server.set_defaults(func=bench_server)
+    phases = commands.add_parser("phases", help="time read_input, parse_input, check_validity, check_formula, Parser and generate_grammar on generated specs")
+    phases.add_argument("--case", nargs="+", choices=list(SUITE), help="cases of the suite to run (default: all)")
+    for name, default in SPEC_PARAMETERS.items():
+        phases.add_argument("--" + name, type=type(default), default=None, help="override for every case (default: %s unless set by the case)" % default)
+    phases.add_argument("--repeat", type=int, default=3)
+    phases.add_argument("--output", default=None, help="save the results as JSON")
+    phases.set_defaults(func=bench_phases)
+    compare = commands.add_parser("compare", help="compare two JSON results of phases")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression (default: 0.1)")
+    compare.add_argument("--min-seconds", type=float, default=0.001, help="smaller slowdowns are noise, not regressions (default: 0.001)")
+    compare.set_defaults(func=bench_compare)
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
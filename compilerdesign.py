@@ -1,75 +1,278 @@
 from datetime import datetime
 import time
 import sys
-import string
-import random
+import re
+import os
+import stat
+import mmap
+import codecs
+import json
+import argparse
+import bisect
+import threading
+import queue
+import io
+import tracemalloc
+import atexit
+from collections import namedtuple, deque, OrderedDict
+from array import array
+from operator import itemgetter
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import resource
+except ImportError:
+    resource = None
 
-#Parse tree visualization modules
-import anytree
-import graphviz
-from anytree import Node, RenderTree
-from anytree.dotexport import RenderTreeGraph
-from anytree.exporter import DotExporter
+#Modules needed only by some commands are imported where they are used, so validating a spec or writing its
+#grammar loads no more than the standard library: anytree (ParseTree.to_anytree), hashlib (CompileCache),
+#subprocess and tempfile (RenderPipeline), multiprocessing (run_batch), socketserver and concurrent.futures (serve).
+#Python compiles a script run by path afresh every time, which for this file costs more than those imports; run as
+#python -m compilerdesign, it starts from the cached bytecode
 
-#Generate random ID strings to append to anytree Nodes for distinction
-def id_generator(size=6, chars=string.ascii_uppercase + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
+#Per-thread compilation state: name of the spec being compiled, errors reported for it and whether to echo them
+_context = threading.local()
 
-#Specify file to read input from as 1st command line argument
-try:
-    IN_FILE = sys.argv[1]
-except:
-    print("Input file not specified.")
-    sys.exit(1)
+#Log file shared by every compile; records are JSON objects, one per line
+LOG_FILE = "logfile.log"
+
+#Buffered log writer. append_log adds a record to a pending deque and returns; a background thread wakes every
+#interval seconds (or once batch records are pending) and appends everything pending to the log with a single write
+#on a persistent O_APPEND handle, under an exclusive lock so records from concurrent processes never interleave.
+#Pending records are bounded: past capacity the caller writes them out itself instead of growing memory
+class LogWriter():
+    def __init__(self, path=LOG_FILE, capacity=100000, batch=1000, interval=0.2):
+        self.path = path
+        self.capacity = capacity
+        self.batch = batch
+        self.interval = interval
+        self.pending = deque()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.pid = os.getpid()
+        #Held while draining, so batches reach the file in the order they were logged
+        self.drain_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    #Queue a (time, source, status, message) record
+    def write(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch:
+            self.wake.set()
+        if len(self.pending) >= self.capacity:
+            self.flush()
+
+    #Write every record queued so far
+    def flush(self):
+        with self.drain_lock:
+            self._drain()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.wake.set()
+            self.thread.join()
+            self.flush()
+            os.close(self.fd)
+
+    def _run(self):
+        while not self.closed:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def _drain(self):
+        lines = []
+        pending = self.pending
+        #deque.popleft is atomic, so records appended meanwhile are either taken now or left for the next drain
+        while pending:
+            when, source, status, msg = pending.popleft()
+            timestamp = datetime.fromtimestamp(when).isoformat(timespec="milliseconds")
+            lines.append(json.dumps({"time": timestamp, "pid": self.pid, "source": source, "status": status, "message": msg}) + "\n")
+        if not lines:
+            return
+        data = "".join(lines).encode()
+        if fcntl != None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            while data:
+                data = data[os.write(self.fd, data):]
+        finally:
+            if fcntl != None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+_log_writer = None
+_log_lock = threading.Lock()
+
+#Log writer of this process, started on first use
+def log_writer():
+    global _log_writer
+    if _log_writer == None:
+        with _log_lock:
+            if _log_writer == None:
+                writer = LogWriter()
+                atexit.register(writer.close)
+                #Worker processes exit without running atexit handlers, but do run multiprocessing finalizers;
+                #a process using multiprocessing has already imported it
+                if "multiprocessing.util" in sys.modules:
+                    sys.modules["multiprocessing.util"].Finalize(writer, writer.close, exitpriority=100)
+                _log_writer = writer
+    return _log_writer
 
-#Specify destination of output grammar 
-current_timestamp = datetime.now()
-timestamp_str = current_timestamp.strftime("%d-%b-%Y-%H:%M:%S")
-OUT_FILE_GRAMMAR = timestamp_str + IN_FILE[:-4] + "-outputgrammar.txt"
-OUT_FILE_PARSETREE = timestamp_str + IN_FILE[:-4] + "-outputparsetree.png"
+#A forked child gets a copy of the parent's writer without its thread; the copy is retired, leaving the parent's
+#pending records to the parent, and the child starts its own writer on first use
+def _reset_log_writer():
+    global _log_writer, _log_lock
+    if _log_writer != None and not _log_writer.closed:
+        _log_writer.closed = True
+        _log_writer.pending.clear()
+        os.close(_log_writer.fd)
+    _log_writer = None
+    _log_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_log_writer)
 
 #Append to log
 def append_log(status, msg):
-    #Generate timestamp for record in log file
-    current_timestamp = datetime.now()
-    timestamp_str = current_timestamp.strftime("%d-%b-%Y-%H:%M:%S")+"\t"+IN_FILE+"\t"+status+"\t"+msg+"\n"
-    #Write tab-delimited lines to log file
-    writing = timestamp_str
-    with open("logfile.log", "a") as log:
-        log.write(writing)
-        log.flush()
+    log_writer().write((time.time(), getattr(_context, "source", ""), status, msg))
+    return 0
+
+#Block until everything logged so far has been written to the log file
+def flush_log():
+    if _log_writer != None:
+        _log_writer.flush()
+
+#Report an error for the spec currently being compiled; echoed to stdout, logged and recorded on its Result
+def report_error(msg):
+    if getattr(_context, "verbose", True):
+        print(msg)
+    errors = getattr(_context, "errors", None)
+    if errors is not None:
+        errors.append(msg)
+    append_log("ERR", msg)
     return 0
 
 #Read from supplied input file
 def read_input(filename):
-    #Check if filename exists in current directory
+    #Check if filename exists; relative paths resolve against the current directory
     try:
-        lines = []
-        with open('./'+filename) as file:
+        with open(filename) as file:
             #Check supplied file is of correct type; .txt extension 
             if filename[-4:] == ".txt":
                 #Read contents of the file
-                line = file.readline()
-                while line:
-                    lines.append(line)
-                    line = file.readline()
+                lines = file.readlines()
                 return lines
             else:
-                print("Specified file is of an invalid format; only files with .txt extension are accepted as valid input.")
-                append_log("ERR", "Specified file is of an invalid format; only files with .txt extension are accepted as valid input.")
+                report_error("Specified file is of an invalid format; only files with .txt extension are accepted as valid input.")
                 #Log and close the running program
                 return False
     except: 
-        print("Specified input file not found.")
-        append_log("ERR", "Specified input file not found.")
+        report_error("Specified input file not found.")
         #Log and close the running program
         return False
 
 
-#Parse input file contents 
-def parse_input(file_contents):
-    #Initialize parsing criteria
-    definitions = ['variables:', 'constants:', 'predicates:', 'equality:', 'connectives:', 'quantifiers:', 'formula:']
+#Section headers of a spec file, in the order of the lists returned by parse_input. A formulas: section holds one
+#formula per line; it is only read by compile_formulas
+definitions = ['variables:', 'constants:', 'predicates:', 'equality:', 'connectives:', 'quantifiers:', 'formula:', 'formulas:']
+HEADER_RE = re.compile(r"^[ \t]*(" + "|".join(definitions) + ")", re.M)
+#Signature symbols are separated by white space and split with str.split; in the formula "(", ")" and "," are
+#terminals in their own right
+FORMULA_TOKEN_RE = re.compile(r"[(),]|[^\s(),]+")
+#Predicate symbols are declared as name[arity]
+PREDICATE_RE = re.compile(r"([^\[]*)\[?([^\]]*)\]?")
+
+#Token of a spec file with its 1-based line and column
+Token = namedtuple("Token", ["text", "line", "col"])
+
+#Split a spec into its sections; yields (category, start, end, line) with category an index into definitions,
+#text[start:end] the contents following the header and line the line number of the header
+def split_sections(text):
+    line = 1
+    previous = None
+    last = 0
+    for match in HEADER_RE.finditer(text):
+        line += text.count("\n", last, match.start())
+        last = match.start()
+        if previous != None:
+            yield previous[0], previous[1], match.start(), previous[2]
+        previous = (definitions.index(match.group(1)), match.end(), line)
+    if previous != None:
+        yield previous[0], previous[1], len(text), previous[2]
+
+#Scan text[start:end] for tokens in a single pass; line and line_start locate start in the text
+def tokenize(text, start=0, end=None, pattern=FORMULA_TOKEN_RE, line=1, line_start=0):
+    if end == None:
+        end = len(text)
+    last = start
+    for match in pattern.finditer(text, start, end):
+        token_start = match.start()
+        #Count the new lines skipped since the previous token; linear over the whole scan
+        newlines = text.count("\n", last, token_start)
+        if newlines:
+            line += newlines
+            line_start = text.rindex("\n", last, token_start) + 1
+        last = match.end()
+        yield Token(match.group(), line, token_start - line_start + 1)
+
+#Split one line of a formula into the same tokens as FORMULA_TOKEN_RE; runs entirely in C string methods
+def split_formula_line(line):
+    return line.replace("(", " ( ").replace(")", " ) ").replace(",", " , ").split()
+
+#Line and column of the formula token at index; columns are recovered by rescanning only the line holding the token
+def token_position(file_contents, index):
+    token = locate_tokens(file_contents, [index])[index]
+    return token.line, token.col
+
+#Tokens of the formula at the given indices, by index; each line holding one of them is rescanned once. An index
+#past the last token gives an empty token just after it
+def locate_tokens(file_contents, indices):
+    formula_lines = file_contents[8]
+    found = {}
+    wanted = sorted(set(indices))
+    position = 0
+    while position < len(wanted):
+        entry = bisect.bisect_right(formula_lines, wanted[position], key=itemgetter(1)) - 1
+        line, first, raw, column = formula_lines[entry]
+        last = Token("", line, column + 1)
+        for token in tokenize(raw, line=line, line_start=-column):
+            while position < len(wanted) and wanted[position] == first:
+                found[first] = token
+                position += 1
+            first += 1
+            last = token
+        #Indices past the last token of the line belong to a later line, unless this is the last one
+        if entry == len(formula_lines) - 1:
+            while position < len(wanted):
+                found[wanted[position]] = Token("", last.line, last.col + len(last.text))
+                position += 1
+    return found
+
+#Tokens of the formula in text[start:end], whose first line is line, and the formula lines they came from (see
+#token_position)
+def formula_tokens(text, start, end, line):
+    formula = []
+    formula_lines = []
+    column = start - (text.rfind("\n", 0, start) + 1)
+    for raw in text[start:end].split("\n"):
+        tokens = split_formula_line(raw.replace("\\", "\\\\"))
+        if tokens:
+            formula_lines.append((line, len(formula), raw, column))
+            formula.extend(tokens)
+        line += 1
+        column = 0
+    return formula, formula_lines
+
+#Parse input file contents; accepts the lines returned by read_input or the text of a spec. When formulas is a
+#list, formula sections are not tokenized; instead (line, start, end) of every formula goes to formulas: one per
+#formula: section and one per non-blank line of a formulas: section
+def parse_input(file_contents, formulas=None):
+    text = file_contents if isinstance(file_contents, str) else "".join(file_contents)
     variables = []
     constants = []
     predicates = []
@@ -78,163 +281,198 @@ def parse_input(file_contents):
     quantifiers = []
     formula = []
     predicate_symbols = []
-    for line in file_contents:
-        #Initialize parsing criteria
-        for category in definitions:
-                if (category in line[0:12]) == True:
-                    current_category = definitions.index(category)
-                    new_line = 1
-        #Parse variables
-        if current_category == 0:
-            if new_line == 1:
-                contents = line[10:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            for c in contents:
-                if c == ' ' or c == '\t' or c == '\n':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        variables.append(var)
-                        var = ''
-                else: 
-                    var += c
-        #Parse constants
-        if current_category == 1: 
-            if new_line == 1:
-                contents = line[10:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            for c in contents:
-                if c == ' ' or c == '\t' or c == '\n':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        constants.append(var)
-                        var = ''
-                else: 
-                    var += c   
-        #Parse predicate symbols and their associated arity
-        if current_category == 2:
-            if new_line == 1:
-                contents = line[11:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            arity = ''
-            parsing_arity = 0 
-            for c in contents:
-                if c == ' ' or c == '\t' or c == '\n':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        predicates.append([var, arity])
-                        predicate_symbols.append(var)
-                        var = ''
-                        arity = ''
-                else:
-                    if c == "[":
-                        parsing_arity = 1 
-                    elif c == "]":
-                        parsing_arity = 0
-                    elif parsing_arity == 1 and c != "[":
-                        arity +=c
-                    else:
-                        var += c
-        #Parse equality
-        if current_category == 3:
-            if new_line == 1:
-                contents = line[9:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            for c in contents:
-                if c == ' ' or c == '\t' or c == '\n':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        equality.append(var)
-                        var = ''
-                else: 
-                    var += c 
-        #Parse connectives
-        if current_category == 4:
-            if new_line == 1:
-                contents = line[12:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            for c in contents:
-                if c == ' ' or c == '\t' or c == '\n':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        connectives.append(var)
-                        var = ''
-                else: 
-                    var += c 
-        #Parse quantifiers
-        if current_category == 5:
-            if new_line == 1:
-                contents = line[12:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            for c in contents:
-                if c == ' ' or c == '\t' or c == '\n':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        quantifiers.append(var)
-                        var = ''
-                else: 
-                    var += c 
+    #(line, index of first token, raw text, column offset) of each formula line holding tokens; see token_position
+    formula_lines = []
+    sections = [variables, constants, predicates, equality, connectives, quantifiers, formula]
+    for category, start, end, line in split_sections(text):
+        #Formulas of a multi-formula spec are located only
+        if formulas != None and category == 6:
+            formulas.append((line, start, end))
+        elif category == 7:
+            if formulas != None:
+                for raw in text[start:end].split("\n"):
+                    if raw.strip():
+                        formulas.append((line, start, start + len(raw)))
+                    start += len(raw) + 1
+                    line += 1
         #Parse formula token by token
-        if current_category == 6:
-            if new_line == 1:
-                contents = line[8:] + ' '
-                new_line = 0
-            else: 
-                contents = line + ' '
-            var = ''
-            for c in contents:
-                #Account for possible white spaces, tabs, new lines, etc. in formula
-                if c ==' ' or c == '\t' or c == '\n' or c == '':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        formula.append(var)
-                        var = ''
-                #Account for "(" ")" and "," as terminals
-                elif c== '(' or c == ')' or c == ',':
-                    if len(var) > 0:
-                        var = var.replace("\\", "\\\\")
-                        formula.append(var)
-                    formula.append(c)
-                    var = ''
-                else: 
-                    var += c 
-    file_contents = [variables, constants, predicates, equality, connectives, quantifiers, formula, predicate_symbols]
+        elif category == 6:
+            tokens, lines = formula_tokens(text, start, end, line)
+            for entry in lines:
+                formula_lines.append((entry[0], entry[1] + len(formula), entry[2], entry[3]))
+            formula.extend(tokens)
+        #Parse predicate symbols and their associated arity
+        elif category == 2:
+            for token in text[start:end].replace("\\", "\\\\").split():
+                name, arity = PREDICATE_RE.match(token).groups()
+                predicates.append([name, arity])
+                predicate_symbols.append(name)
+        #Parse variables, constants, equality, connectives and quantifiers
+        else:
+            sections[category].extend(text[start:end].replace("\\", "\\\\").split())
+    #The symbol table is filled in by check_validity
+    file_contents = [variables, constants, predicates, equality, connectives, quantifiers, formula, predicate_symbols, formula_lines, None]
     return file_contents
 
+#Size of the blocks read from a formula section when streaming a spec
+STREAM_CHUNK = 1 << 16
+HEADER_BYTES = [header.encode() for header in definitions]
+HEADER_BYTES_RE = re.compile(rb"^[ \t]*(" + "|".join(definitions).encode() + rb")", re.M)
+SEPARATORS = frozenset(" \t\n\r\f\v(),")
+
+#Locate the sections of a spec without keeping its contents; yields (category, start, end) byte ranges of the
+#contents following each header. An mmap is searched in place, a file is read in blocks of STREAM_CHUNK: the end of
+#a block is carried over to the next one only while it may still become a header, so long lines are never held
+def locate_sections(source, use_mmap):
+    previous = None
+    if use_mmap:
+        for match in HEADER_BYTES_RE.finditer(source):
+            if previous != None:
+                yield previous[0], previous[1], match.start()
+            previous = (definitions.index(match.group(1).decode()), match.end())
+        end = len(source)
+    else:
+        #File offset of the first byte of data, whether that byte is inside a line rather than at its start, and the
+        #blanks dropped from the line just before it
+        offset = 0
+        inside = False
+        skipped = 0
+        carry = b""
+        while True:
+            block = source.read(STREAM_CHUNK)
+            data = carry + block
+            cut = len(data)
+            carry = b""
+            dropped = 0
+            if block:
+                newline = data.rfind(b"\n")
+                if newline >= 0 or not inside:
+                    tail = data[newline + 1:]
+                    rest = tail.lstrip(b" \t")
+                    if any(header.startswith(rest) for header in HEADER_BYTES):
+                        #Blanks before the header only shift it, so at most one is kept
+                        cut = len(data) - len(tail)
+                        carry = tail[max(0, len(tail) - len(rest) - 1):]
+                        dropped = len(tail) - len(carry)
+            for match in HEADER_BYTES_RE.finditer(data, 0, cut):
+                if inside and match.start() == 0:
+                    continue
+                if previous != None:
+                    yield previous[0], previous[1], offset + match.start() - (skipped if match.start() == 0 else 0)
+                previous = (definitions.index(match.group(1).decode()), offset + match.end())
+            if not block:
+                end = offset + len(data)
+                break
+            offset += cut + dropped
+            skipped = dropped + (skipped if cut == 0 else 0)
+            inside = not carry and data[-1:] != b"\n"
+    if previous != None:
+        yield previous[0], previous[1], end
+
+#Read the byte ranges of a file or mmap in blocks of at most STREAM_CHUNK, decoded incrementally
+def iter_chunks(source, ranges):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for start, end in ranges:
+        source.seek(start)
+        while start < end:
+            block = source.read(min(STREAM_CHUNK, end - start))
+            if not block:
+                break
+            start += len(block)
+            yield decoder.decode(block)
+        #Sections are separated as if by a new line
+        yield decoder.decode(b"", final=True) + "\n"
+
+#Tokenize a formula supplied as text chunks; a token cut at the end of a chunk is carried over to the next one
+def iter_formula_tokens(chunks):
+    carry = ""
+    for chunk in chunks:
+        chunk = carry + chunk
+        cut = len(chunk)
+        while cut > 0 and chunk[cut - 1] not in SEPARATORS:
+            cut -= 1
+        carry = chunk[cut:]
+        for token in split_formula_line(chunk[:cut].replace("\\", "\\\\")):
+            yield token
+    for token in split_formula_line(carry.replace("\\", "\\\\")):
+        yield token
+
+#Open a spec for streaming; returns the signature as parsed by parse_input (with an empty formula) and a generator of
+#formula tokens. Memory used by the generator is bounded by STREAM_CHUNK, independent of the length of the formula
+def stream_spec(filename, use_mmap=False):
+    file = open(filename, "rb")
+    try:
+        #mmap refuses empty files
+        if use_mmap and os.fstat(file.fileno()).st_size > 0:
+            source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            source = file
+            use_mmap = False
+        sections = list(locate_sections(source, use_mmap))
+        signature = []
+        formula = []
+        for category, start, end in sections:
+            if category == 6:
+                formula.append((start, end))
+            else:
+                signature.append(definitions[category])
+                signature.extend(iter_chunks(source, [(start, end)]))
+    except:
+        file.close()
+        raise
+    return parse_input("".join(signature)), _stream_formula(file, source, formula)
+
+def _stream_formula(file, source, ranges):
+    try:
+        for token in iter_formula_tokens(iter_chunks(source, ranges)):
+            yield token
+    finally:
+        if source is not file:
+            source.close()
+        file.close()
+
+#Symbol table categories, in the order symbols are entered by build_symbol_table
+CAT_VARIABLE = 0
+CAT_CONSTANT = 1
+CAT_PREDICATE = 2
+CAT_QUANTIFIER = 3
+CAT_CONNECTIVE = 4
+CAT_EQUALITY = 5
+CATEGORY_NAMES = ["variables", "constants", "predicate symbols", "quantifiers", "connectives", "equality"]
+FORBIDDEN_MESSAGES = ["Variable cannot be one of '(', ')', or ',' ", "Constant cannot be one of '(', ')', or ',' ", "Predicate symbol cannot be one of '(', ')', or ',' ", "Quantifier cannot be one of '(', ')', or ',' ", "Connective cannot be one of '(', ')', or ',' ", "Equality cannot be one of '(', ')', or ',' "]
+
+#Number of symbols declared by the signature of parsed input
+def signature_size(file_contents):
+    return sum(len(file_contents[category]) for category in range(6))
+
+#Build the symbol table of a signature in a single pass; maps each interned symbol to the category declaring it first.
+#Also returns every (symbol, first category, other category) for symbols declared in more than one category
+def build_symbol_table(file_contents):
+    table = {}
+    conflicts = []
+    sets = [file_contents[0], file_contents[1], file_contents[7], file_contents[5], file_contents[4], file_contents[3]]
+    for category in range(len(sets)):
+        for symbol in sets[category]:
+            symbol = sys.intern(symbol)
+            first = table.setdefault(symbol, category)
+            if first != category:
+                conflicts.append((symbol, first, category))
+    return table, conflicts
+
 #Check validity of supplied input file
 def check_validity(file_contents):
     #Check all necessary elements are present in equality, connectives, and quantifiers sets
     #Variable, constant, and predicate sets may be empty
     if len(file_contents[3]) != 1:
-        print("Incorrect cardinality; exactly 1 equality symbol must be supplied.")
-        append_log("ERR", "Incorrect cardinality; exactly 1 equality symbol must be supplied.")
+        report_error("Incorrect cardinality; exactly 1 equality symbol must be supplied.")
         return False
     
     if len(file_contents[4]) != 5:
-        print("Incorrect cardinality; exactly 5 logical connectives must be supplied.")
-        append_log("ERR", "Incorrect cardinality; exactly 5 logical connectives must be supplied.")
+        report_error("Incorrect cardinality; exactly 5 logical connectives must be supplied.")
         return False
 
     if len(file_contents[5]) != 2:
-        print("Incorrect cardinality; exactly 2 quantifiers must be supplied.")
-        append_log("ERR", "Incorrect cardinality; exactly 2 quantifiers must be supplied.")
+        report_error("Incorrect cardinality; exactly 2 quantifiers must be supplied.")
         return False
     
     #Check that arity of predicates is an int and convert type str to int
@@ -242,274 +480,163 @@ def check_validity(file_contents):
         try:
             predicate[1] = int(predicate[1])
         except:
-            print("Supplied predicate arity is not an integer.")
-            append_log("ERR", "Supplied predicate arity is not an integer.")
+            report_error("Supplied predicate arity is not an integer.")
             return False
 
-    #Check for duplicates within individual sets
+    #Check for duplicates within individual sets; every problem from here on is reported before returning
+    valid = True
     #Variables
     if len(file_contents[0]) != len(set(file_contents[0])):
-        print("Detected duplicate variables.")
-        append_log("ERR", "Detected duplicate variables.")
-        return False
+        report_error("Detected duplicate variables.")
+        valid = False
     #Constants
     if len(file_contents[1]) != len(set(file_contents[1])):
-        print("Detected duplicate constants.")
-        append_log("ERR", "Detected duplicate constants.")
-        return False
+        report_error("Detected duplicate constants.")
+        valid = False
     #Predicate symbols
     if len(file_contents[7]) != len(set(file_contents[7])):
-        print("Detected duplicate predicate symbols.")
-        append_log("ERR", "Detected duplicate predicate symbols.")
-        return False
+        report_error("Detected duplicate predicate symbols.")
+        valid = False
     #Connectives
     if len(file_contents[4]) != len(set(file_contents[4])):
-        print("Detected duplicate connectives.")
-        append_log("ERR", "Detected duplicate connectives.")
-        return False
+        report_error("Detected duplicate connectives.")
+        valid = False
     #Quantifiers
     if len(file_contents[5]) != len(set(file_contents[5])):
-        print("Detected duplicate connectives.")
-        append_log("ERR", "Detected duplicate connectives.")
-        return False
-
+        report_error("Detected duplicate quantifiers.")
+        valid = False
 
     #Check for duplicate variables, constants, predicate symbols, quantifiers, connectives, equality across all sets
-    for variable in file_contents[0]:
-        #Var in constants
-        if variable in file_contents[1]:
-            print("Found a duplicate in variables and constants: ", variable)
-            append_log("ERR", "Found a duplicate in variables and constants: " + variable)
-            return False
-        #Var in predicate symbols
-        elif variable in file_contents[7]:
-            print("Found a duplicate in variables and predicate symbols: ", variable)
-            append_log("ERR", "Found a duplicate in variables and predicate symbols: " + variable)
-            return False
-        #Var in quantifiers
-        elif variable in file_contents[5]: 
-            print("Found a duplicate in variables and quantifiers: ", variable)
-            append_log("ERR", "Found a duplicate in variables and quantifers: " + variable)
-            return False
-        #Var in connectives
-        elif variable in file_contents[4]: 
-            print("Found a duplicate in variables and connectives: ", variable)
-            append_log("ERR", "Found a duplicate in variables and connectives: " + variable)
-            return False
-        #Var in equality
-        elif variable in file_contents[3]: 
-            print("Found a duplicate in variables and equality: ", variable)
-            append_log("ERR", "Found a duplicate in variables and equality: " + variable)
-            return False
+    table, conflicts = build_symbol_table(file_contents)
+    for symbol, first, second in conflicts:
+        report_error("Found a duplicate in " + CATEGORY_NAMES[first] + " and " + CATEGORY_NAMES[second] + ": " + symbol)
+        valid = False
 
-    for constant in file_contents[1]:
-        #Constant in predicate symbols
-        if constant in file_contents[7]:
-            print("Found a duplicate in constants and predicate symbols: ", constant)
-            append_log("ERR", "Found a duplicate in constants and predicate symbols: " + constant)
-            return False
-        #Constant in quantifiers
-        elif constant in file_contents[5]: 
-            print("Found a duplicate in constants and quantifiers: ", constant)
-            append_log("ERR", "Found a duplicate in constants and quantifers: " + constant)
-            return False
-        #Constant in connectives
-        elif constant in file_contents[4]: 
-            print("Found a duplicate in constants and connectives: ", constant)
-            append_log("ERR", "Found a duplicate in constants and connectives: " + constant)
-            return False
-        #Constant in equality
-        elif constant in file_contents[3]: 
-            print("Found a duplicate in constants and equality: ", constant)
-            append_log("ERR", "Found a duplicate in constants and equality: " + constant)
-            return False
-    
-    for predsymbol in file_contents[7]:
-        #Predicate symbols in quantifiers
-        if predsymbol in file_contents[5]: 
-            print("Found a duplicate in predicate symbols and quantifiers: ", predsymbol)
-            append_log("ERR", "Found a duplicate in predicate symbols and quantifers: " + predsymbol)
-            return False
-        #Predicate symbols in connectives
-        elif predsymbol in file_contents[4]: 
-            print("Found a duplicate in predicate symbols and connectives: ", predsymbol)
-            append_log("ERR", "Found a duplicate in predicate symbols and connectives: " + predsymbol)
-            return False
-        #Predicate symbols in equality
-        elif predsymbol in file_contents[3]: 
-            print("Found a duplicate in predicate symbols and equality: ", predsymbol)
-            append_log("ERR", "Found a duplicate in predicate symbols and equality: " + predsymbol)
-            return False
-
-    for quantifier in file_contents[5]:
-        #Quantifiers in connectives
-        if quantifier in file_contents[4]: 
-            print("Found a duplicate in quantifiers and connectives: ", quantifier)
-            append_log("ERR", "Found a duplicate in quantifiers and connectives: " + quantifier)
-            return False
-        #Quantifiers in equality
-        elif quantifier in file_contents[3]: 
-            print("Found a duplicate in quantifiers and equality: ", quantifier)
-            append_log("ERR", "Found a duplicate in quantifiers and equality: " + quantifier)
-            return False
-    
-    for connective in file_contents[4]: 
-        #Connectives in equality
-        if connective in file_contents[3]: 
-            print("Found a duplicate in connectives and equality: ", connective)
-            append_log("ERR", "Found a duplicate in connectives and equality: " + connective)
-            return False
-    
     #Check if any variables, constants, predicate symbols, quantifiers, equality, connectives are forbidden symbols
-    for variable in file_contents[0]:
-        if variable in ["(", ")", ","]:
-            print("Variable cannot be one of '(', ')', or ',' ")
-            append_log("ERR", "Variable cannot be one of '(', ')', or ',' ")
-            return False
-    for constant in file_contents[1]:
-        if constant in ["(", ")", ","]:
-            print("Constant cannot be one of '(', ')', or ',' ")
-            append_log("ERR", "Constant cannot be one of '(', ')', or ',' ")
-            return False
-    for predicate_symbol in file_contents[7]:
-        if predicate_symbol in ["(", ")", ","]:
-            print("Predicate symbols cannot be one of '(', ')', or ',' ")
-            append_log("ERR", "Predicate symbol cannot be one of '(', ')', or ',' ")
-            return False
-    for quantifier in file_contents[5]:
-        if quantifier in ["(", ")", ","]:
-            print("Quantifiers cannot be one of '(', ')', or ',' ")
-            append_log("ERR", "Quantifier cannot be one of '(', ')', or ',' ")
-            return False
-    for connective in file_contents[4]:
-        if connective in ["(", ")", ","]:
-            print("Connectives cannot be one of '(', ')', or ',' ")
-            append_log("ERR", "Connective cannot be one of '(', ')', or ',' ")
-            return False
-    for equality in file_contents[3]:
-        if equality in ["(", ")", ","]:
-            print("Equality cannot be one of '(', ')', or ',' ")
-            append_log("ERR", "Equality cannot be one of '(', ')', or ',' ")
-            return False
+    for symbol in ["(", ")", ","]:
+        if symbol in table:
+            report_error(FORBIDDEN_MESSAGES[table[symbol]])
+            valid = False
 
-    #If input file contents are valid, return True 
-    return True 
+    #If input file contents are valid, keep the symbol table for the parser and return True
+    if valid:
+        file_contents[9] = table
+    return valid
 
-parsed = parse_input(read_input(IN_FILE))
+#Outcome of checking a signature, kept for reuse by specs with the same signature: validity, the errors reported,
+#and for a valid signature the symbol table, the Parser's token kinds table, predicate symbols and arities
+class Signature():
+    def __init__(self, file_contents, valid, errors):
+        self.valid = valid
+        self.errors = errors
+        self.table = file_contents[9]
+        self.kinds = None
+        if valid:
+            self.predicates = [predicate[0] for predicate in file_contents[2]]
+            self.arities = dict(file_contents[2])
+            self.kinds = token_kinds(file_contents[0], file_contents[1], file_contents[4], self.predicates, file_contents[5], file_contents[3])
 
-#If supplied input file is valid, generate corresponding grammar 
-def generate_grammar(file_contents, OUT_FILE_GRAMMAR, IN_FILE):
+#Signatures checked most recently, so a long-running process (see serve) checks each signature once
+SIGNATURE_CACHE_SIZE = 64
+_signatures = OrderedDict()
+_signatures_lock = threading.Lock()
+
+#check_validity through the signature cache; returns the Signature of parsed input, whose errors were reported
+def check_signature(file_contents):
+    key = signature_key(file_contents) + (tuple(predicate[1] for predicate in file_contents[2]),)
+    with _signatures_lock:
+        signature = _signatures.get(key)
+        if signature != None:
+            _signatures.move_to_end(key)
+    if signature != None:
+        for msg in signature.errors:
+            report_error(msg)
+        if signature.valid:
+            for predicate in file_contents[2]:
+                predicate[1] = int(predicate[1])
+            file_contents[9] = signature.table
+        return signature
+    #Collect the errors of this check apart, so they can be replayed on a later hit
+    errors = getattr(_context, "errors", None)
+    _context.errors = []
+    try:
+        valid = check_validity(file_contents)
+        found = _context.errors
+    finally:
+        _context.errors = errors
+    if errors is not None:
+        errors.extend(found)
+    signature = Signature(file_contents, valid, found)
+    with _signatures_lock:
+        _signatures[key] = signature
+        if len(_signatures) > SIGNATURE_CACHE_SIZE:
+            _signatures.popitem(last=False)
+    return signature
+
+#Formal grammar of a signature; independent of the formula, so it is built once per signature (see grammar_for)
+#and only the name of the input file is filled in when it is rendered
+class Grammar():
     intro = ["A formal grammar is defined as a quadruple (V_t, V_n, P, S), where:","- V_t is a set of terminal symbols","- V_n is a set of non-terminal symbols","- P is set of production rules","- S is the start symbol, which is a non-terminal" ]
-    with open(OUT_FILE_GRAMMAR, "a") as output:
-        for line in intro:
-            output.write(line)
-            output.write("\n")
-        output.write("\n")
-        intro2 = "See program documentation for meaning of each non-terminal symbol in the grammar below. The formal grammar for the supplied input file, " + str(IN_FILE) + ", is defined by the sets V_t, V_n, P, and S as follows:\n"
-        output.write(intro2)
-        output.write("\n")
-        terminals = "V_t = {"
-        for variable in file_contents[0]:
-            variable = variable.replace("\\\\", "\\")  
-            var_str = variable + ", "
-            terminals += var_str
-        for constant in file_contents[1]:
-            constant = constant.replace("\\\\", "\\")  
-            const_str = constant + ", "
-            terminals += const_str
-        for predicate_symbol in file_contents[2]:
-            predicate_symbol[0] =  predicate_symbol[0].replace("\\\\", "\\")  
-            pred_str = predicate_symbol[0] + ", "
-            terminals += pred_str
-        for connective in file_contents[4]:
-            connective = connective.replace("\\\\", "\\")  
-            conn_str = connective + ", "
-            terminals += conn_str
-        for quantifier in file_contents[5]:
-            quantifier = quantifier.replace("\\\\", "\\")  
-            quant_str = quantifier + ", "
-            terminals += quant_str
-        for equality in file_contents[3]:
-            equality = equality.replace("\\\\", "\\")  
-            equality_str = equality
-            terminals += equality
-
-
-        output.write(terminals+"}\n\n")
-        non_terminals = "V_n = {F*, P*, Z*, T*, V*, C*, K*, Q*, J*}\n\n"
-        output.write(non_terminals)
-        productions = ["F* -> ( F* C* F* ) | Q* V* F* | "+ file_contents[4][4].replace("\\\\", "\\") +" F* | ( T* "+ file_contents[3][0].replace("\\\\", "\\") + " T* ) | P*",
+    non_terminals = "V_n = {F*, P*, Z*, T*, V*, C*, K*, Q*, J*}"
+    start = "S = {F*}"
+
+    #signature is (variables, constants, predicate symbols, equality, connectives, quantifiers), as escaped tokens
+    def __init__(self, signature):
+        variables, constants, predicates, equality, connectives, quantifiers = [[symbol.replace("\\\\", "\\") for symbol in section] for section in signature]
+        self.terminals = "V_t = {" + "".join(symbol + ", " for symbol in variables + constants + predicates + connectives + quantifiers) + "".join(equality) + "}"
+        self.productions = ["F* -> ( F* C* F* ) | Q* V* F* | " + connectives[4] + " F* | ( T* " + equality[0] + " T* ) | P*",
         "T* -> V* | K*",
-        "C* -> ", 
-        "Q* -> ", 
+        "C* -> " + " | ".join(connectives),
+        "Q* -> " + " | ".join(quantifiers),
         "P* -> Z* ( J* )",
         "J* -> V* | V* , J*",
-        "Z* -> ", 
-        "K* -> ", 
-        "V* -> "]
-        i = 0
-        for connective in file_contents[4]:
-            connective = connective.replace("\\\\", "\\")
-            num = len(file_contents[4])
-            if i < num-1:
-                conn_str = connective + " | "
-                productions[2] += conn_str
-                i += 1
-            else:
-                productions[2] += connective
-        i = 0
-        for quantifier in file_contents[5]:
-            quantifier = quantifier.replace("\\\\", "\\")
-            num = len(file_contents[5])
-            if i < num-1:
-                quant_str = quantifier + " | "
-                productions[3] += quant_str
-                i += 1
-            else:
-                productions[3] += quantifier
-        i = 0
-        for predicate_symbol in file_contents[2]:
-            predicate_symbol[0] = predicate_symbol[0].replace("\\\\", "\\")
-            num = len(file_contents[2])
-            if i < num-1:
-                pred_str = predicate_symbol[0] + " | "
-                productions[6] += pred_str
-                i += 1
-            else:
-                productions[6] += predicate_symbol[0]
-        i = 0
-        for constant in file_contents[1]:
-            constant = constant.replace("\\\\", "\\")
-            num = len(file_contents[1])
-            if i < num-1:
-                const_str = constant + " | "
-                productions[7] += const_str
-                i += 1
-            else:
-                productions[7] += constant
-        i = 0
-        for variable in file_contents[0]:
-            variable = variable.replace("\\\\", "\\")
-            num = len(file_contents[0])
-            if i < num-1:
-                var_str = variable + " | "
-                productions[8] += var_str
-                i += 1
-            else:
-                productions[8] += variable
-        #Format the grammar for writing in a text file        
-        output.write("P = {\n\n")
-        for line in productions:
-            output.write(line)
-            output.write("\n")
-        output.write("\n}\n")
-        start = "S = {F*}\n"
-        output.write("\n")
-        output.write(start)
+        "Z* -> " + " | ".join(predicates),
+        "K* -> " + " | ".join(constants),
+        "V* -> " + " | ".join(variables)]
+        #Text before and after the input file name
+        self.head = "\n".join(self.intro) + "\n\nSee program documentation for meaning of each non-terminal symbol in the grammar below. The formal grammar for the supplied input file, "
+        self.tail = "".join([", is defined by the sets V_t, V_n, P, and S as follows:\n\n", self.terminals, "\n\n", self.non_terminals, "\n\nP = {\n\n", "\n".join(self.productions), "\n\n}\n\n", self.start, "\n"])
+
+    def render(self, IN_FILE):
+        return self.head + str(IN_FILE) + self.tail
+
+#Grammars of the most recently used signatures, so specs sharing a signature build their grammar once
+GRAMMAR_CACHE_SIZE = 64
+_grammars = OrderedDict()
+_grammars_lock = threading.Lock()
+
+#Signature of parsed input as a hashable key
+def signature_key(file_contents):
+    return (tuple(file_contents[0]), tuple(file_contents[1]), tuple(predicate[0] for predicate in file_contents[2]), tuple(file_contents[3]), tuple(file_contents[4]), tuple(file_contents[5]))
+
+#Grammar of the signature of parsed input, from the in-memory cache when the signature was seen recently
+def grammar_for(file_contents):
+    key = signature_key(file_contents)
+    with _grammars_lock:
+        grammar = _grammars.get(key)
+        if grammar != None:
+            _grammars.move_to_end(key)
+            return grammar
+    grammar = Grammar(key)
+    with _grammars_lock:
+        _grammars[key] = grammar
+        if len(_grammars) > GRAMMAR_CACHE_SIZE:
+            _grammars.popitem(last=False)
+    return grammar
+
+#Grammar text for the supplied input file
+def render_grammar(file_contents, IN_FILE):
+    return grammar_for(file_contents).render(IN_FILE)
+
+#Write the grammar for the supplied input file to OUT_FILE_GRAMMAR
+def generate_grammar(file_contents, OUT_FILE_GRAMMAR, IN_FILE):
+    with open(OUT_FILE_GRAMMAR, "a") as output:
+        output.write(render_grammar(file_contents, IN_FILE))
     return True
 
     
-#Check validity of supplied FO formula - parenthese and predicate arity
+#Check validity of supplied FO formula - parenthese and predicate arity. Standalone pass over a token list; the
+#compile functions make the same checks while parsing
 def check_formula(file_contents):
     raw_formula = file_contents[6]
     valid_formula = []
@@ -527,20 +654,17 @@ def check_formula(file_contents):
             for entry in file_contents[2]:
                 if entry[0] == predicate:
                     arity = entry[1]
-            if raw_formula[i+1] != "(":
+            if i+1 >= len(raw_formula) or raw_formula[i+1] != "(":
             #The next symbol must be an opening parenthese
-                print("Predicate symbol must be directly followed by opening parenthese; incorrect arity")
-                append_log("ERR", "Predicate symbol must be directly followed by opening parenthese; incorrect arity")
+                report_error("Predicate symbol must be directly followed by opening parenthese; incorrect arity")
                 return False
             #The final symbol must be a closing parenthese
             try:
                 if raw_formula[i+(2*arity)+1] != ")":
-                    print("Predicate symbol must conclude with a closing parenthese; incorrect arity")
-                    append_log("ERR", "Predicate symbol must conclude with a closing parenthese; incorrect arity")
+                    report_error("Predicate symbol must conclude with a closing parenthese; incorrect arity")
                     return False
             except:
-                print("Predicate used in formula with incorrect arity")
-                append_log("ERR", "Predicate used in formula with incorrect arity")
+                report_error("Predicate used in formula with incorrect arity")
                 return False
             #Followed by variables, separated by commas, of correct arity associated with that predicate symbol
             j = 0 
@@ -549,8 +673,7 @@ def check_formula(file_contents):
                 try:
                     if raw_formula[i+1+j] != ")":
                         if raw_formula[i+1+j] == "," and comma == 1:
-                            print("Commas must alternate with variables")
-                            append_log("ERR", "Commas must alternate with variables")
+                            report_error("Commas must alternate with variables")
                             return False
 
                         elif raw_formula[i+1+j] == "," and comma == 0:
@@ -558,30 +681,488 @@ def check_formula(file_contents):
                         else: 
                             comma = 0
                     else: 
-                        print("Predicate used in formula with incorrect arity")
-                        append_log("ERR", "Predicate used in formula with incorrect arity")
+                        report_error("Predicate used in formula with incorrect arity")
                         return False 
                     j += 1
                 except:
-                    print("Predicate used in formula with incorrect arity")
-                    append_log("ERR", "Predicate used in formula with incorrect arity")
+                    report_error("Predicate used in formula with incorrect arity")
                     return False
         i +=1
     #Check parentheses match up
     if open_parenth != close_parenth:
-        print("Opening and closing parentheses in supplied formula do not match.")
-        append_log("ERR", "Opening and closing parentheses in supplied formula do not match.")
-        sys.exit(1)
+        report_error("Opening and closing parentheses in supplied formula do not match.")
+        return False
     #If parenthese and arity checks passed, return True 
     return True
 
-#Recursive descent parser
+#Raised to abandon a streamed formula once an error has been reported for it
+class FormulaError(ValueError):
+    pass
+
+#Pass the tokens of a streamed formula through, rejecting the EOF symbol "$"
+def forbid_eof_symbol(tokens):
+    for token in tokens:
+        if token == "$":
+            report_error("$ is a forbidden input symbol; denotes end of file character")
+            raise FormulaError(token)
+        yield token
+
+#Token stream over a token iterator for the Parser; keeps a short window of tokens around the current position
+#so memory does not grow with the length of the formula. Ends with the EOF symbol "$"
+class TokenStream():
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.window = deque()
+        #Index of the first token held in window
+        self.base = 0
+        self.exhausted = False
+
+    def __getitem__(self, index):
+        #The Parser looks at most two tokens behind the furthest token it has requested
+        while self.base < index - 2 and self.window:
+            self.window.popleft()
+            self.base += 1
+        while index - self.base >= len(self.window):
+            if self.exhausted:
+                raise IndexError(index)
+            try:
+                self.window.append(next(self.tokens))
+            except StopIteration:
+                self.window.append("$")
+                self.exhausted = True
+        return self.window[index - self.base]
+
+#Kind codes the Parser branches on; the signature kinds share their codes with the symbol table categories
+KIND_VARIABLE = CAT_VARIABLE
+KIND_CONSTANT = CAT_CONSTANT
+KIND_PREDICATE = CAT_PREDICATE
+KIND_QUANTIFIER = CAT_QUANTIFIER
+#Binary connectives; the negation connective (connectives[4]) has its own kind
+KIND_CONNECTIVE = CAT_CONNECTIVE
+KIND_EQUALITY = CAT_EQUALITY
+KIND_NEGATION = 6
+KIND_LEFT = 7
+KIND_RIGHT = 8
+KIND_COMMA = 9
+KIND_EOF = 10
+KIND_UNKNOWN = 11
+
+#Map every symbol of the signature, the punctuation terminals and the EOF symbol to its kind code
+def token_kinds(variables, constants, connectives, predicates, quantifiers, equality):
+    table = dict.fromkeys(variables, KIND_VARIABLE)
+    table.update(dict.fromkeys(constants, KIND_CONSTANT))
+    table.update(dict.fromkeys(predicates, KIND_PREDICATE))
+    table.update(dict.fromkeys(quantifiers, KIND_QUANTIFIER))
+    table.update(dict.fromkeys(connectives[:4], KIND_CONNECTIVE))
+    table.update(dict.fromkeys(connectives[4:], KIND_NEGATION))
+    table.update(dict.fromkeys(equality, KIND_EQUALITY))
+    table["("] = KIND_LEFT
+    table[")"] = KIND_RIGHT
+    table[","] = KIND_COMMA
+    table["$"] = KIND_EOF
+    return table
+
+#Kind codes of the tokens of a TokenStream, classified as the Parser reaches them
+class StreamKinds():
+    def __init__(self, tokenstream, table):
+        self.tokenstream = tokenstream
+        self.table = table
+
+    def __getitem__(self, index):
+        return self.table.get(self.tokenstream[index], KIND_UNKNOWN)
+
+#Node kinds of a ParseTree: the non-terminals of the grammar, then NODE_TERMINAL plus the token kind of a terminal
+NODE_F = 0
+NODE_T = 1
+NODE_C = 2
+NODE_Q = 3
+NODE_P = 4
+NODE_Z = 5
+NODE_K = 6
+NODE_V = 7
+NODE_TERMINAL = 8
+NODE_LABELS = ["F*", "T*", "C*", "Q*", "P*", "Z*", "K*", "V*"]
+
+#Nodes written by the tree serializers between two writes to the output
+SERIALIZE_BLOCK = 1<<16
+#Characters that make an S-expression atom need quotes
+SEXP_QUOTE_RE = re.compile(r'[\s()";\\]')
+
+#Compact parse tree. Nodes are numbered in preorder and described by parallel arrays: kind, sym (index of the
+#interned symbol of a terminal in symbols, -1 for a non-terminal), pos (position in the token stream when the node
+#was created) and end (one past the last node of its subtree, so the subtree of i is the range i to end[i])
+class ParseTree():
+    __slots__ = ("kind", "sym", "pos", "end", "symbols", "symbol_ids")
+
+    def __init__(self):
+        self.kind = array("B")
+        self.sym = array("l")
+        self.pos = array("l")
+        self.end = array("l")
+        self.symbols = []
+        self.symbol_ids = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    #Append a node, returning its index; a non-terminal stays open until closed by close()
+    def add(self, kind, pos, symbol=None):
+        index = len(self.kind)
+        if symbol == None:
+            sym = -1
+        else:
+            sym = self.symbol_ids.get(symbol)
+            if sym == None:
+                sym = self.symbol_ids[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        self.kind.append(kind)
+        self.sym.append(sym)
+        self.pos.append(pos)
+        self.end.append(index + 1)
+        return index
+
+    #Close the subtree of index after its last descendant has been added
+    def close(self, index):
+        self.end[index] = len(self.kind)
+
+    #Label of a node: the non-terminal (F*, T*, ...) or the symbol of a terminal
+    def label(self, index):
+        kind = self.kind[index]
+        if kind < NODE_TERMINAL:
+            return NODE_LABELS[kind]
+        return self.symbols[self.sym[index]]
+
+    def children(self, index):
+        child = index + 1
+        end = self.end[index]
+        while child < end:
+            yield child
+            child = self.end[child]
+
+    #Serialize to bytes: a JSON line holding the symbols and array item sizes, then the raw arrays
+    def to_bytes(self):
+        header = {"symbols": self.symbols, "nodes": len(self.kind), "itemsize": self.sym.itemsize}
+        return json.dumps(header).encode() + b"\n" + self.kind.tobytes() + self.sym.tobytes() + self.pos.tobytes() + self.end.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        header, _, body = data.partition(b"\n")
+        header = json.loads(header)
+        tree = cls()
+        nodes = header["nodes"]
+        if header["itemsize"] != tree.sym.itemsize:
+            raise ValueError("parse tree serialized with a different array item size")
+        tree.kind.frombytes(body[:nodes])
+        offset = nodes
+        for column in (tree.sym, tree.pos, tree.end):
+            size = nodes * column.itemsize
+            column.frombytes(body[offset:offset+size])
+            offset += size
+        tree.symbols = header["symbols"]
+        tree.symbol_ids = {symbol: index for index, symbol in enumerate(tree.symbols)}
+        return tree
+
+    #Label id of every node: its kind for non-terminals, NODE_TERMINAL plus its symbol for terminals. Serializers
+    #format each distinct label once and index the formatted strings by label id
+    def label_ids(self):
+        return [kind if kind < NODE_TERMINAL else NODE_TERMINAL + sym for kind, sym in zip(self.kind, self.sym)]
+
+    def distinct_labels(self):
+        return NODE_LABELS[:NODE_TERMINAL] + self.symbols
+
+    #Write the tree in one preorder pass over the arrays: opening[label id] starts a node with children, leaf[label id]
+    #is a node without, separator goes between siblings and closing ends the children of a node. Output is
+    #buffered in blocks of about SERIALIZE_BLOCK nodes
+    def write_nested(self, out, opening, leaf, separator, closing):
+        end = self.end
+        parts = []
+        ends = []
+        for index, label in enumerate(self.label_ids()):
+            while ends and ends[-1] == index:
+                ends.pop()
+                parts.append(closing)
+            if index and end[index - 1] <= index:
+                parts.append(separator)
+            if end[index] > index + 1:
+                parts.append(opening[label])
+                ends.append(end[index])
+            else:
+                parts.append(leaf[label])
+            if len(parts) >= SERIALIZE_BLOCK:
+                out.write("".join(parts))
+                parts = []
+        parts.append(closing * len(ends))
+        out.write("".join(parts))
+
+    #Write the tree as DOT text to the file object out; same output as anytree's DotExporter with the node labels
+    #as label attributes, so node names are the label and the preorder index
+    def write_dot(self, out):
+        labels = self.distinct_labels()
+        names = ['    "' + label.replace("\\", "\\\\").replace('"', '\\"') + "_" for label in labels]
+        attributes = ['" [label="' + label.replace('"', '\\"') + '"];\n' for label in labels]
+        ids = self.label_ids()
+        end = self.end
+        out.write("digraph tree {\n")
+        parts = []
+        for index, label in enumerate(ids):
+            parts.append(names[label])
+            parts.append(str(index))
+            parts.append(attributes[label])
+            if len(parts) >= SERIALIZE_BLOCK:
+                out.write("".join(parts))
+                parts = []
+        for index, label in enumerate(ids):
+            if end[index] > index + 1:
+                edge = names[label] + str(index) + '" -> "'
+                for child in self.children(index):
+                    parts.append(edge)
+                    parts.append(names[ids[child]][5:])
+                    parts.append(str(child))
+                    parts.append('";\n')
+                if len(parts) >= SERIALIZE_BLOCK:
+                    out.write("".join(parts))
+                    parts = []
+        parts.append("}\n")
+        out.write("".join(parts))
+
+    #Write the tree as nested JSON objects {"label": ..., "children": [...]}; terminals have no children
+    def write_json(self, out):
+        labels = [json.dumps(label.replace("\\\\", "\\")) for label in self.distinct_labels()]
+        self.write_nested(out, ['{"label":' + label + ',"children":[' for label in labels], ['{"label":' + label + '}' for label in labels], ",", "]}")
+        out.write("\n")
+
+    #Write the tree as an S-expression: (F* (Q* A) (V* x) ...); terminals are atoms, quoted when they contain
+    #whitespace, parentheses, quotes or semicolons
+    def write_sexp(self, out):
+        labels = []
+        for label in self.distinct_labels():
+            label = label.replace("\\\\", "\\")
+            if SEXP_QUOTE_RE.search(label) or not label:
+                label = '"' + label.replace("\\", "\\\\").replace('"', '\\"') + '"'
+            labels.append(label)
+        self.write_nested(out, ["(" + label + " " for label in labels], labels, " ", ")")
+        out.write("\n")
+
+    #Build the equivalent anytree tree for visualization; each anytree Node has the label of its node as id and is
+    #named after the label and its preorder index, so names are unique and exports reproducible
+    def to_anytree(self):
+        from anytree import Node
+        nodes = []
+        for index in range(len(self.kind)):
+            label = self.label(index)
+            nodes.append(Node(label+"_"+str(index), id = label))
+        #Attach children in reverse preorder, so a node is still detached when it receives its children and
+        #anytree's loop check does not walk up the tree
+        for index in range(len(nodes) - 1, -1, -1):
+            if self.end[index] > index + 1:
+                nodes[index].children = [nodes[child] for child in self.children(index)]
+        return nodes[0] if nodes else None
+
+#Hash-consed parse trees: structurally identical subtrees, within a formula or across formulas, are interned as a
+#single node, so memory grows with the number of distinct subformulas and two subtrees are equal exactly when their
+#node ids are. A node is its key, the tuple (kind, sym, child, child, ...) with kind and sym as in ParseTree, and
+#size, the number of ParseTree nodes it stands for. Nodes are reference counted: every parent holds a reference to
+#each of its children and make() returns a reference owned by the caller, given back with release(); a node is
+#freed, and its id reused, when its last reference goes. add() and close() build nodes as the Parser parses, in place
+#of a ParseTree; the last node closed at the top level is root
+class FormulaDAG():
+    __slots__ = ("keys", "size", "refs", "table", "free", "symbols", "symbol_ids", "open", "root")
+
+    def __init__(self):
+        self.keys = []
+        self.size = array("q")
+        self.refs = array("l")
+        #Key of every live node to its id
+        self.table = {}
+        self.free = []
+        self.symbols = []
+        self.symbol_ids = {}
+        #Non-terminals being built by add(): their kind and sym followed by the ids of the children closed so far
+        self.open = []
+        self.root = -1
+
+    #Number of live distinct nodes
+    def __len__(self):
+        return len(self.table)
+
+    #Id of the node with key, creating it if there is none yet; the caller's references to the children are handed
+    #over to the node and a reference to the node is returned
+    def make(self, key):
+        node = self.table.get(key)
+        if node != None:
+            self.refs[node] += 1
+            #The existing node already holds references to its children
+            for child in key[2:]:
+                self.refs[child] -= 1
+            return node
+        size = 1
+        for child in key[2:]:
+            size += self.size[child]
+        if self.free:
+            node = self.free.pop()
+            self.keys[node] = key
+            self.size[node] = size
+            self.refs[node] = 1
+        else:
+            node = len(self.keys)
+            self.keys.append(key)
+            self.size.append(size)
+            self.refs.append(1)
+        self.table[key] = node
+        return node
+
+    #Give back a reference to node, freeing the nodes no longer referenced
+    def release(self, node):
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            self.refs[node] -= 1
+            if self.refs[node] == 0:
+                key = self.keys[node]
+                del self.table[key]
+                self.keys[node] = None
+                self.free.append(node)
+                pending.extend(key[2:])
+
+    #Same interface as ParseTree.add and ParseTree.close; a terminal is complete when added, a non-terminal when closed
+    def add(self, kind, pos, symbol=None):
+        if symbol == None:
+            self.open.append([kind, -1])
+            return len(self.open) - 1
+        sym = self.symbol_ids.get(symbol)
+        if sym == None:
+            sym = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        self.open[-1].append(self.make((kind, sym)))
+        return -1
+
+    def close(self, index):
+        node = self.make(tuple(self.open.pop()))
+        if self.open:
+            self.open[-1].append(node)
+        else:
+            self.root = node
+
+    def children(self, node):
+        return self.keys[node][2:]
+
+    #Label of a node, as ParseTree.label
+    def label(self, node):
+        kind, sym = self.keys[node][:2]
+        if kind < NODE_TERMINAL:
+            return NODE_LABELS[kind]
+        return self.symbols[sym]
+
+    #Expand the subformula of node into a ParseTree, for the serializers; token positions are not kept and read -1
+    def tree(self, node):
+        tree = ParseTree()
+        #A non-negative entry adds a node, ~index closes the non-terminal at index of the tree
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if node < 0:
+                tree.close(~node)
+                continue
+            key = self.keys[node]
+            if key[0] >= NODE_TERMINAL:
+                tree.add(key[0], -1, self.symbols[key[1]])
+            else:
+                pending.append(~tree.add(key[0], -1))
+                pending.extend(reversed(key[2:]))
+        return tree
+
+#Scope analysis of a formula: variables used outside every quantifier binding them (free), quantifiers binding a
+#variable that an enclosing quantifier already binds (shadow) and quantifiers whose formula never uses the variable
+#they bind (unused). One preorder pass over the tree: scope maps each variable to its innermost binder in scope and
+#entering a quantified formula records the binding it replaces, restored once the pass leaves the formula, so a
+#lookup costs the same at any quantifier depth. Returns (code, message, start, end) as the Parser's diagnostics
+def check_scopes(tree):
+    kind = tree.kind
+    sym = tree.sym
+    pos = tree.pos
+    end = tree.end
+    symbols = tree.symbols
+    scope = {}
+    #(end of the quantified formula, variable, binding it replaced) of the quantifiers being passed through
+    exits = []
+    #Quantifier node of each binder and the uses of its variable
+    binders = []
+    uses = []
+    found = []
+    binding = -1
+    for index in range(len(kind)):
+        while exits and exits[-1][0] <= index:
+            limit, variable, previous = exits.pop()
+            if previous == None:
+                del scope[variable]
+            else:
+                scope[variable] = previous
+        node = kind[index]
+        #F* -> Q* V* F*: the variable of V* is bound in F*
+        if node == NODE_F and end[index] > index + 1 and kind[index + 1] == NODE_Q:
+            binding = end[index + 1]
+            variable = sym[binding + 1]
+            previous = scope.get(variable)
+            if previous != None:
+                found.append(("shadow", "Quantifier binds " + symbols[variable] + ", already bound by an enclosing quantifier", pos[index + 1], pos[index + 1] + 2))
+            scope[variable] = len(binders)
+            exits.append((end[index], variable, previous))
+            binders.append(index + 1)
+            uses.append(0)
+        elif node == NODE_V and index != binding:
+            variable = sym[index + 1]
+            binder = scope.get(variable)
+            if binder == None:
+                found.append(("free", "Variable " + symbols[variable] + " is not bound by any quantifier", pos[index], pos[index] + 1))
+            else:
+                uses[binder] += 1
+    for binder, quantifier in enumerate(binders):
+        if uses[binder] == 0:
+            found.append(("unused", "Quantifier binds " + symbols[sym[end[quantifier] + 1]] + ", which its formula does not use", pos[quantifier], pos[quantifier] + 2))
+    found.sort(key=itemgetter(2))
+    return found
+
+#Actions of the Parser's explicit stack. _C to _Z match a single terminal of the named category; _RIGHT, _EQUALITY,
+#_LEFT and _RIGHT_P match a terminal inside a production and abandon the production on a mismatch. _ARITY checks the
+#number of arguments of a predicate. _CALL+op creates the non-terminal node for op before expanding it
+_C = 0
+_Q = 1
+_V = 2
+_K = 3
+_Z = 4
+_RIGHT = 5
+_EQUALITY = 6
+_LEFT = 7
+_RIGHT_P = 8
+_F = 9
+_T = 10
+_P = 11
+_J = 12
+_COMMA = 13
+_ARITY = 14
+_END = 15
+_CALL = 16
+_NODE_KINDS = [NODE_C, NODE_Q, NODE_V, NODE_K, NODE_Z, -1, -1, -1, -1, NODE_F, NODE_T, NODE_P]
+_TERMINAL_KINDS = [KIND_CONNECTIVE, KIND_QUANTIFIER, KIND_VARIABLE, KIND_CONSTANT, KIND_PREDICATE, KIND_RIGHT, KIND_EQUALITY, KIND_LEFT, KIND_RIGHT]
+_EXPECTED = ["a connective", "a quantifier", "a variable", "a constant", "a predicate symbol"]
+#Token kind each action can resume parsing at after an error, see Parser.recover
+_SYNC_KINDS = [None] * (_CALL + _CALL)
+_SYNC_KINDS[_C] = _SYNC_KINDS[_CALL+_C] = KIND_CONNECTIVE
+_SYNC_KINDS[_RIGHT] = _SYNC_KINDS[_RIGHT_P] = KIND_RIGHT
+_SYNC_KINDS[_EQUALITY] = KIND_EQUALITY
+_SYNC_KINDS[_COMMA] = KIND_COMMA
+
+#Predictive parser for the FO formula grammar written out by render_grammar; builds a ParseTree
 class Parser():
     #Initialize parser class
-    def __init__(self,tokenstream, variables, constants, connectives, predicates, quantifiers, equality):
+    #arities maps predicate symbols to their arity; when given, predicate applications are checked against it.
+    #kinds is the token_kinds table of the signature, when already built. tree receives the nodes, a new ParseTree
+    #unless given (such as a FormulaDAG)
+    def __init__(self,tokenstream, variables, constants, connectives, predicates, quantifiers, equality, arities=None, kinds=None, tree=None):
         self.tokenstream = tokenstream
-        #Append EOF to end of tokenstream
-        self.tokenstream.append("$")
+        #Append EOF to end of tokenstream; a TokenStream supplies its own
+        if not isinstance(self.tokenstream, TokenStream):
+            self.tokenstream.append("$")
 
         self.variables = variables
         self.connectives = connectives
@@ -589,253 +1170,1586 @@ class Parser():
         self.quantifiers = quantifiers
         self.equality = equality
         self.constants = constants
+        self.arities = arities
+        #Arity of the predicate being parsed, the number of arguments read so far and the position of its symbol
+        self.arity = None
+        self.arguments = 0
+        self.predicate = 0
+        #Errors found while parsing as (code, message, first token, token after the last); see Diagnostic
+        self.diagnostics = []
+
+        #Classify tokens into kind codes with a single dictionary lookup each, so the cost of a token does not
+        #depend on the size of the signature; a list is classified up front, a TokenStream as it is read
+        table = kinds
+        if table == None:
+            table = token_kinds(variables, constants, connectives, predicates, quantifiers, equality)
+        if isinstance(self.tokenstream, TokenStream):
+            self.kinds = StreamKinds(self.tokenstream, table)
+        else:
+            self.kinds = [table.get(token, KIND_UNKNOWN) for token in self.tokenstream]
 
         #Intialize position to 0 and current token to first in stream
         self.pos = 0
         self.current = self.tokenstream[self.pos]
+        self.kind = self.kinds[self.pos]
 
-        #Initialize parse tree
-        self.root = Node("F", parent=None, id = "F*")
-        self.initialroot = Node("F", parent=None, id = "F*")
+        #Initialize parse tree; its root is node 0
+        self.tree = tree if tree != None else ParseTree()
+        self.root = self.tree.add(NODE_F, self.pos)
         self.parseF(self.root)
 
-    #Parse productions of the form F -> 
+    #Move on to the next token in the stream
+    def advance(self):
+        self.pos += 1
+        self.current = self.tokenstream[self.pos]
+        self.kind = self.kinds[self.pos]
+
+    #Add the current token to the tree as a terminal and move on
+    def shift(self):
+        self.tree.add(NODE_TERMINAL + self.kind, self.pos, self.current)
+        self.advance()
+
+    #Kind of the token offset places ahead of the current one; the end of the stream reads as EOF
+    def peek(self, offset):
+        try:
+            return self.kinds[self.pos + offset]
+        except IndexError:
+            return KIND_EOF
+
+    #Record a diagnostic for the tokens start to end (exclusive) and report its message
+    def error(self, code, message, start, end=None):
+        if end == None:
+            end = start + 1
+        self.diagnostics.append((code, message, start, end))
+        report_error(message)
+
+    #Message for a predicate applied to the wrong number of arguments, worded as check_formula words it: with too
+    #many arguments a "," stands where the closing parenthese belongs
+    def arity_message(self):
+        if self.arity != None and self.arguments > self.arity:
+            return "Predicate symbol must conclude with a closing parenthese; incorrect arity"
+        return "Predicate used in formula with incorrect arity"
+
+    #Report an unexpected current token: what describes the expected symbol, code is used unless the token is
+    #undeclared or the end of the formula
+    def unexpected(self, code, what):
+        if self.kind == KIND_EOF:
+            self.error("eof", "Unexpected end of FO formula; expected " + what, self.pos, self.pos)
+        elif self.kind == KIND_UNKNOWN:
+            self.error("undeclared", "Expected " + what + " but received " + self.current + ", which is not declared in the signature", self.pos)
+        else:
+            self.error(code, "Expected " + what + " but received " + self.current, self.pos)
+
+    #Push an action onto the stack, recording its stack index in syncs if it is a synchronizing one (see recover)
+    def push(self, stack, op, node):
+        kind = _SYNC_KINDS[op]
+        if kind != None:
+            self.syncs[kind].append(len(stack))
+        stack.append((op, node))
+
+    #Panic-mode recovery after an error. The synchronizing tokens are those a pending action on the stack can
+    #consume: ")" (closing a parenthesized production), a binary connective (the C of ( F C F )), "," (the next
+    #predicate argument) and the equality symbol (of ( T = T )). Tokens are skipped, whole parenthesized groups at a
+    #time, up to the first synchronizing token or EOF; the stack is then unwound to the nearest action consuming it,
+    #closing the nodes of the abandoned productions. The next action therefore consumes a token, so recovery always
+    #makes progress. The nearest action for each token comes from syncs rather than a scan of the stack, and every
+    #action is unwound at most once, so the pass stays linear in the number of tokens however many errors there are
+    def recover(self, stack):
+        syncs = self.syncs
+        accepting = {kind: depths[-1] for kind, depths in syncs.items() if depths}
+        #A predicate whose "(" is still pending cannot be closed by a ")"; its _RIGHT_P lies three actions below the
+        #_LEFT, with no synchronizing action in between
+        rights = syncs[KIND_RIGHT]
+        if rights:
+            depth = rights[-1]
+            if stack[depth][0] == _RIGHT_P and depth + 3 < len(stack) and stack[depth + 3][0] == _LEFT:
+                if len(rights) > 1:
+                    accepting[KIND_RIGHT] = rights[-2]
+                else:
+                    del accepting[KIND_RIGHT]
+        balance = 0
+        while self.kind != KIND_EOF:
+            if balance == 0 and self.kind in accepting:
+                break
+            if self.kind == KIND_LEFT:
+                balance += 1
+            elif self.kind == KIND_RIGHT and balance > 0:
+                balance -= 1
+            self.advance()
+        #The argument count of a predicate abandoned part way is meaningless
+        self.arity = None
+        depth = accepting[self.kind] + 1 if self.kind != KIND_EOF else 0
+        while len(stack) > depth:
+            op, node = stack.pop()
+            kind = _SYNC_KINDS[op]
+            if kind != None:
+                syncs[kind].pop()
+            if op == _END:
+                self.tree.close(node)
+
+    #Parse productions of the form F -> with an explicit stack of pending actions instead of recursion, so nesting
+    #depth is bounded by memory rather than the interpreter's recursion limit. Each action is a pair (op, node) of
+    #the node the action works on; nodes are added in preorder and a node's subtree is closed by its _END action.
+    #Errors are recorded in diagnostics and parsing resumes after them (see recover), so one pass finds them all.
+    #Each synchronizing action has its stack index recorded in syncs while it is on the stack (see push and recover)
     def parseF(self, _parent):
+        tree = self.tree
+        stack = [(_END, _parent), (_F, _parent)]
+        #Stack indices of the pending actions consuming each synchronizing token kind, nearest last
+        syncs = self.syncs = {KIND_CONNECTIVE: [], KIND_RIGHT: [], KIND_EQUALITY: [], KIND_COMMA: []}
+        connectives = syncs[KIND_CONNECTIVE]
+        rights = syncs[KIND_RIGHT]
+        while stack:
+            op, node = stack.pop()
+            kind = _SYNC_KINDS[op]
+            if kind != None:
+                syncs[kind].pop()
 
-        #Parse productions of the form F -> (FCF)
-        if self.current == "(" and self.tokenstream[self.pos+2] != self.equality[0]:
-            LeftBr = Node("("+str(self.pos)+id_generator(), parent=_parent, id = "(")
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-            F= Node("F"+str(self.pos)+id_generator(), parent=_parent, id = "F*")
-            self.parseF(F)
-            C = Node("C"+str(self.pos)+id_generator(), parent=_parent, id = "C*")
-            self.parseC(C)
-            F= Node("F"+str(self.pos)+id_generator(), parent=_parent, id = "F*")
-            self.parseF(F)
-            if self.current == ")":
-                RightBr = Node(")"+str(self.pos)+id_generator(), parent=_parent, id = ")")
-                self.pos += 1
-                self.current = self.tokenstream[self.pos]
-            else:
-                msg = "Expected ')' but received " + self.current
-                print(msg)
-                append_log("ERR", msg)
-                return False
-        
-        #Parse productions of the form F -> (T=T)
-        elif self.current == "(" and self.tokenstream[self.pos+2] == self.equality[0]:
-            LeftBr = Node("("+str(self.pos)+id_generator(), parent=_parent, id = "(")
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-            T= Node("T"+str(self.pos)+id_generator(), parent=_parent, id = "T*")
-            self.parseT(T)
-
-            if self.current == self.equality[0]:
-                Eq = Node(self.equality[0]+str(self.pos)+id_generator(), parent=_parent, id = self.current)
-                self.pos += 1
-                self.current = self.tokenstream[self.pos]
+            #Create a non-terminal node and expand its production; the node is closed by an _END action
+            if op >= _CALL:
+                op -= _CALL
+                node = tree.add(_NODE_KINDS[op], self.pos)
+                stack.append((_END, node))
+
+            if op == _END:
+                tree.close(node)
+
+            #Parse productions of the form F -> 
+            elif op == _F:
+                #Parse productions of the form F -> (FCF)
+                if self.kind == KIND_LEFT and self.peek(2) != KIND_EQUALITY:
+                    self.shift()
+                    rights.append(len(stack))
+                    stack.append((_RIGHT, node))
+                    stack.append((_CALL+_F, node))
+                    connectives.append(len(stack))
+                    stack.append((_CALL+_C, node))
+                    stack.append((_CALL+_F, node))
+                #Parse productions of the form F -> (T=T)
+                elif self.kind == KIND_LEFT:
+                    self.shift()
+                    rights.append(len(stack))
+                    stack.append((_RIGHT, node))
+                    stack.append((_CALL+_T, node))
+                    self.push(stack, _EQUALITY, node)
+                    stack.append((_CALL+_T, node))
+                #Parse productions of the form F -> QVF
+                elif self.kind == KIND_QUANTIFIER:
+                    stack.append((_CALL+_F, node))
+                    stack.append((_CALL+_V, node))
+                    stack.append((_CALL+_Q, node))
+                #Parse productions of the form F -> notF
+                elif self.kind == KIND_NEGATION:
+                    self.shift()
+                    stack.append((_CALL+_F, node))
+                #The formula ends at EOF; an empty formula has always been accepted
+                elif self.kind == KIND_EOF:
+                    pass
+                #Parse productions of the form F -> P
+                else:
+                    stack.append((_CALL+_P, node))
+
+            #Parse productions of the form T (term) -> 
+            elif op == _T:
+                if self.kind == KIND_VARIABLE:
+                    stack.append((_CALL+_V, node))
+                elif self.kind == KIND_CONSTANT:
+                    stack.append((_CALL+_K, node))
+                else:
+                    self.unexpected("syntax", "a variable or constant")
+                    self.recover(stack)
+
+            #Parse productions of the form P (predicate) -> Z ( J ), checking the arity of Z as the arguments are read
+            elif op == _P:
+                if self.arities != None:
+                    self.arity = self.arities.get(self.current)
+                self.arguments = 0
+                self.predicate = self.pos
+                rights.append(len(stack))
+                stack.append((_RIGHT_P, node))
+                stack.append((_ARITY, node))
+                stack.append((_J, node))
+                stack.append((_LEFT, node))
+                stack.append((_CALL+_Z, node))
+
+            #Parse productions of the form J (variable list inside predicate) -> ; its symbols belong to the P node
+            elif op == _J:
+                self.arguments += 1
+                self.push(stack, _COMMA, node)
+                stack.append((_CALL+_V, node))
+            elif op == _COMMA:
+                if self.kind == KIND_COMMA:
+                    self.shift()
+                    stack.append((_J, node))
+            elif op == _ARITY:
+                if self.arity != None and self.kind == KIND_RIGHT and self.arguments != self.arity:
+                    self.error("arity", self.arity_message(), self.predicate, self.pos + 1)
+
+            #Parse productions of the form C (connective), Q (quantifier), V (variable), K (constant) and Z (predicate symbol) -> 
+            elif op <= _Z:
+                if self.kind == _TERMINAL_KINDS[op]:
+                    self.shift()
+                else:
+                    self.unexpected("syntax", _EXPECTED[op])
+                    #A missing connective can still be found further on
+                    if op == _C:
+                        self.push(stack, op, node)
+                    self.recover(stack)
+
+            #Match the parentheses or equality symbol of the production being parsed
+            elif self.kind == _TERMINAL_KINDS[op]:
+                self.shift()
             else:
-                msg = "Expected " + self.equality[0]+ " but received " + self.current
-                print(msg)
-                append_log("ERR", msg)
-                return False
+                end = self.pos if self.kind == KIND_EOF else self.pos + 1
+                if op == _EQUALITY:
+                    self.unexpected("syntax", self.equality[0])
+                elif op == _LEFT:
+                    self.error("parenthesis", "Predicate symbol must be directly followed by opening parenthese; incorrect arity", self.pos, end)
+                elif op == _RIGHT_P and self.kind == KIND_EOF:
+                    self.error("arity", self.arity_message(), self.predicate, end)
+                elif op == _RIGHT_P:
+                    self.error("parenthesis", "Predicate symbol must conclude with a closing parenthese; incorrect arity", self.pos)
+                elif self.kind == KIND_EOF:
+                    self.error("eof", "Opening and closing parentheses in supplied formula do not match.", self.pos, end)
+                else:
+                    self.error("parenthesis", "Expected ')' but received " + self.current, self.pos)
+                #The expected terminal may still turn up after the tokens in error
+                if op != _LEFT:
+                    self.push(stack, op, node)
+                self.recover(stack)
 
-            T= Node("T"+str(self.pos)+id_generator(), parent=_parent, id = "T*")
-            self.parseT(T)
-            if self.current == ")":
-                RightBr = Node(")"+str(self.pos)+id_generator(), parent=_parent, id = ")")
-                self.pos += 1
-                self.current = self.tokenstream[self.pos]
+        #Everything after a complete formula is in error; unbalanced parentheses there, such as an extra ")", are
+        #reported as check_formula reports them
+        if self.kind != KIND_EOF:
+            start = self.pos
+            balance = 0
+            while self.kind != KIND_EOF:
+                if self.kind == KIND_LEFT:
+                    balance += 1
+                elif self.kind == KIND_RIGHT:
+                    balance -= 1
+                self.advance()
+            if balance != 0:
+                self.error("trailing", "Opening and closing parentheses in supplied formula do not match.", start, self.pos)
             else:
-                msg = "Expected ')' but received " + self.current
-                print(msg)
-                append_log("ERR", msg)
-                return False
+                self.error("trailing", "Unexpected tokens after the end of the FO formula", start, self.pos)
 
-        #Parse productions of the form F -> QVF
-        elif self.current in self.quantifiers:
-            Q = Node("Q"+str(self.pos)+id_generator(), parent=_parent, id = "Q*")
-            self.parseQ(Q)
-            V = Node("V"+str(self.pos)+id_generator(), parent=_parent, id = "V*")
-            self.parseV(V)
-            F= Node("F"+str(self.pos)+id_generator(), parent=_parent, id = "F*")
-            self.parseF(F)
-
-        #Parse productions of the form F -> notF
-        elif self.current == self.connectives[4]:
-            NEG = Node("N"+str(self.pos)+id_generator(), parent=_parent, id = self.current)
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-            F= Node("F"+str(self.pos)+id_generator(), parent=_parent, id = "F*")
-            self.parseF(F)
-
-        #If EOF reached, check for EOF symbol and return visualization of the parsetree
-        elif self.current == "$":
-            self.check_success()
-
-        #Parse productions of the form F -> P
-        else:
-            P = Node("P"+str(self.pos)+id_generator(), parent=_parent, id = "P*")
-            self.parseP(P)
-
-     #Parse productions of the form Q (quantifier) -> 
-    def parseQ(self, Qparent):
-        if self.current in self.quantifiers:
-            Q = Node(self.current+str(self.pos)+id_generator(), parent=Qparent, id = self.current)
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
+    #Check if end of token stream reached
+    def check_success(self):
+        if self.kind == KIND_EOF and not self.diagnostics:
+            append_log("OK", "FO formula parsed successfully")
+            #Return the parse tree
+            return self.tree
         else:
-            msg = "Expected a quantifier but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
-    
-     #Parse productions of the form T (term) -> 
-    def parseT(self, Tparent):
-        if self.current in self.variables:
-            V = Node("V"+str(self.pos)+id_generator(), parent=Tparent, id = "V*")
-            self.parseV(V)
-        elif self.current in self.constants:
-            K = Node("K"+str(self.pos)+id_generator(), parent=Tparent, id = "K*")
-            self.parseK(K)
-        else: 
-            msg = "Expected a variable or constant but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
+            append_log("ERR", "Failed to parse FO formula")
             return False
 
-    #Parse productions of the form C (connective) -> 
-    def parseC(self, Cparent):
-        if self.current in [self.connectives[0],self.connectives[1],self.connectives[2],self.connectives[3]]:
-            C = Node(self.current+str(self.pos)+id_generator(), parent=Cparent, id = self.current)
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-        else:
-            msg = "Expected a connective but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
-    
-    #Parse productions of the form V (variable) -> 
-    def parseV(self, Vparent):
-        if self.current in self.variables:
-            V = Node(self.current+str(self.pos)+id_generator(), parent=Vparent, id = self.current)
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-        else:
-            msg = "Expected a variable but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
+#Outcome of compiling a single spec; returned by compile_spec and compile_file
+class Result():
+    def __init__(self, source):
+        self.source = source
+        #Sections of the spec as returned by parse_input, once read
+        self.parsed = None
+        #ParseTree of the formula and text of the grammar, once the formula parsed successfully
+        self.tree = None
+        self.grammar = None
+        #Node of the formula in the FormulaDAG it was parsed into, in place of tree (see compile_formulas)
+        self.root = None
+        self.errors = []
+        #Parse errors of the formula as Diagnostic, all found in one pass
+        self.diagnostics = []
+        self.ok = False
+        #Seconds spent in each stage: read, tokenize, validate, parse, grammar, cache
+        self.timings = {}
+        #Set by compile_cached: the spec's cache key, whether the result came from the cache and cached renders
+        self.cache_key = None
+        self.cached = False
+        self.renders = {}
 
-    #Parse productions of the form K (constant) -> 
-    def parseK(self, Kparent):
-        if self.current in self.constants:
-            K = Node(self.current+str(self.pos)+id_generator(), parent=Kparent, id = self.current)
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-        else:
-            msg = "Expected a constant but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
+    def __repr__(self):
+        return "Result(%r, ok=%r, errors=%d)" % (self.source, self.ok, len(self.errors))
+
+#Parse error of a formula. code is one of syntax, undeclared, arity, parenthesis, eof and trailing; tokens start to
+#end (exclusive) of the formula are in error, from line:col up to end_line:end_col. Positions are None for formulas
+#read from a stream, whose lines are not kept
+Diagnostic = namedtuple("Diagnostic", ["code", "message", "start", "end", "line", "col", "end_line", "end_col"])
+
+#Diagnostics for the errors (code, message, start, end) recorded by the Parser, located in the spec's lines
+def diagnostics(file_contents, errors):
+    if file_contents == None or not file_contents[8]:
+        return [Diagnostic(code, message, start, end, None, None, None, None) for code, message, start, end in errors]
+    tokens = locate_tokens(file_contents, [index for error in errors for index in (error[2], max(error[2], error[3] - 1))])
+    located = []
+    for code, message, start, end in errors:
+        first = tokens[start]
+        last = tokens[max(start, end - 1)]
+        located.append(Diagnostic(code, message, start, end, first.line, first.col, last.line, last.col + len(last.text)))
+    return located
+
+#Scope diagnostics of the formula of a compiled result, see check_scopes
+def scope_diagnostics(result):
+    return diagnostics(result.parsed, check_scopes(result.tree))
+
+#Route errors reported while compiling to the given Result; nests, so a compile can run inside another
+class _compiling():
+    def __init__(self, result, verbose):
+        self.result = result
+        self.verbose = verbose
+
+    def __enter__(self):
+        self.saved = (getattr(_context, "source", ""), getattr(_context, "errors", None), getattr(_context, "verbose", True))
+        _context.source = self.result.source
+        _context.errors = self.result.errors
+        _context.verbose = self.verbose
+        return self.result
+
+    def __exit__(self, *exc):
+        _context.source, _context.errors, _context.verbose = self.saved
+        return False
+
+#Per-phase metrics of a run: calls, wall and CPU time, items processed (lines read, tokens, signature symbols,
+#parse tree nodes) and peak memory. Peaks are traced with tracemalloc when memory is set, which slows the run down
+#and mixes phases running on concurrent threads; otherwise they are the high-water mark of the process
+class Profiler():
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.phases = {}
+        self.lock = threading.Lock()
+        if memory:
+            tracemalloc.start()
+
+    def record(self, name, wall, cpu, items, peak):
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase == None:
+                phase = self.phases[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "items": 0, "peak": 0}
+            phase["calls"] += 1
+            phase["wall"] += wall
+            phase["cpu"] += cpu
+            phase["items"] += items or 0
+            phase["peak"] = max(phase["peak"], peak or 0)
 
-    #Parse productions of the form P (predicate) -> 
-    def parseP(self, Pparent):
-        Z = Node("Z"+str(self.pos), parent=Pparent, id = "Z*")
-        self.parseZ(Z)
-        if self.current == "(":
-            LeftBr = Node(self.current+str(self.pos)+id_generator(), parent=Pparent, id = "(")
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
+    #Add the phases of another Profiler, for instance of a worker process
+    def merge(self, phases):
+        with self.lock:
+            for name, other in phases.items():
+                phase = self.phases.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "items": 0, "peak": 0})
+                for field in ("calls", "wall", "cpu", "items"):
+                    phase[field] += other[field]
+                phase["peak"] = max(phase["peak"], other["peak"])
+
+    def table(self):
+        lines = ["%-12s %8s %12s %12s %12s %14s %10s" % ("phase", "calls", "wall s", "cpu s", "items", "items/s", "peak MB")]
+        for name, phase in self.phases.items():
+            rate = phase["items"] / phase["wall"] if phase["wall"] and phase["items"] else 0
+            lines.append("%-12s %8d %12.6f %12.6f %12d %14.0f %10.1f" % (name, phase["calls"], phase["wall"], phase["cpu"], phase["items"], rate, phase["peak"] / (1024 * 1024)))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path, "w") as output:
+            json.dump({"pid": os.getpid(), "memory": "tracemalloc" if self.memory else "maxrss", "phases": self.phases}, output, indent=1)
+            output.write("\n")
+
+#Profiler of the running process while profiling is enabled; None otherwise, which is all a disabled run checks
+_profiler = None
+
+def enable_profiling(memory=False):
+    global _profiler
+    _profiler = Profiler(memory)
+    return _profiler
+
+def disable_profiling():
+    global _profiler
+    if _profiler != None and _profiler.memory:
+        tracemalloc.stop()
+    _profiler = None
+
+#High-water mark of the memory of the process in bytes, where the resource module reports it
+def peak_memory():
+    if resource == None:
+        return 0
+    #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+#Time a stage of compiling into timings, and into the Profiler when profiling; set items to the amount of work done
+class _stage():
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.items = None
+
+    def __enter__(self):
+        self.profiler = _profiler
+        if self.profiler != None:
+            self.cpu = time.thread_time()
+            if self.profiler.memory:
+                self.memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0) + elapsed
+        if self.profiler != None:
+            if self.profiler.memory:
+                peak = tracemalloc.get_traced_memory()[1] - self.memory
+            else:
+                peak = peak_memory()
+            self.profiler.record(self.name, elapsed, time.thread_time() - self.cpu, self.items, peak)
+        return False
+
+#If input file read sucessfully and passed all initial checks, feed FO formula to the parser; parentheses and
+#predicate arity are checked while parsing
+def _compile_lines(result, lines):
+    with _stage(result.timings, "tokenize") as stage:
+        parsed = parse_input(lines)
+        stage.items = len(parsed[6])
+    result.parsed = parsed
+    with _stage(result.timings, "validate") as stage:
+        signature = check_signature(parsed)
+        stage.items = signature_size(parsed)
+    if not signature.valid:
+        return result
+    #Parser appends the EOF symbol to its token stream; keep the parsed formula intact
+    tokenstream = list(parsed[6])
+
+    #Check for forbidden tokens and escape characters in the tokenstream
+    if "$" in tokenstream:
+        report_error("$ is a forbidden input symbol; denotes end of file character")
+        return result
+    return _run_parser(result, parsed, tokenstream, signature)
+
+#Run the Parser over tokenstream (a list of tokens or a TokenStream) and record the outcome on result; signature is
+#the checked Signature of parsed, grammar the grammar text when already rendered and dag a FormulaDAG to parse into
+def _run_parser(result, parsed, tokenstream, signature, grammar=None, dag=None):
+    variables = parsed[0]
+    constants = parsed[1]
+    equality = parsed[3]
+    connectives = parsed[4]
+    quantifiers = parsed[5]
+
+    #Initialize a Parser object
+    try:
+        with _stage(result.timings, "parse") as stage:
+            parsing = Parser(tokenstream, variables, constants, connectives, signature.predicates, quantifiers, equality, signature.arities, signature.kinds, dag)
+            stage.items = len(parsing.tree) if dag == None else dag.size[dag.root]
+    except IndexError:
+        report_error("Unexpected end of FO formula")
+        return result
+    except FormulaError:
+        return result
+
+    result.diagnostics = diagnostics(parsed, parsing.diagnostics)
+
+    #Parsing only succeeded if the whole stream was consumed without reporting an error
+    errors = len(result.errors)
+    tree = parsing.check_success()
+    if tree != False and errors == 0:
+        if dag != None:
+            result.root = dag.root
         else:
-            msg = "Expected '(' but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
+            result.tree = tree
+        with _stage(result.timings, "grammar"):
+            result.grammar = grammar or render_grammar(parsed, result.source)
+        result.ok = True
+    else:
+        if dag != None:
+            dag.release(dag.root)
+        report_error("Failed to generate visualization of parse tree; invalid FO formula")
+    return result
 
-        self.parseJ(Pparent)
-        if self.current == ")":
-            RightBr = Node(self.current+str(self.pos)+id_generator(), parent=Pparent, id = ")")
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
+#Compile the text of a spec; source names the spec in the log and in the generated grammar
+def compile_spec(text, source="<string>", verbose=False):
+    result = Result(source)
+    with _compiling(result, verbose):
+        return _compile_lines(result, text)
+
+#Read and compile the spec stored at path
+def compile_file(path, verbose=False):
+    result = Result(path)
+    with _compiling(result, verbose):
+        with _stage(result.timings, "read") as stage:
+            lines = read_input(path)
+            stage.items = len(lines) if lines else 0
+        if lines == False:
+            return result
+        return _compile_lines(result, lines)
+
+#Compile the spec stored at path without holding its formula in memory; tokens flow from the file (or an mmap
+#of it) into the Parser. result.parsed holds the signature only
+def compile_stream(path, use_mmap=False, verbose=False):
+    result = Result(path)
+    with _compiling(result, verbose):
+        if path[-4:] != ".txt":
+            report_error("Specified file is of an invalid format; only files with .txt extension are accepted as valid input.")
+            return result
+        try:
+            parsed, tokens = stream_spec(path, use_mmap)
+        except OSError:
+            report_error("Specified input file not found.")
+            return result
+        result.parsed = parsed
+        try:
+            with _stage(result.timings, "validate") as stage:
+                signature = check_signature(parsed)
+                stage.items = signature_size(parsed)
+            if not signature.valid:
+                return result
+            return _run_parser(result, parsed, TokenStream(forbid_eof_symbol(tokens)), signature)
+        finally:
+            tokens.close()
+
+#Compile every formula of a multi-formula spec against its signature. A formula: section holds one formula and a
+#formulas: section one formula per line. The signature is checked once; if it is invalid, a single Result holding
+#its errors is yielded. Otherwise formulas are tokenized and parsed one at a time, yielding a Result each, named
+#source:line after the line the formula starts on. All share the grammar of the spec. Given a FormulaDAG, formulas
+#are parsed into it and each Result holds the root of its formula rather than a tree
+def compile_formulas(text, source="<string>", verbose=False, dag=None):
+    result = Result(source)
+    formulas = []
+    with _compiling(result, verbose):
+        with _stage(result.timings, "tokenize"):
+            parsed = parse_input(text, formulas)
+        result.parsed = parsed
+        with _stage(result.timings, "validate") as stage:
+            signature = check_signature(parsed)
+            stage.items = signature_size(parsed)
+        if not signature.valid:
+            yield result
+            return
+        grammar = render_grammar(parsed, source)
+    for line, start, end in formulas:
+        formula = Result(source + ":" + str(line))
+        with _compiling(formula, verbose):
+            with _stage(formula.timings, "tokenize") as stage:
+                tokens, formula_lines = formula_tokens(text, start, end, line)
+                stage.items = len(tokens)
+            #The formula shares the signature of parsed; see token_position for formula_lines
+            formula.parsed = parsed[:6] + [tokens, parsed[7], formula_lines, parsed[9]]
+            if "$" in tokens:
+                report_error("$ is a forbidden input symbol; denotes end of file character")
+            else:
+                _run_parser(formula, formula.parsed, list(tokens), signature, grammar, dag)
+        yield formula
+
+#Read the spec stored at path and compile each of its formulas, see compile_formulas
+def compile_file_formulas(path, verbose=False, dag=None):
+    result = Result(path)
+    with _compiling(result, verbose):
+        lines = read_input(path)
+        if lines == False:
+            yield result
+            return
+    yield from compile_formulas("".join(lines), path, verbose, dag)
+
+#Length of the common prefix of the token lists old and new, up to limit; blocks are compared as list slices, which
+#run in C, and only the first differing block is scanned token by token
+def common_prefix(old, new, limit, block=4096):
+    length = 0
+    while length < limit:
+        step = min(block, limit - length)
+        if old[length:length+step] != new[length:length+step]:
+            while old[length] == new[length]:
+                length += 1
+            return length
+        length += step
+    return length
+
+#Length of the common suffix of the token lists old and new, up to limit; see common_prefix
+def common_suffix(old, new, limit, block=4096):
+    length = 0
+    while length < limit:
+        step = min(block, limit - length)
+        if old[len(old)-length-step:len(old)-length] != new[len(new)-length-step:len(new)-length]:
+            while old[len(old)-length-1] == new[len(new)-length-1]:
+                length += 1
+            return length
+        length += step
+    return length
+
+#Replace the subtree of the smallest F* node of tree covering the tokens that differ between old and new (lists of
+#formula tokens) with a parse of its new tokens. Nodes outside that subtree are kept, with their positions shifted;
+#the tree is updated in place. prefix and suffix, the numbers of tokens the lists share at either end, are computed
+#unless given. Returns the number of nodes parsed, or None if the edit is not confined to an F* subtree that still
+#parses on its own, in which case the tree is left untouched
+def splice_tree(tree, old, new, signature, parsed, prefix=None, suffix=None):
+    if prefix == None:
+        prefix = common_prefix(old, new, min(len(old), len(new)))
+    if prefix == len(old) == len(new):
+        return 0
+    if suffix == None:
+        suffix = common_suffix(old, new, min(len(old), len(new)) - prefix)
+    old_end = len(old) - suffix
+    shift = len(new) - len(old)
+    kind = tree.kind
+    pos = tree.pos
+    end = tree.end
+    nodes = len(kind)
+    #Descend from the root to the innermost F* whose tokens cover the change; a pure insertion at the end of an F*
+    #belongs to its parent
+    path = [0]
+    node = 0
+    while True:
+        for child in tree.children(node):
+            if kind[child] != NODE_F:
+                continue
+            first = pos[child]
+            last = pos[end[child]] if end[child] < nodes else len(old)
+            if first <= prefix and old_end <= last and (prefix < last or old_end > prefix):
+                node = child
+                path.append(child)
+                break
         else:
-            msg = "Expected ')' but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
+            break
+    first = pos[node]
+    last = pos[end[node]] if end[node] < nodes else len(old)
 
-    #Parse productions of the form J (variable list inside predicate) -> 
-    def parseJ(self, JParent):
-        V = Node("V"+str(self.pos)+id_generator(), parent=JParent, id = "V*")
-        self.parseV(V)
-        if self.current == ",":
-            Comma = Node(","+str(self.pos)+id_generator(), parent=JParent, id = ",")
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
-            self.parseJ(JParent)         
-    
-    #Parse productions of the form Z (predicate symbol) -> 
-    def parseZ(self,Zparent):
-        if self.current in self.predicates:
-            Z = Node(self.current+str(self.pos)+id_generator(), parent=Zparent, id = self.current)
-            self.pos += 1
-            self.current = self.tokenstream[self.pos]
+    #Parse the new tokens of the subtree as a formula of their own; a context free grammar with the same tokens
+    #around them parses them the same way inside the whole formula
+    with _compiling(Result("<reparse>"), False):
+        parsing = Parser(new[first:last+shift], parsed[0], parsed[1], parsed[4], signature.predicates, parsed[5], parsed[3], signature.arities, signature.kinds)
+        sub = parsing.check_success()
+    if sub == False:
+        return None
+    #An empty F* is only accepted at the end of the formula, see Parser.parseF
+    if last < len(old):
+        for index in range(len(sub)):
+            if sub.kind[index] == NODE_F and sub.end[index] == index + 1:
+                return None
+
+    #Splice the new subtree in: symbols are renumbered into the tree's symbol table, positions and ends made absolute
+    symbols = []
+    for symbol in sub.symbols:
+        sym = tree.symbol_ids.get(symbol)
+        if sym == None:
+            sym = tree.symbol_ids[symbol] = len(tree.symbols)
+            tree.symbols.append(symbol)
+        symbols.append(sym)
+    stop = end[node]
+    added = len(sub) - (stop - node)
+    kind[node:stop] = sub.kind
+    tree.sym[node:stop] = array("l", [symbols[sym] if sym >= 0 else -1 for sym in sub.sym])
+    pos[node:] = array("l", map(first.__add__, sub.pos)) + (array("l", map(shift.__add__, pos[stop:])) if shift else pos[stop:])
+    end[node:] = array("l", map(node.__add__, sub.end)) + (array("l", map(added.__add__, end[stop:])) if added else end[stop:])
+    for ancestor in path[:-1]:
+        end[ancestor] += added
+    return len(sub)
+
+#Compile text, an edited version of the spec of previous, reparsing only what changed. When the signature is the
+#same and previous parsed, the formula lines of previous (file_contents[8]) are matched against those of text from
+#either end, only the lines in between are tokenized and the tokens they changed are spliced into the tree of
+#previous (see splice_tree), so tokenizing and parsing follow the size of the edit rather than of the formula. The
+#tree keeps absolute token positions, so those after the edit are still shifted, in one pass over the arrays.
+#Otherwise the spec is compiled in full, as it is when previous holds no tokens to match against (a result answered
+#from a CompileCache may not). The tree is handed over: previous.tree is cleared once it is reused
+def reparse(previous, text, verbose=False):
+    if previous.parsed == None:
+        return compile_spec(text, previous.source, verbose)
+    result = Result(previous.source)
+    with _compiling(result, verbose):
+        #The signature only; the formula is located, not tokenized
+        formulas = []
+        with _stage(result.timings, "tokenize"):
+            parsed = parse_input(text, formulas)
+        with _stage(result.timings, "validate") as stage:
+            signature = check_signature(parsed)
+            stage.items = signature_size(parsed)
+        if not signature.valid:
+            result.parsed = parsed
+            return result
+        same = previous.ok and previous.tree != None and len(formulas) == 1 and signature_key(parsed) == signature_key(previous.parsed) and [predicate[1] for predicate in parsed[2]] == [predicate[1] for predicate in previous.parsed[2]]
+        if same:
+            with _stage(result.timings, "reparse") as stage:
+                stage.items = _splice_lines(previous, text, formulas[0], parsed, signature)
+            if stage.items != None:
+                result.parsed = parsed
+                result.tree = previous.tree
+                previous.tree = None
+                with _stage(result.timings, "grammar"):
+                    result.grammar = render_grammar(parsed, result.source)
+                result.ok = True
+                return result
+        with _stage(result.timings, "tokenize") as stage:
+            parsed = parse_input(text)
+            stage.items = len(parsed[6])
+        result.parsed = parsed
+        if "$" in parsed[6]:
+            report_error("$ is a forbidden input symbol; denotes end of file character")
+            return result
+        return _run_parser(result, parsed, list(parsed[6]), signature)
+
+#Fill in the formula tokens and lines of parsed, the signature of text as parsed by reparse, from those of previous
+#and the lines of the formula at (line, start, end) in text that differ, and splice the change into the tree of
+#previous. Returns as splice_tree, leaving parsed and the tree of previous untouched on None
+def _splice_lines(previous, text, formula, parsed, signature):
+    line, start, end = formula
+    old_tokens = previous.parsed[6]
+    old_lines = previous.parsed[8]
+    raws = text[start:end].split("\n")
+    column = start - (text.rfind("\n", 0, start) + 1)
+    #Lines holding tokens, as (line, raw text, column offset)
+    lines = [(line + number, raw, column if number == 0 else 0) for number, raw in enumerate(raws) if raw.strip()]
+    limit = min(len(lines), len(old_lines))
+    first = 0
+    while first < limit and lines[first][1] == old_lines[first][2]:
+        first += 1
+    last = 0
+    while last < limit - first and lines[len(lines)-last-1][1] == old_lines[len(old_lines)-last-1][2]:
+        last += 1
+    #Tokens of previous from the first to the last line that changed, and those of the lines replacing them
+    old_start = old_lines[first][1] if first < len(old_lines) else len(old_tokens)
+    old_end = old_lines[len(old_lines)-last][1] if last else len(old_tokens)
+    changed = []
+    formula_lines = [(number, old_lines[index][1], raw, offset) for index, (number, raw, offset) in enumerate(lines[:first])]
+    for number, raw, offset in lines[first:len(lines)-last]:
+        formula_lines.append((number, old_start + len(changed), raw, offset))
+        changed.extend(split_formula_line(raw.replace("\\", "\\\\")))
+    if "$" in changed:
+        return None
+    shift = len(changed) - (old_end - old_start)
+    for index, (number, raw, offset) in enumerate(lines[len(lines)-last:]):
+        formula_lines.append((number, old_lines[len(old_lines)-last+index][1] + shift, raw, offset))
+    tokens = old_tokens[:old_start] + changed + old_tokens[old_end:]
+    #Tokens of the changed lines may still match at either end
+    middle = old_tokens[old_start:old_end]
+    prefix = common_prefix(middle, changed, min(len(middle), len(changed)))
+    suffix = common_suffix(middle, changed, min(len(middle), len(changed)) - prefix)
+    nodes = splice_tree(previous.tree, old_tokens, tokens, signature, parsed, old_start + prefix, len(old_tokens) - old_end + suffix)
+    if nodes != None:
+        parsed[6] = tokens
+        parsed[8] = formula_lines
+    return nodes
+
+#Version of the compiler's outputs; part of every cache key, so bump it whenever the grammar or tree changes
+TOOL_VERSION = "2.2"
+
+#Canonical form of a spec for cache keys: sections in a fixed order with their tokens separated by single spaces,
+#so layout, whitespace and the order of sections do not change the key
+def normalize_spec(text):
+    sections = [[] for _ in definitions]
+    for category, start, end, line in split_sections(text):
+        if category == 6:
+            sections[category].extend(split_formula_line(text[start:end]))
         else:
-            msg = "Expected a predicate symbol but received " + self.current
-            print(msg)
-            append_log("ERR", msg)
-            return False
+            sections[category].extend(text[start:end].split())
+    return "\n".join(definitions[category] + " " + " ".join(sections[category]) for category in range(len(definitions)))
 
-    #Check if end of token stream reached
-    def check_success(self):
-        if self.current == '$':
-            append_log("OK", "FO formula parsed successfully")
-            #Return the parse tree
-            return self.root
+#On-disk cache of compilation results addressed by a hash of the normalized spec and TOOL_VERSION. An entry is a
+#single file holding the outcome, the grammar text, the serialized ParseTree and any renders of it (PNG, DOT), so a
+#hit costs one hash and one file read; the spec is only tokenized if its tokens or positions are asked for (see
+#CachedResult). Entries are written atomically; hits refresh their modification time and the least recently used
+#entries are evicted once the cache grows past max_bytes
+class CompileCache():
+    def __init__(self, directory, max_bytes=256*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        #Total size of the entries, measured on the first write
+        self.size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, text):
+        import hashlib
+        return hashlib.sha256((TOOL_VERSION + "\n" + normalize_spec(text)).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".entry")
+
+    #Entry for key as (metadata, blobs), or None on a miss
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry:
+                data = entry.read()
+            os.utime(path)
+        except OSError:
+            return None
+        header, _, body = data.partition(b"\n")
+        meta = json.loads(header)
+        blobs = {}
+        for name, (offset, length) in meta.pop("blobs").items():
+            blobs[name] = body[offset:offset+length]
+        return meta, blobs
+
+    def put(self, key, meta, blobs):
+        layout = {}
+        offset = 0
+        for name, blob in blobs.items():
+            layout[name] = [offset, len(blob)]
+            offset += len(blob)
+        meta = dict(meta, blobs=layout)
+        data = json.dumps(meta).encode() + b"\n" + b"".join(blobs.values())
+        path = self.path(key)
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = 0
+        #A temporary name of its own per write, since threads and processes may write the same key at once
+        import tempfile
+        descriptor, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(descriptor, "wb") as entry:
+                entry.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        if self.size == None:
+            self.size = sum(size for mtime, size, path in self.entries())
         else:
-            append_log("ERR", "Failed to parse FO formula")
-            return False
+            self.size += len(data) - previous
+        if self.size > self.max_bytes:
+            self.evict()
+
+    #Add a render (for instance "png" or "dot") to an existing entry
+    def add_render(self, key, name, data):
+        entry = self.get(key)
+        if entry != None:
+            meta, blobs = entry
+            blobs["render:" + name] = data
+            self.put(key, meta, blobs)
+
+    #Entries of the cache as (modification time, size, path); those removed by another writer meanwhile are left out
+    def entries(self):
+        entries = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".entry"):
+                try:
+                    info = item.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, item.path))
+        return entries
+
+    #Remove least recently used entries until the cache is back under 90% of max_bytes
+    def evict(self):
+        entries = self.entries()
+        entries.sort()
+        self.size = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+#Result answered from a CompileCache entry. Entries keep token indices only, since specs differing in layout share an
+#entry, so parsed and the positions of diagnostics come from the text of this spec; it is tokenized, and its valid
+#signature completed, when either is first read, and never if the caller needs neither
+class CachedResult(Result):
+    def __init__(self, source, text):
+        Result.__init__(self, source)
+        self.cached = True
+        self.text = text
+        #Errors (code, message, start, end) recorded in the entry, located once diagnostics are read
+        self.errors_found = []
+
+    @property
+    def parsed(self):
+        if self._parsed == None and self.text != None:
+            text = self.text
+            self.text = None
+            with _compiling(self, False):
+                with _stage(self.timings, "tokenize") as stage:
+                    parsed = parse_input(text)
+                    stage.items = len(parsed[6])
+                if self.ok:
+                    #The signature is valid, so this only completes parsed, from the signature cache once warm
+                    with _stage(self.timings, "validate"):
+                        check_signature(parsed)
+            self._parsed = parsed
+        return self._parsed
+
+    @parsed.setter
+    def parsed(self, value):
+        self._parsed = value
+
+    @property
+    def diagnostics(self):
+        if self._diagnostics == None:
+            self._diagnostics = diagnostics(self.parsed, self.errors_found)
+        return self._diagnostics
+
+    @diagnostics.setter
+    def diagnostics(self, value):
+        self._diagnostics = value
+
+#Compile the text of a spec through cache; an unchanged spec is answered from its entry without parsing
+def compile_cached(text, cache, source="<string>", verbose=False):
+    result = Result(source)
+    with _compiling(result, verbose):
+        with _stage(result.timings, "cache"):
+            result.cache_key = cache.key(text)
+            entry = cache.get(result.cache_key)
+        if entry != None:
+            meta, blobs = entry
+            cached = CachedResult(source, text)
+            cached.cache_key = result.cache_key
+            cached.timings = result.timings
+            with _compiling(cached, verbose):
+                for msg in meta["errors"]:
+                    report_error(msg)
+            cached.errors_found = [tuple(fields) for fields in meta["diagnostics"]]
+            if cached.errors_found:
+                cached.diagnostics = None
+            if meta["ok"]:
+                before, after = meta["grammar"]
+                cached.grammar = before + source + after
+                cached.tree = ParseTree.from_bytes(blobs["tree"])
+                cached.ok = True
+            for name, blob in blobs.items():
+                if name.startswith("render:"):
+                    cached.renders[name[7:]] = blob
+            return cached
+        _compile_lines(result, text)
+        meta = {"ok": result.ok, "errors": result.errors, "diagnostics": [diagnostic[:4] for diagnostic in result.diagnostics], "grammar": None}
+        blobs = {}
+        if result.ok:
+            grammar = grammar_for(result.parsed)
+            meta["grammar"] = [grammar.head, grammar.tail]
+            blobs["tree"] = result.tree.to_bytes()
+        with _stage(result.timings, "cache"):
+            cache.put(result.cache_key, meta, blobs)
+        return result
+
+#Read the spec stored at path and compile it through cache
+def compile_file_cached(path, cache, verbose=False):
+    result = Result(path)
+    with _compiling(result, verbose):
+        with _stage(result.timings, "read") as stage:
+            lines = read_input(path)
+            stage.items = len(lines) if lines else 0
+        if lines == False:
+            return result
+    timings = result.timings
+    result = compile_cached("".join(lines), cache, path, verbose)
+    result.timings.update(timings)
+    return result
+
+#Spec files named by a batch source: the .txt files of a directory, or the paths listed one per line in a manifest
+#(relative to the manifest's directory). Returns the paths and the directory outputs are mirrored from
+def batch_specs(source):
+    if os.path.isdir(source):
+        specs = sorted(os.path.join(source, name) for name in os.listdir(source) if name.endswith(".txt"))
+        return specs, source
+    base = os.path.dirname(source)
+    specs = []
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                specs.append(os.path.join(base, line))
+    return specs, base
+
+#Base path under out_dir of the outputs of the spec at path: its path relative to base, without the extension. A
+#spec outside base (an absolute or ".." manifest entry) is placed at the top of out_dir under its file name and a
+#short hash of its full path, so its outputs stay under out_dir and do not collide with those of another spec
+def batch_output(path, base, out_dir):
+    try:
+        relative = os.path.relpath(path, base or os.curdir)
+    except ValueError:
+        #On another drive than base
+        relative = os.path.abspath(path)
+    if os.path.isabs(relative) or relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        import hashlib
+        digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]
+        relative = os.path.splitext(os.path.basename(path))[0] + "-" + digest
+    else:
+        relative = os.path.splitext(relative)[0]
+    return os.path.join(out_dir, relative)
+
+#Serialized parse tree formats: the ParseTree method writing each and the file extension of its output
+TREE_FORMATS = {"dot": ("write_dot", ".dot"), "json": ("write_json", ".json"), "sexp": ("write_sexp", ".sexp")}
+
+#Write a parse tree to path in one of TREE_FORMATS
+def export_tree(tree, path, fmt="dot"):
+    with open(path, "w", encoding="utf-8") as output:
+        getattr(tree, TREE_FORMATS[fmt][0])(output)
+
+#Write the DOT text of a parse tree to path
+def write_dot(tree, path):
+    export_tree(tree, path, "dot")
+
+#How parse trees are rendered: "png" writes DOT text and a PNG image, "dot" the DOT text only, "none" nothing
+RENDER_MODES = ("png", "dot", "none")
+#Trees with more nodes than this get no PNG image by default; dot takes minutes to lay out larger ones
+MAX_RENDER_NODES = 20000
+
+#Rendering stage decoupled from compiling: jobs are queued and picked up by a pool of render threads, which spend
+#most of their time waiting on the external dot program. Each job updates its status record with the outputs,
+#errors and timings of rendering; done, if given, is called with the record from the render thread
+class RenderPipeline():
+    def __init__(self, workers=None, mode="png", max_nodes=MAX_RENDER_NODES, done=None):
+        self.mode = mode
+        self.max_nodes = max_nodes
+        self.done = done
+        self.jobs = queue.Queue()
+        self.results = []
+        self.lock = threading.Lock()
+        self.threads = []
+        for _ in range(workers or os.cpu_count() or 1):
+            thread = threading.Thread(target=self.run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    #Queue the rendering of a parse tree to dot_path and png_path. Without a tree, the DOT text is read from
+    #dot_path and nodes gives the size of the tree; without a dot_path, the DOT text goes to a temporary file, which
+    #is not written for a tree too large to be rendered
+    def submit(self, status, dot_path, png_path, tree=None, nodes=None):
+        if tree != None:
+            nodes = len(tree)
+        self.jobs.put((time.perf_counter(), status, tree, nodes, dot_path, png_path))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job == None:
+                break
+            status = self.render(*job)
+            with self.lock:
+                self.results.append(status)
+            if self.done != None:
+                self.done(status)
+
+    def render(self, queued, status, tree, nodes, dot_path, png_path):
+        import subprocess
+        import tempfile
+        timings = status.setdefault("timings", {})
+        timings["render_wait"] = time.perf_counter() - queued
+        temporary = dot_path == None
+        skip = self.mode == "png" and nodes > self.max_nodes
+        if skip:
+            status["render"] = "skipped; parse tree has " + str(nodes) + " nodes, more than " + str(self.max_nodes)
+            if temporary:
+                return status
+        try:
+            if temporary:
+                descriptor, dot_path = tempfile.mkstemp(suffix=".dot")
+                os.close(descriptor)
+            if tree != None and self.mode != "none":
+                with _stage(timings, "dot") as stage:
+                    write_dot(tree, dot_path)
+                    stage.items = nodes
+                if not temporary:
+                    status["parsetree"] = dot_path
+            if self.mode == "png" and not skip:
+                with _stage(timings, "png") as stage:
+                    subprocess.run(["dot", "-Tpng", dot_path, "-o", png_path], check=True, capture_output=True)
+                    stage.items = nodes
+                status["picture"] = png_path
+        except Exception as error:
+            status["ok"] = False
+            status["errors"].append("Failed to render parse tree: " + type(error).__name__ + ": " + str(error))
+        finally:
+            if temporary:
+                os.remove(dot_path)
+        return status
+
+    #Wait for the queued jobs; returns their status records
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.results
+
+#Caches opened by this worker process, by directory
+_batch_caches = {}
+
+#Compile one spec of a batch in a worker process and write its grammar and, unless mode is "none", its DOT text.
+#PNG images are left to the RenderPipeline of run_batch, except when found in the cache. Returns its status record
+def _batch_compile(job):
+    path, out_base, mode, exports, cache_dir, cache_size, profile = job
+    start = time.perf_counter()
+    #Each spec gets its own Profiler; run_batch merges them
+    if profile:
+        profiler = enable_profiling(profile == "memory")
+    if cache_dir:
+        if cache_dir not in _batch_caches:
+            _batch_caches[cache_dir] = CompileCache(cache_dir, cache_size)
+        result = compile_file_cached(path, _batch_caches[cache_dir])
+    else:
+        result = compile_file(path)
+    status = {"file": path, "ok": result.ok, "errors": result.errors}
+    if cache_dir:
+        status["cached"] = result.cached
+        status["cache_key"] = result.cache_key
+    if result.ok:
+        status["nodes"] = len(result.tree)
+        #A failure to write one spec's outputs is recorded in its status rather than stopping the batch
+        try:
+            os.makedirs(os.path.dirname(out_base) or ".", exist_ok=True)
+            status["grammar"] = out_base + "-outputgrammar.txt"
+            with open(status["grammar"], "w") as output:
+                output.write(result.grammar)
+            if mode != "none":
+                status["parsetree"] = out_base + "-outputparsetree.dot"
+                if "dot" in result.renders:
+                    with open(status["parsetree"], "wb") as output:
+                        output.write(result.renders["dot"])
+                else:
+                    with _stage(result.timings, "dot") as stage:
+                        write_dot(result.tree, status["parsetree"])
+                        stage.items = status["nodes"]
+                    if cache_dir:
+                        with open(status["parsetree"], "rb") as rendered:
+                            _batch_caches[cache_dir].add_render(result.cache_key, "dot", rendered.read())
+            for fmt in exports:
+                status[fmt] = out_base + "-outputparsetree" + TREE_FORMATS[fmt][1]
+                with _stage(result.timings, "export") as stage:
+                    export_tree(result.tree, status[fmt], fmt)
+                    stage.items = status["nodes"]
+            if mode == "png" and "png" in result.renders:
+                status["picture"] = out_base + "-outputparsetree.png"
+                with open(status["picture"], "wb") as output:
+                    output.write(result.renders["png"])
+        except Exception as error:
+            status["ok"] = False
+            status["errors"].append("Failed to write outputs: " + type(error).__name__ + ": " + str(error))
+    status["timings"] = result.timings
+    status["seconds"] = time.perf_counter() - start
+    if profile:
+        status["profile"] = profiler.phases
+    return status
+
+#Compile every spec of a directory or manifest over a pool of worker processes. Outputs mirror the layout of the
+#specs under out_dir; PNG images are rendered by a RenderPipeline of render_workers threads as specs complete.
+#One JSON status record per spec is written to summary once it is finished. Returns the records
+def run_batch(source, out_dir, summary, workers=None, chunksize=None, mode="dot", exports=(), cache_dir=None, cache_size=256*1024*1024, render_workers=None, max_nodes=MAX_RENDER_NODES, profile=None):
+    specs, base = batch_specs(source)
+    jobs = []
+    for path in specs:
+        jobs.append((path, batch_output(path, base, out_dir), mode, exports, cache_dir, cache_size, profile))
+    workers = workers or os.cpu_count() or 1
+    #By default hand each worker about four chunks, enough to balance uneven specs without much messaging
+    chunksize = chunksize or max(1, len(jobs) // (workers * 4))
+    import multiprocessing
+    import multiprocessing.util
+    records = []
+    lock = threading.Lock()
+    cache = CompileCache(cache_dir, cache_size) if cache_dir else None
+    #The parent profiles rendering and collects the profiles of the workers
+    if profile:
+        profiler = enable_profiling(profile == "memory")
+    with open(summary, "w") as status_file:
+        def finish(status):
+            if cache != None and "picture" in status:
+                with open(status["picture"], "rb") as rendered:
+                    cache.add_render(status["cache_key"], "png", rendered.read())
+            for stage, seconds in status["timings"].items():
+                status["timings"][stage] = round(seconds, 6)
+            status["seconds"] = round(status["seconds"], 6)
+            with lock:
+                status_file.write(json.dumps(status) + "\n")
+                records.append(status)
+        pipeline = RenderPipeline(render_workers, mode, max_nodes, finish)
+        with multiprocessing.Pool(workers) as pool:
+            for status in pool.imap_unordered(_batch_compile, jobs, chunksize):
+                if profile:
+                    profiler.merge(status.pop("profile"))
+                if status["ok"] and mode == "png" and "picture" not in status:
+                    pipeline.submit(status, status["parsetree"], status["parsetree"][:-4] + ".png", nodes=status["nodes"])
+                else:
+                    finish(status)
+            #Let the workers exit normally, so they flush their logs
+            pool.close()
+            pool.join()
+        pipeline.close()
+    return records
+
+#Options shared by the single-file and batch command lines
+def add_cache_arguments(parser):
+    parser.add_argument("--cache", default=None, metavar="DIR", help="reuse grammars, parse trees and renders of unchanged specs from a cache in DIR")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB", help="size above which least recently used cache entries are evicted (default: 256)")
+
+def add_render_arguments(parser, default):
+    parser.add_argument("--render", choices=RENDER_MODES, default=default, help="png: DOT text and PNG image, dot: DOT text only, none: no parse tree output (default: " + default + ")")
+    parser.add_argument("--render-workers", type=int, default=None, help="threads rendering PNG images (default: number of CPUs)")
+    parser.add_argument("--max-render-nodes", type=int, default=MAX_RENDER_NODES, help="skip the PNG image of parse trees with more nodes (default: " + str(MAX_RENDER_NODES) + ")")
+    parser.add_argument("--export", nargs="+", choices=["json", "sexp"], default=[], help="also write the parse tree as JSON and/or an S-expression")
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", default=None, metavar="FILE", help="record wall and CPU time, items processed and peak memory of each phase; print a summary table and write the metrics as JSON to FILE")
+    parser.add_argument("--profile-memory", action="store_true", help="trace the peak memory of each phase with tracemalloc instead of the process high-water mark (slower)")
+
+#Profiling mode selected on the command line: None, "time" or "memory"
+def profile_mode(args):
+    if not args.profile:
+        return None
+    return "memory" if args.profile_memory else "time"
+
+#Print the summary table of the running Profiler and write its metrics file
+def report_profile(path):
+    print(_profiler.table(), end="")
+    _profiler.write(path)
+    print("Metrics written to " + path)
+
+#Command line interface of the batch compiler
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="compilerdesign.py batch", description="Compile a directory or manifest of spec files in parallel.")
+    parser.add_argument("source", help="directory of .txt specs, or a manifest listing one spec path per line")
+    parser.add_argument("--out", default="batch-output", help="directory for the grammar and parse tree outputs")
+    parser.add_argument("--summary", default=None, help="JSONL status file (default: OUT/summary.jsonl)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=None, help="specs handed to a worker at a time")
+    add_render_arguments(parser, "dot")
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.source):
+        print("Specified batch source not found.")
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+    summary = args.summary or os.path.join(args.out, "summary.jsonl")
+    records = run_batch(args.source, args.out, summary, args.workers, args.chunksize, args.render, args.export, args.cache, args.cache_size * 1024 * 1024, args.render_workers, args.max_render_nodes, profile_mode(args))
+    failed = sum(1 for status in records if not status["ok"])
+    print("Compiled " + str(len(records)) + " specs, " + str(failed) + " failed; status written to " + summary)
+    if args.profile:
+        report_profile(args.profile)
+    return 1 if failed else 0
 
-#If input file read sucessfully and passed all initial checks, feed FO formula to recursive descent parser    
-if check_validity(parsed) == True:
-    if check_formula(parsed) == True:
-        variables = parsed[0]
-        constants = parsed[1]
-
-        predicates = []
-        for predsymbol in parsed[2]:
-            predicates.append(predsymbol[0])
-        
-        equality = parsed[3]
-
-        connectives = parsed[4]
-
-        quantifiers = parsed[5]
-
-        tokenstream = parsed[6]
-
-        #Check for forbidden tokens and escape characters in the tokenstream
-        if "$" in tokenstream:
-            print("$ is a forbidden input symbol; denotes end of file character")
-            append_log("ERR","$ is a forbidden input symbol; denotes end of file character")
-            sys.exit()
-        
-        #Initialize a Parser object
-        parsing = Parser(tokenstream, variables, constants, connectives, predicates, quantifiers, equality)
-        if parsing == False:
-            print("Failed to generate visualization of parse tree; invalid FO formula")
-            
-        #If parsing was successful, visualize the PT
-        tree = parsing.check_success()
-
-        if tree != False and parsing.root != parsing.initialroot:
-            generate_grammar(parsed, OUT_FILE_GRAMMAR, IN_FILE)
-            DotExporter(tree, nodeattrfunc=lambda n: 'label="%s"' % (n.id)).to_picture(OUT_FILE_PARSETREE)
-            print("Parsing successful; grammar output to " + OUT_FILE_GRAMMAR + " and parse tree output to " + OUT_FILE_PARSETREE)
+#Last result of each editing session of the compile server, most recently used last; see handle_request
+SESSION_CACHE_SIZE = 64
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+#Answer one request of the compile server. A request is a JSON object: {"op": "compile", "spec": text} or
+#{"op": "compile", "path": file}. "id" is echoed back. "source" names the spec. "grammar" set to false leaves out the
+#grammar. "tree" gives the format of the parse tree, one of TREE_FORMATS, or null for none. "multi" set to true
+#compiles every formula of a multi-formula spec, answered with a "formulas" list. "session" names a session whose
+#result is kept, so its next spec is reparsed from it (see reparse). "scopes" set to true adds the "scopes"
+#diagnostics of the formula (see check_scopes). Other ops are "ping", "stats" and, for a socket server, "shutdown".
+#Responses carry "ok" and "errors"; those to compiles also carry "diagnostics" (see Diagnostic), "grammar", "tree"
+#and "timings"
+def handle_request(request, cache=None, server=None):
+    response = {"id": request.get("id"), "ok": False, "errors": []}
+    op = request.get("op", "compile")
+    if op == "ping":
+        response["ok"] = True
+        return response
+    if op == "stats":
+        response["ok"] = True
+        response["signatures"] = len(_signatures)
+        response["grammars"] = len(_grammars)
+        response["sessions"] = len(_sessions)
+        return response
+    if op == "shutdown" and server != None:
+        #shutdown() waits for serve_forever to return, so it cannot run on a thread serving a request
+        threading.Thread(target=server.shutdown).start()
+        response["ok"] = True
+        return response
+    if op != "compile":
+        response["errors"].append("Unknown request: " + str(op))
+        return response
+    fmt = request.get("tree", "json")
+    if fmt != None and fmt not in TREE_FORMATS:
+        response["errors"].append("Unknown parse tree format: " + str(fmt))
+        return response
+    if request.get("multi"):
+        if "spec" in request:
+            results = compile_formulas(request["spec"], request.get("source", "<string>"))
+        elif "path" in request:
+            results = compile_file_formulas(request["path"])
+        else:
+            response["errors"].append("Compile request needs a spec or a path")
+            return response
+        response["formulas"] = []
+        for result in results:
+            entry = {"source": result.source, "ok": result.ok, "errors": result.errors, "diagnostics": [diagnostic._asdict() for diagnostic in result.diagnostics]}
+            if result.ok and fmt != None:
+                output = io.StringIO()
+                getattr(result.tree, TREE_FORMATS[fmt][0])(output)
+                entry["tree"] = output.getvalue()
+            if result.ok and request.get("scopes"):
+                entry["scopes"] = [diagnostic._asdict() for diagnostic in scope_diagnostics(result)]
+            response["formulas"].append(entry)
+            if request.get("grammar", True) and result.ok:
+                response["grammar"] = result.grammar
+        response["ok"] = all(entry["ok"] for entry in response["formulas"])
+        return response
+    if "spec" in request and request.get("session") != None:
+        #Take the session's result while reparsing, as reparse hands its tree over
+        with _sessions_lock:
+            previous = _sessions.pop(request["session"], None)
+        if previous != None:
+            result = reparse(previous, request["spec"])
+        elif cache != None:
+            result = compile_cached(request["spec"], cache, request.get("source", "<string>"))
+        else:
+            result = compile_spec(request["spec"], request.get("source", "<string>"))
+        with _sessions_lock:
+            _sessions[request["session"]] = result
+            if len(_sessions) > SESSION_CACHE_SIZE:
+                _sessions.popitem(last=False)
+    elif "spec" in request:
+        source = request.get("source", "<string>")
+        if cache != None:
+            result = compile_cached(request["spec"], cache, source)
         else:
-            print("Failed to generate grammar and visualization of parse tree; invalid FO formula")
-            append_log("ERR", "Failed to generate visualization of parse tree; invalid FO formula")
-            sys.exit(1)
+            result = compile_spec(request["spec"], source)
+    elif "path" in request:
+        if cache != None:
+            result = compile_file_cached(request["path"], cache)
+        else:
+            result = compile_file(request["path"])
+    else:
+        response["errors"].append("Compile request needs a spec or a path")
+        return response
+    response["ok"] = result.ok
+    response["errors"] = result.errors
+    response["diagnostics"] = [diagnostic._asdict() for diagnostic in result.diagnostics]
+    if result.ok:
+        if request.get("grammar", True):
+            response["grammar"] = result.grammar
+        if fmt != None:
+            output = io.StringIO()
+            getattr(result.tree, TREE_FORMATS[fmt][0])(output)
+            response["tree"] = output.getvalue()
+        if request.get("scopes"):
+            response["scopes"] = [diagnostic._asdict() for diagnostic in scope_diagnostics(result)]
+    response["timings"] = result.timings
+    return response
+
+#Answer one line of the server protocol with one line of JSON
+def handle_line(line, cache=None, server=None):
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("request is not a JSON object")
+    except ValueError as error:
+        return json.dumps({"id": None, "ok": False, "errors": ["Invalid request: " + str(error)]}) + "\n"
+    try:
+        response = handle_request(request, cache, server)
+    except Exception as error:
+        response = {"id": request.get("id"), "ok": False, "errors": ["Internal error: " + type(error).__name__ + ": " + str(error)]}
+    return json.dumps(response) + "\n"
+
+#Serve requests read line by line from stdin on a pool of threads; responses are written to stdout as they
+#complete, so they may come out of order and are matched to requests by id
+def serve_stdio(workers, cache=None):
+    import concurrent.futures
+    lock = threading.Lock()
+    def answer(line):
+        reply = handle_line(line, cache)
+        with lock:
+            sys.stdout.write(reply)
+            sys.stdout.flush()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for line in sys.stdin:
+            if line.strip():
+                pool.submit(answer, line)
+    return 0
+
+#Whether a server accepts connections on the Unix socket at path
+def socket_in_use(path):
+    import socket
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+#Serve requests on a Unix socket; every connection is served on its own thread, one response per request line in
+#order. {"op": "shutdown"} stops the server
+def serve_socket(path, cache=None):
+    import socketserver
+
+    class CompileHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                self.wfile.write(handle_line(line, cache, self.server).encode())
+                self.wfile.flush()
+
+    #A socket left behind by a server that did not shut down cleanly is replaced; anything else at path is kept
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            report_error("Cannot listen on " + path + ": the path exists and is not a socket")
+            return 1
+        if socket_in_use(path):
+            report_error("Cannot listen on " + path + ": another server is listening on it")
+            return 1
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, CompileHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+    return 0
+
+#Command line interface of the compile server
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog="compilerdesign.py serve", description="Keep the compiler loaded and answer compile requests, one JSON object per line.")
+    parser.add_argument("--socket", default=None, metavar="PATH", help="listen on a Unix socket instead of stdin/stdout")
+    parser.add_argument("--workers", type=int, default=4, help="threads answering stdin/stdout requests (default: 4)")
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    cache = None
+    if args.cache:
+        cache = CompileCache(args.cache, args.cache_size * 1024 * 1024)
+    if args.socket:
+        return serve_socket(args.socket, cache)
+    return serve_stdio(args.workers, cache)
+
+#Compile every formula of a multi-formula input file; writes the grammar once and a JSON line per formula with its
+#outcome, errors and, with exports, its parse tree in the first export format. With share, identical subformulas
+#are stored once (see FormulaDAG) and each record holds the "root" node of its formula; formulas are identical
+#exactly when their roots are. With scopes, records of formulas kept as trees list their "scopes" diagnostics
+def compile_multi_main(IN_FILE, out_base, exports, share=False, scopes=False):
+    OUT_FILE_GRAMMAR = out_base + "-outputgrammar.txt"
+    OUT_FILE_RESULTS = out_base + "-outputformulas.jsonl"
+    grammar = None
+    count = 0
+    failed = 0
+    nodes = 0
+    dag = FormulaDAG() if share else None
+    with open(OUT_FILE_RESULTS, "w") as output:
+        for result in compile_file_formulas(IN_FILE, dag=dag):
+            #Only a spec that could not be read or has an invalid signature yields a result named after the file
+            if result.source == IN_FILE:
+                for msg in result.errors:
+                    print(msg)
+                output.close()
+                os.remove(OUT_FILE_RESULTS)
+                return 1
+            count += 1
+            if grammar == None:
+                grammar = render_grammar(result.parsed, IN_FILE)
+            record = {"source": result.source, "ok": result.ok, "errors": result.errors, "diagnostics": [diagnostic._asdict() for diagnostic in result.diagnostics]}
+            if result.ok:
+                if scopes and result.tree != None:
+                    record["scopes"] = [diagnostic._asdict() for diagnostic in scope_diagnostics(result)]
+                if dag != None:
+                    record["root"] = result.root
+                    nodes += dag.size[result.root]
+                if exports:
+                    tree = io.StringIO()
+                    getattr(result.tree or dag.tree(result.root), TREE_FORMATS[exports[0]][0])(tree)
+                    record[exports[0]] = tree.getvalue()
+            else:
+                failed += 1
+                for msg in result.errors:
+                    print(result.source + ": " + msg)
+            output.write(json.dumps(record) + "\n")
+    outputs = "results written to " + OUT_FILE_RESULTS
+    if grammar != None:
+        with open(OUT_FILE_GRAMMAR, "a") as output:
+            output.write(grammar)
+        outputs = "grammar output to " + OUT_FILE_GRAMMAR + " and " + outputs
+    print("Checked " + str(count) + " formulas, " + str(failed) + " failed; " + outputs)
+    if dag != None:
+        print("Parse tree nodes: " + str(nodes) + ", distinct subformulas: " + str(len(dag)))
+    return 1 if failed else 0
+
+#Command line interface; compiles the input file given as 1st argument and writes the grammar and parse tree.
+#"batch" as 1st argument compiles many specs instead, see batch_main; "serve" starts a compile server, see serve_main
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) >= 1 and argv[0] == "batch":
+        return batch_main(argv[1:])
+    if len(argv) >= 1 and argv[0] == "serve":
+        return serve_main(argv[1:])
+    #Specify file to read input from as 1st command line argument
+    if len(argv) < 1:
+        print("Input file not specified.")
+        return 1
+    parser = argparse.ArgumentParser(prog="compilerdesign.py", description="Compile a spec file into its grammar and parse tree.", epilog="Run as python -m compilerdesign to start from cached bytecode; python compilerdesign.py compiles the source on every run.")
+    parser.add_argument("input", help="spec file (.txt)")
+    add_render_arguments(parser, "png")
+    add_cache_arguments(parser)
+    parser.add_argument("--timings", action="store_true", help="print the time spent in each stage")
+    parser.add_argument("--multi", action="store_true", help="the input holds many formulas (formula: sections, or a formulas: section with one per line); check each against the signature and write one JSON result per formula")
+    parser.add_argument("--share", action="store_true", help="with --multi, store identical subformulas once and report each formula's node, equal for identical formulas")
+    parser.add_argument("--scopes", action="store_true", help="report free variables, shadowed bindings and unused quantifiers of the formula (not with --share)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling(args.profile_memory)
+    code = compile_main(args)
+    if args.profile:
+        report_profile(args.profile)
+    return code
+
+#Compile the input file named on the command line and write its outputs; returns the exit status
+def compile_main(args):
+    IN_FILE = args.input
+
+    #Specify destination of output grammar 
+    current_timestamp = datetime.now()
+    timestamp_str = current_timestamp.strftime("%d-%b-%Y-%H:%M:%S")
+    #Outputs go next to the input file, prefixed with the timestamp
+    out_base = os.path.join(os.path.dirname(IN_FILE), timestamp_str + os.path.basename(IN_FILE)[:-4])
+    OUT_FILE_GRAMMAR = out_base + "-outputgrammar.txt"
+    OUT_FILE_PARSETREE = out_base + "-outputparsetree.png"
+    if args.multi:
+        return compile_multi_main(IN_FILE, out_base, args.export, args.share, args.scopes)
+
+    cache = None
+    if args.cache:
+        cache = CompileCache(args.cache, args.cache_size * 1024 * 1024)
+        result = compile_file_cached(IN_FILE, cache, verbose=True)
+    else:
+        result = compile_file(IN_FILE, verbose=True)
+    if not result.ok:
+        return 1
+
+    #If parsing was successful, write the grammar and visualize the PT
+    with open(OUT_FILE_GRAMMAR, "a") as output:
+        output.write(result.grammar)
+    if args.scopes:
+        for diagnostic in scope_diagnostics(result):
+            location = "" if diagnostic.line == None else str(diagnostic.line) + ":" + str(diagnostic.col) + ":"
+            print(IN_FILE + ":" + location + " " + diagnostic.message)
+    status = {"file": IN_FILE, "ok": True, "errors": [], "timings": result.timings}
+    exported = []
+    for fmt in args.export:
+        exported.append(out_base + "-outputparsetree" + TREE_FORMATS[fmt][1])
+        with _stage(result.timings, "export") as stage:
+            export_tree(result.tree, exported[-1], fmt)
+            stage.items = len(result.tree)
+    if args.render == "png" and "png" in result.renders:
+        with open(OUT_FILE_PARSETREE, "wb") as output:
+            output.write(result.renders["png"])
+        status["picture"] = OUT_FILE_PARSETREE
+    elif args.render != "none":
+        #The DOT text is kept in "dot" mode and for a tree too large for a PNG image, as in batch mode; for an image
+        #it goes to a temporary file
+        pipeline = RenderPipeline(args.render_workers or 1, args.render, args.max_render_nodes)
+        keep_dot = args.render == "dot" or len(result.tree) > args.max_render_nodes
+        pipeline.submit(status, out_base + "-outputparsetree.dot" if keep_dot else None, OUT_FILE_PARSETREE, result.tree)
+        pipeline.close()
+        if cache != None and "picture" in status:
+            with open(OUT_FILE_PARSETREE, "rb") as rendered:
+                cache.add_render(result.cache_key, "png", rendered.read())
+    with _compiling(result, True):
+        for msg in status["errors"]:
+            report_error(msg)
+    if args.timings:
+        for stage, seconds in result.timings.items():
+            print("%-12s %10.6f s" % (stage, seconds))
+    if not status["ok"]:
+        return 1
+    outputs = "grammar output to " + OUT_FILE_GRAMMAR
+    if "parsetree" in status:
+        outputs += " and parse tree output to " + status["parsetree"]
+    if "picture" in status:
+        outputs += " and parse tree output to " + status["picture"]
+    for path in exported:
+        outputs += " and " + path
+    if "render" in status:
+        outputs += "; parse tree image " + status["render"]
+    print("Parsing successful; " + outputs)
+    return 0
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,732 @@
+import sys
+import argparse
+from array import array
+
+import compilerdesign
+from compilerdesign import NODE_F, NODE_Q, NODE_V, NODE_P, NODE_TERMINAL, KIND_NEGATION
+
+#Operators of the nodes of a Formula; the binary connectives are numbered as in the connectives section
+#(AND OR IMPLIES IFF NOT) and the quantifiers as in the quantifiers section (exists, for all)
+AND = 0
+OR = 1
+IMPLIES = 2
+IFF = 3
+NOT = 4
+ATOM = 5
+EXISTS = 6
+FORALL = 7
+
+#Normal forms written by main
+FORMS = ("nnf", "prenex", "cnf")
+#Clauses or tokens written between two writes to the output
+WRITE_BLOCK = 1<<14
+
+#Hash-consed first-order formula over the signature of a compiled spec; the rewrites below build on it. A node is
+#(op, left, right): for an ATOM left is the atom id, for a quantifier left is the binder id and right the body,
+#otherwise left and right are operand nodes (right -1 for NOT). Identical nodes are stored once, so rewrites that
+#need a subformula twice share it. Atoms are (symbol, terms) with the equality symbol for ( T = T ); a term is a
+#binder id (a variable bound by a quantifier) or the name of a constant or free variable. Every quantifier of the
+#parsed formula gets a binder of its own, so bound variables never clash, whatever their names
+class Formula():
+    def __init__(self, parsed):
+        self.variables = [symbol.replace("\\\\", "\\") for symbol in parsed[0]]
+        self.constants = [symbol.replace("\\\\", "\\") for symbol in parsed[1]]
+        self.predicates = [[name.replace("\\\\", "\\"), arity] for name, arity in parsed[2]]
+        self.equality = parsed[3][0].replace("\\\\", "\\")
+        self.connectives = [symbol.replace("\\\\", "\\") for symbol in parsed[4]]
+        self.quantifiers = [symbol.replace("\\\\", "\\") for symbol in parsed[5]]
+        self.op = array("B")
+        self.left = array("l")
+        self.right = array("l")
+        #Whether a quantifier occurs in the subformula of each node
+        self.quantified = array("B")
+        self.table = {}
+        self.atoms = []
+        self.atom_ids = {}
+        #Name in the spec of the variable of each binder, and its name in the output once assigned by name()
+        self.binders = []
+        self.names = {}
+        self.taken = None
+        self.numbers = {}
+        #Variables used outside every quantifier binding them
+        self.free = set()
+
+    def __len__(self):
+        return len(self.op)
+
+    def make(self, op, left, right=-1):
+        key = (op, left, right)
+        node = self.table.get(key)
+        if node == None:
+            node = self.table[key] = len(self.op)
+            self.op.append(op)
+            self.left.append(left)
+            self.right.append(right)
+            if op == ATOM:
+                self.quantified.append(0)
+            elif op >= EXISTS:
+                self.quantified.append(1)
+            else:
+                self.quantified.append(self.quantified[left] or (right >= 0 and self.quantified[right]))
+        return node
+
+    def atom(self, symbol, terms):
+        key = (symbol, terms)
+        atom = self.atom_ids.get(key)
+        if atom == None:
+            atom = self.atom_ids[key] = len(self.atoms)
+            self.atoms.append(key)
+        return self.make(ATOM, atom)
+
+    def binder(self, name):
+        self.binders.append(name)
+        return len(self.binders) - 1
+
+    #Add the formula of a ParseTree; returns its node. One preorder pass with an explicit stack: a quantifier binds
+    #its variable for the pass through its formula, and nodes are built as the pass leaves them
+    def add_tree(self, tree):
+        kind = tree.kind
+        sym = tree.sym
+        end = tree.end
+        symbols = [symbol.replace("\\\\", "\\") for symbol in tree.symbols]
+        connectives = {symbol: index for index, symbol in enumerate(self.connectives)}
+        scope = {}
+        #Bindings replaced by the quantifiers being passed through
+        saved = []
+        results = []
+        if end[0] == 1:
+            raise ValueError("empty formula")
+        #Entries are (index of an F* node, whether its operands are done)
+        pending = [(0, False)]
+        while pending:
+            index, done = pending.pop()
+            children = list(tree.children(index))
+            first = kind[children[0]]
+            if first == NODE_Q:
+                variable = symbols[sym[children[1] + 1]]
+                if not done:
+                    binder = self.binder(variable)
+                    saved.append((variable, scope.get(variable), binder))
+                    scope[variable] = binder
+                    pending.append((index, True))
+                    pending.append((children[2], False))
+                else:
+                    variable, previous, binder = saved.pop()
+                    if previous == None:
+                        del scope[variable]
+                    else:
+                        scope[variable] = previous
+                    results.append(self.make(EXISTS + self.quantifiers.index(symbols[sym[children[0] + 1]]), binder, results.pop()))
+            elif first == NODE_P:
+                #P* -> Z* ( V* , V* ... ); the arguments are every other child after the parenthese
+                parts = list(tree.children(children[0]))
+                terms = tuple(self.term(symbols[sym[part + 1]], scope) for part in parts[2:-1:2])
+                results.append(self.atom(symbols[sym[parts[0] + 1]], terms))
+            elif first == NODE_TERMINAL + KIND_NEGATION:
+                if not done:
+                    pending.append((index, True))
+                    pending.append((children[1], False))
+                else:
+                    results.append(self.make(NOT, results.pop()))
+            elif kind[children[1]] != NODE_F:
+                #( T* = T* ); a term is V* or K* over its symbol
+                terms = (self.term(symbols[sym[children[1] + 2]], scope, kind[children[1] + 1] == NODE_V), self.term(symbols[sym[children[3] + 2]], scope, kind[children[3] + 1] == NODE_V))
+                results.append(self.atom(self.equality, terms))
+            elif not done:
+                pending.append((index, True))
+                pending.append((children[3], False))
+                pending.append((children[1], False))
+            else:
+                right = results.pop()
+                left = results.pop()
+                results.append(self.make(connectives[symbols[sym[children[2] + 1]]], left, right))
+        return results.pop()
+
+    def term(self, symbol, scope, variable=True):
+        if not variable:
+            return symbol
+        binder = scope.get(symbol)
+        if binder == None:
+            self.free.add(symbol)
+            return symbol
+        return binder
+
+    #Copy of the subformula of node with a new binder for each of its quantifiers, for rewrites that need a
+    #quantified subformula twice with different quantifiers; renamed maps further binders to their replacements
+    def rename(self, root, renamed=None):
+        renamed = dict(renamed or {})
+        copies = {}
+        pending = [root]
+        while pending:
+            node = pending[-1]
+            if node in copies:
+                pending.pop()
+                continue
+            op = self.op[node]
+            if op == ATOM:
+                symbol, terms = self.atoms[self.left[node]]
+                copies[node] = self.atom(symbol, tuple(renamed.get(term, term) if term.__class__ == int else term for term in terms))
+                pending.pop()
+            elif op >= EXISTS:
+                binder = self.left[node]
+                if binder not in renamed:
+                    renamed[binder] = self.binder(self.binders[binder])
+                body = self.right[node]
+                if body not in copies:
+                    pending.append(body)
+                    continue
+                copies[node] = self.make(op, renamed[binder], copies[body])
+                pending.pop()
+            else:
+                left = self.left[node]
+                right = self.right[node]
+                if left not in copies or (right >= 0 and right not in copies):
+                    pending.append(left)
+                    if right >= 0:
+                        pending.append(right)
+                    continue
+                copies[node] = self.make(op, copies[left], copies[right] if right >= 0 else -1)
+                pending.pop()
+        return copies[root]
+
+    #Binders occurring in the subformula of node that no quantifier inside it binds, memoized in free
+    def free_binders(self, root, free):
+        pending = [root]
+        while pending:
+            node = pending[-1]
+            if node in free:
+                pending.pop()
+                continue
+            op = self.op[node]
+            if op == ATOM:
+                free[node] = frozenset(term for term in self.atoms[self.left[node]][1] if term.__class__ == int)
+                pending.pop()
+                continue
+            operands = [self.right[node]] if op >= EXISTS else [operand for operand in (self.left[node], self.right[node]) if operand >= 0]
+            missing = [operand for operand in operands if operand not in free]
+            if missing:
+                pending.extend(missing)
+                continue
+            binders = frozenset().union(*[free[operand] for operand in operands])
+            if op >= EXISTS:
+                binders = binders - {self.left[node]}
+            free[node] = binders
+            pending.pop()
+        return free[root]
+
+    #Equisatisfiable formula in which no IFF has a quantifier in its sides, so its negation normal form (see nnf)
+    #stays linear. Working upwards, a quantified side s of an IFF is replaced by an atom N(x...) over a new predicate
+    #symbol and the free variables of s, and the definitions A x... (NOT N(x...) OR s) and A x... (N(x...) OR NOT s)
+    #are added to the formula, each over its own copy of the variables. Inner IFFs are named first, so the copies
+    #only repeat atoms naming them
+    def name_iffs(self, root):
+        done = {}
+        free = {}
+        definitions = []
+        pending = [root]
+        while pending:
+            node = pending[-1]
+            if node in done:
+                pending.pop()
+                continue
+            if not self.quantified[node]:
+                done[node] = node
+                pending.pop()
+                continue
+            op = self.op[node]
+            left = self.left[node]
+            right = self.right[node]
+            operands = [right] if op >= EXISTS else [operand for operand in (left, right) if operand >= 0]
+            missing = [operand for operand in operands if operand not in done]
+            if missing:
+                pending.extend(missing)
+                continue
+            pending.pop()
+            if op >= EXISTS:
+                done[node] = self.make(op, left, done[right])
+            elif op == NOT:
+                done[node] = self.make(NOT, done[left])
+            elif op != IFF:
+                done[node] = self.make(op, done[left], done[right])
+            else:
+                sides = []
+                for side in (done[left], done[right]):
+                    if self.quantified[side]:
+                        variables = sorted(self.free_binders(side, free))
+                        symbol = self.fresh_symbol()
+                        for negated in (False, True):
+                            copies = {binder: self.binder(self.binders[binder]) for binder in variables}
+                            name = self.atom(symbol, tuple(copies[binder] for binder in variables))
+                            copy = self.rename(side, copies)
+                            definition = self.make(OR, name, self.make(NOT, copy)) if negated else self.make(OR, self.make(NOT, name), copy)
+                            for binder in reversed(variables):
+                                definition = self.make(FORALL, copies[binder], definition)
+                            definitions.append(definition)
+                        side = self.atom(symbol, tuple(variables))
+                    sides.append(side)
+                done[node] = self.make(IFF, sides[0], sides[1])
+        root = done[root]
+        for definition in definitions:
+            root = self.make(AND, root, definition)
+        return root
+
+    #New predicate symbol for name_iffs, distinct from the symbols of the signature
+    def fresh_symbol(self):
+        taken = self.reserved()
+        number = len(taken)
+        while "N" + str(number) in taken or "N" + str(number) in self.variables:
+            number += 1
+        taken.add("N" + str(number))
+        return "N" + str(number)
+
+    #Names output may not give a binder or a new symbol: free variables, the signature and names already given
+    def reserved(self):
+        if self.taken == None:
+            self.taken = set(self.free) | set(self.constants) | set(name for name, arity in self.predicates) | set(self.connectives) | set(self.quantifiers) | {self.equality}
+        return self.taken
+
+    #Negation normal form of node: IMPLIES and IFF are eliminated and negations are pushed down to the atoms. a IFF b
+    #is expanded into (NOT a OR b) AND (a OR NOT b), sharing a and b; with split, an IFF whose sides hold quantifiers
+    #gets renamed copies a' and b' in its second half, so each quantifier ends up with a single polarity as prenex
+    #needs. Nested IFFs make the written formula exponential (see nnf_size), and nested quantified IFFs with split its
+    #memory too; name_iffs avoids it where equisatisfiability is enough. With iff, an IFF whose sides hold no
+    #quantifier is kept instead, negated by negating one side, for write_dimacs, which encodes it directly. Each node
+    #is rewritten once per polarity
+    def nnf(self, node, split=False, iff=False):
+        done = {}
+        expanded = {}
+        root = (node, False)
+        pending = [root]
+        while pending:
+            item = pending[-1]
+            if item in done:
+                pending.pop()
+                continue
+            node, negated = item
+            op = self.op[node]
+            left = self.left[node]
+            right = self.right[node]
+            if op == ATOM:
+                done[item] = self.make(NOT, node) if negated else node
+                pending.pop()
+                continue
+            if op == NOT:
+                needed = [(left, not negated)]
+            elif op >= EXISTS:
+                needed = [(right, negated)]
+            elif op == IMPLIES:
+                needed = [(left, not negated), (right, negated)]
+            elif op == IFF and iff and not (split and self.quantified[node]):
+                needed = [(left, False), (right, negated)]
+            elif op == IFF:
+                if not (split and self.quantified[node]):
+                    expanded[node] = (left, right)
+                elif node not in expanded:
+                    expanded[node] = (self.rename(left), self.rename(right))
+                copy_left, copy_right = expanded[node]
+                needed = [(left, True), (right, negated), (copy_left, False), (copy_right, not negated)]
+            else:
+                needed = [(left, negated), (right, negated)]
+            missing = [operand for operand in needed if operand not in done]
+            if missing:
+                pending.extend(missing)
+                continue
+            operands = [done[operand] for operand in needed]
+            pending.pop()
+            if op == NOT:
+                done[item] = operands[0]
+            elif op >= EXISTS:
+                #NOT E x F is A x NOT F and the other way round
+                done[item] = self.make(op ^ negated, left, operands[0])
+            elif op == IFF and len(operands) == 4:
+                #a IFF b is (NOT a OR b) AND (a OR NOT b); NOT (a IFF b) is (NOT a OR NOT b) AND (a OR b)
+                done[item] = self.make(AND, self.make(OR, operands[0], operands[1]), self.make(OR, operands[2], operands[3]))
+            elif op == IFF:
+                done[item] = self.make(IFF, operands[0], operands[1])
+            elif op == IMPLIES:
+                #a IMPLIES b is NOT a OR b; NOT (a IMPLIES b) is a AND NOT b
+                done[item] = self.make(AND if negated else OR, operands[0], operands[1])
+            else:
+                #De Morgan: a negated AND is an OR of the negations and the other way round
+                done[item] = self.make(op ^ negated, operands[0], operands[1])
+        return done[root]
+
+    #Prenex form of a node in negation normal form taken with split (see nnf): returns the quantifier prefix, as
+    #(EXISTS or FORALL, binder) outermost first, and the quantifier-free matrix. Binders are unique, so quantifiers
+    #move out over AND and OR without renaming; they are collected in preorder, which keeps every quantifier ahead
+    #of those inside its formula. A subformula shared by several parents contributes its quantifiers once
+    def prenex(self, root):
+        prefix = []
+        seen = set()
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            if node in seen or not self.quantified[node]:
+                continue
+            seen.add(node)
+            op = self.op[node]
+            if op >= EXISTS:
+                prefix.append((op, self.left[node]))
+                pending.append(self.right[node])
+            elif op == AND or op == OR:
+                pending.append(self.right[node])
+                pending.append(self.left[node])
+            else:
+                raise ValueError("prenex form needs a formula in negation normal form with quantified IFF expanded")
+        return prefix, self.strip(root, {})
+
+    #Node with the quantifiers of the subformula of node removed; matrix memoizes the nodes already stripped
+    def strip(self, node, matrix):
+        pending = [node]
+        while pending:
+            current = pending[-1]
+            if current in matrix:
+                pending.pop()
+                continue
+            if not self.quantified[current]:
+                matrix[current] = current
+                pending.pop()
+                continue
+            op = self.op[current]
+            if op >= EXISTS:
+                body = self.right[current]
+                if body not in matrix:
+                    pending.append(body)
+                    continue
+                matrix[current] = matrix[body]
+            else:
+                left = self.left[current]
+                right = self.right[current]
+                if left not in matrix or right not in matrix:
+                    pending.append(left)
+                    pending.append(right)
+                    continue
+                matrix[current] = self.make(op, matrix[left], matrix[right])
+            pending.pop()
+        return matrix[node]
+
+    #Output name of a binder. A bound variable keeps its name unless it is free elsewhere, a symbol of the signature
+    #other than a variable or the name of an earlier binder; it is then numbered apart
+    def name(self, binder):
+        name = self.names.get(binder)
+        if name != None:
+            return name
+        taken = self.reserved()
+        base = name = self.binders[binder]
+        #Numbering resumes after the last number given to the name, so many binders of one name stay linear
+        number = self.numbers.get(base, 0)
+        while name in taken:
+            number += 1
+            name = base + "_" + str(number)
+        self.numbers[base] = number
+        taken.add(name)
+        self.names[binder] = name
+        return name
+
+    def atom_text(self, atom):
+        symbol, terms = self.atoms[atom]
+        terms = [self.name(term) if term.__class__ == int else term for term in terms]
+        if symbol == self.equality and len(terms) == 2:
+            return "( " + terms[0] + " " + symbol + " " + terms[1] + " )"
+        return symbol + "(" + ",".join(terms) + ")"
+
+    #Number of parse tree nodes of F* the subformula of node spells out, counting shared subformulas every time
+    #they are written; Python integers, so exponential sizes are reported rather than overflowing
+    def size(self, node):
+        sizes = {}
+        pending = [node]
+        while pending:
+            current = pending[-1]
+            if current in sizes:
+                pending.pop()
+                continue
+            op = self.op[current]
+            if op == ATOM:
+                sizes[current] = 1
+                pending.pop()
+                continue
+            operands = [self.right[current]] if op >= EXISTS else [operand for operand in (self.left[current], self.right[current]) if operand >= 0]
+            missing = [operand for operand in operands if operand not in sizes]
+            if missing:
+                pending.extend(missing)
+                continue
+            sizes[current] = 1 + sum(sizes[operand] for operand in operands)
+            pending.pop()
+        return sizes[node]
+
+    #Size size() would give the negation normal form of node (see nnf, taken without iff), worked out from the
+    #formula as it stands rather than by building it: one pass over each node and polarity, so the size of an
+    #expansion is known before it is built. A renamed copy has the size of the subformula it copies, so split does
+    #not change the size; the prefix of a prenex form has an entry per quantifier, so it has this size too
+    def nnf_size(self, node):
+        sizes = {}
+        root = (node, False)
+        pending = [root]
+        while pending:
+            item = pending[-1]
+            if item in sizes:
+                pending.pop()
+                continue
+            node, negated = item
+            op = self.op[node]
+            left = self.left[node]
+            right = self.right[node]
+            if op == ATOM:
+                sizes[item] = 2 if negated else 1
+                pending.pop()
+                continue
+            if op == NOT:
+                needed = [(left, not negated)]
+            elif op >= EXISTS:
+                needed = [(right, negated)]
+            elif op == IMPLIES:
+                needed = [(left, not negated), (right, negated)]
+            elif op == IFF:
+                needed = [(left, True), (right, negated), (left, False), (right, not negated)]
+            else:
+                needed = [(left, negated), (right, negated)]
+            missing = [operand for operand in needed if operand not in sizes]
+            if missing:
+                pending.extend(missing)
+                continue
+            pending.pop()
+            size = sum(sizes[operand] for operand in needed)
+            if op == NOT:
+                sizes[item] = size
+            elif len(needed) == 4:
+                #( ( a OR b ) AND ( c OR d ) )
+                sizes[item] = 3 + size
+            else:
+                sizes[item] = 1 + size
+        return sizes[root]
+
+    #Write the subformula of node in the syntax of a spec, after the quantifiers of prefix, to the file object out
+    def write(self, out, node, prefix=()):
+        parts = []
+        for op, binder in prefix:
+            parts.append(self.quantifiers[op - EXISTS] + " " + self.name(binder) + " ")
+        #Entries are nodes to write or text to write as is
+        pending = [node]
+        while pending:
+            item = pending.pop()
+            if item.__class__ == str:
+                parts.append(item)
+            else:
+                op = self.op[item]
+                if op == ATOM:
+                    parts.append(self.atom_text(self.left[item]))
+                elif op == NOT:
+                    parts.append(self.connectives[NOT] + " ")
+                    pending.append(self.left[item])
+                elif op >= EXISTS:
+                    parts.append(self.quantifiers[op - EXISTS] + " " + self.name(self.left[item]) + " ")
+                    pending.append(self.right[item])
+                else:
+                    parts.append("( ")
+                    pending.append(" )")
+                    pending.append(self.right[item])
+                    pending.append(" " + self.connectives[op] + " ")
+                    pending.append(self.left[item])
+            if len(parts) >= WRITE_BLOCK:
+                out.write("".join(parts))
+                parts = []
+        out.write("".join(parts))
+
+    #Give each binder of the subformula of node and of prefix its output name (see name), in the order write meets
+    #them. A subformula written several times names nothing new after the first, so each node is passed once
+    def name_binders(self, node, prefix=()):
+        for op, binder in prefix:
+            self.name(binder)
+        seen = set()
+        pending = [node]
+        while pending:
+            item = pending.pop()
+            if item in seen:
+                continue
+            seen.add(item)
+            op = self.op[item]
+            if op == ATOM:
+                for term in self.atoms[self.left[item]][1]:
+                    if term.__class__ == int:
+                        self.name(term)
+            elif op == NOT:
+                pending.append(self.left[item])
+            elif op >= EXISTS:
+                self.name(self.left[item])
+                pending.append(self.right[item])
+            else:
+                pending.append(self.right[item])
+                pending.append(self.left[item])
+
+    #Write a spec holding the signature and the formula of node after prefix; the variables section also declares
+    #the names given to renamed binders, which are all given before the formula is streamed to out
+    def write_spec(self, out, node, prefix=()):
+        self.name_binders(node, prefix)
+        variables = list(self.variables)
+        declared = set(variables)
+        for binder in sorted(self.names):
+            if self.names[binder] not in declared:
+                declared.add(self.names[binder])
+                variables.append(self.names[binder])
+        out.write("variables: " + " ".join(variables) + "\n")
+        out.write("constants: " + " ".join(self.constants) + "\n")
+        out.write("predicates: " + " ".join(name + "[" + str(arity) + "]" for name, arity in self.predicates) + "\n")
+        out.write("equality: " + self.equality + "\n")
+        out.write("connectives: " + " ".join(self.connectives) + "\n")
+        out.write("quantifiers: " + " ".join(self.quantifiers) + "\n")
+        out.write("formula: ")
+        self.write(out, node, prefix)
+        out.write("\n")
+
+    #Clauses of the Tseitin encoding of a quantifier-free node in negation normal form, as lists of DIMACS literals.
+    #Atoms and the operands of AND, OR and IFF are numbered as they are first met, from 1; every AND, OR or IFF below
+    #the top-level clauses gets a variable defined equivalent to it by 3 or 4 clauses, so the output grows linearly
+    #with the formula. The top-level AND is split into clauses and an OR of literals is a clause of its own. Numbers
+    #are only kept per node, clauses are generated one at a time
+    def clauses(self, node, numbers):
+        conjuncts = []
+        pending = [node]
+        while pending:
+            current = pending.pop()
+            if self.op[current] == AND:
+                pending.append(self.right[current])
+                pending.append(self.left[current])
+            else:
+                conjuncts.append(current)
+        for conjunct in conjuncts:
+            disjuncts = []
+            pending = [conjunct]
+            while pending:
+                current = pending.pop()
+                if self.op[current] == OR:
+                    pending.append(self.right[current])
+                    pending.append(self.left[current])
+                else:
+                    disjuncts.append(current)
+            clause = []
+            for disjunct in disjuncts:
+                yield from self.define(disjunct, numbers)
+                clause.append(self.literal(disjunct, numbers))
+            yield clause
+
+    def literal(self, node, numbers):
+        if self.op[node] == NOT:
+            return -numbers[self.left[node]]
+        return numbers[node]
+
+    #Number node and its operands and yield the clauses defining the operators among them, operands first
+    def define(self, node, numbers):
+        pending = [node]
+        while pending:
+            current = pending[-1]
+            op = self.op[current]
+            #A negated atom shares the number of the atom
+            if op == NOT:
+                current = self.left[current]
+                op = ATOM
+            if current in numbers:
+                pending.pop()
+                continue
+            if op == ATOM:
+                numbers[current] = len(numbers) + 1
+                pending.pop()
+                continue
+            if op != AND and op != OR and op != IFF:
+                raise ValueError("CNF needs a quantifier-free formula in negation normal form")
+            left = self.left[current]
+            right = self.right[current]
+            missing = [operand for operand in (left, right) if (self.left[operand] if self.op[operand] == NOT else operand) not in numbers]
+            if missing:
+                pending.extend(missing)
+                continue
+            pending.pop()
+            variable = numbers[current] = len(numbers) + 1
+            a = self.literal(left, numbers)
+            b = self.literal(right, numbers)
+            if op == AND:
+                yield [-variable, a]
+                yield [-variable, b]
+                yield [variable, -a, -b]
+            elif op == OR:
+                yield [-variable, a, b]
+                yield [variable, -a]
+                yield [variable, -b]
+            else:
+                yield [-variable, -a, b]
+                yield [-variable, a, -b]
+                yield [variable, a, b]
+                yield [variable, -a, -b]
+
+    #Write the CNF of the matrix of a prenex form to the file object out in DIMACS format: comments giving the
+    #quantifier prefix and the atom of each variable, the "p cnf" header, then the clauses. The clauses are
+    #generated twice, once to count them for the header and once to write them, so they are never all held at once.
+    #Returns the number of variables and of clauses
+    def write_dimacs(self, out, prefix, matrix):
+        numbers = {}
+        count = 0
+        for clause in self.clauses(matrix, numbers):
+            count += 1
+        if prefix:
+            out.write("c prefix " + " ".join(self.quantifiers[op - EXISTS] + " " + self.name(binder) for op, binder in prefix) + "\n")
+        for node, number in numbers.items():
+            if self.op[node] == ATOM:
+                out.write("c " + str(number) + " " + self.atom_text(self.left[node]) + "\n")
+        out.write("p cnf " + str(len(numbers)) + " " + str(count) + "\n")
+        numbers.clear()
+        parts = []
+        for clause in self.clauses(matrix, numbers):
+            parts.append(" ".join(map(str, clause)) + " 0\n")
+            if len(parts) >= WRITE_BLOCK:
+                out.write("".join(parts))
+                parts = []
+        out.write("".join(parts))
+        return len(numbers), count
+
+#Write the normal form of the formula of a compiled result to out: "nnf" and "prenex" as a spec, "cnf" in DIMACS
+#format. max_size bounds the size of an nnf or prenex formula, in parse tree nodes of F*; larger ones raise
+#ValueError, as writing them out would take too long. The size is checked before the formula is rewritten (see
+#nnf_size), so the memory of an expansion of IFFs is bounded by max_size too. The CNF is only equisatisfiable:
+#quantified IFFs are named first (see name_iffs), so its size stays linear in the formula. Returns the Formula
+def normalize(result, form, out, max_size=None):
+    formula = Formula(result.parsed)
+    root = formula.add_tree(result.tree)
+    if max_size != None and form != "cnf":
+        size = formula.nnf_size(root)
+        if size > max_size:
+            raise ValueError("normal form has " + str(size) + " nodes, more than " + str(max_size))
+    if form == "nnf":
+        node = formula.nnf(root)
+        prefix = ()
+    elif form == "cnf":
+        prefix, node = formula.prenex(formula.nnf(formula.name_iffs(root), split=True, iff=True))
+    else:
+        prefix, node = formula.prenex(formula.nnf(root, split=True))
+    if form == "cnf":
+        formula.write_dimacs(out, prefix, node)
+        return formula
+    formula.write_spec(out, node, prefix)
+    return formula
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the formula of a spec file to a normal form.")
+    parser.add_argument("input", help="spec file (.txt)")
+    parser.add_argument("--form", choices=FORMS, default="cnf", help="nnf or prenex (written as a spec), or cnf (written in DIMACS format, Tseitin encoded); default: cnf")
+    parser.add_argument("--output", "-o", default=None, help="file to write to (default: standard output)")
+    parser.add_argument("--max-size", type=int, default=10000000, help="largest nnf or prenex formula written, in parse tree nodes (default: 10000000)")
+    args = parser.parse_args(argv)
+    result = compilerdesign.compile_file(args.input, verbose=True)
+    if not result.ok:
+        return 1
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        normalize(result, args.form, out, args.max_size)
+    except ValueError as error:
+        compilerdesign.report_error("Failed to convert formula: " + str(error))
+        return 1
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
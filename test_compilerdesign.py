@@ -0,0 +1,873 @@
+import io
+import json
+import os
+import random
+import itertools
+import re
+import time
+
+import pytest
+
+import compilerdesign
+import normalforms
+
+SIGNATURE = "variables: x y z\nconstants: C D\npredicates: P[2] Q[1] R[3]\nequality: ==\nconnectives: AND OR IMPLIES IFF NOT\nquantifiers: E A\n"
+ARITIES = {"P": 2, "Q": 1, "R": 3}
+
+EXAMPLE1 = '(F* (Q* A) (V* price) (F* (Q* E) (V* cost1) (F* "(" (F* (P* (Z* Same) "(" (V* cost1) , (V* price) ")")) (C* AND) (F* "(" (F* NOT (F* (P* (Z* Non_zero) "(" (V* price) ")"))) (C* IFF) (F* "(" (T* (V* cost1)) == (T* (K* 30)) ")") ")") ")")))'
+
+#Errors are logged to the working directory; each test starts its own log writer there
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    compilerdesign.flush_log()
+    compilerdesign._reset_log_writer()
+
+#Random formula over SIGNATURE as (text, S-expression of its parse tree)
+def generate(rng, depth=0):
+    choice = rng.random()
+    if depth > 5 or choice < 0.25:
+        name = rng.choice(["P", "Q", "R", "=="])
+        if name == "==":
+            left = rng.choice("xyCD")
+            right = rng.choice("xyzCD")
+            terms = ["(T* (%s* %s))" % ("V" if term in "xyz" else "K", term) for term in (left, right)]
+            return "( %s == %s )" % (left, right), '(F* "(" %s == %s ")")' % tuple(terms)
+        variables = [rng.choice("xyz") for _ in range(ARITIES[name])]
+        return name + "(" + ",".join(variables) + ")", '(F* (P* (Z* %s) "(" %s ")"))' % (name, " , ".join("(V* " + variable + ")" for variable in variables))
+    if choice < 0.5:
+        left = generate(rng, depth + 1)
+        right = generate(rng, depth + 1)
+        connective = rng.choice(["AND", "OR", "IMPLIES", "IFF"])
+        return "( %s %s %s )" % (left[0], connective, right[0]), '(F* "(" %s (C* %s) %s ")")' % (left[1], connective, right[1])
+    if choice < 0.7:
+        formula = generate(rng, depth + 1)
+        return "NOT " + formula[0], "(F* NOT " + formula[1] + ")"
+    quantifier = rng.choice("EA")
+    variable = rng.choice("xyz")
+    formula = generate(rng, depth + 1)
+    return quantifier + " " + variable + " " + formula[0], "(F* (Q* %s) (V* %s) %s)" % (quantifier, variable, formula[1])
+
+def sexp(tree):
+    output = io.StringIO()
+    tree.write_sexp(output)
+    return output.getvalue().strip()
+
+def arrays(tree):
+    return list(tree.kind), [tree.label(index) for index in range(len(tree))], list(tree.pos), list(tree.end)
+
+def spec(formula):
+    return SIGNATURE + "formula: " + formula + "\n"
+
+@pytest.mark.parametrize("name, nodes", [("example1.txt", 51), ("example1a.txt", 85)])
+def test_examples(name, nodes):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    result = compilerdesign.compile_file(path)
+    assert result.ok and not result.diagnostics
+    assert len(result.tree) == nodes
+    if name == "example1.txt":
+        assert sexp(result.tree) == EXAMPLE1
+
+def test_random_trees():
+    rng = random.Random(0)
+    for _ in range(300):
+        formula, expected = generate(rng)
+        result = compilerdesign.compile_spec(spec(formula))
+        assert result.ok, (formula, result.errors)
+        assert sexp(result.tree) == expected
+
+
+def test_nesting_deeper_than_recursion_limit():
+    depth = 5000
+    result = compilerdesign.compile_spec(spec("NOT " * depth + "( Q(x) AND " * depth + "Q(y)" + " )" * depth))
+    assert result.ok and len(result.tree) == 15 * depth + 8
+
+@pytest.mark.parametrize("name", ["example1.txt", "example1a.txt"])
+def test_streamed_examples(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    result = compilerdesign.compile_file(path)
+    streamed = compilerdesign.compile_stream(path)
+    mapped = compilerdesign.compile_stream(path, use_mmap=True)
+    assert streamed.ok and mapped.ok
+    assert sexp(streamed.tree) == sexp(mapped.tree) == sexp(result.tree)
+
+def test_streamed_trees(workdir):
+    rng = random.Random(1)
+    compilerdesign.STREAM_CHUNK, chunk = 7, compilerdesign.STREAM_CHUNK
+    try:
+        for number in range(50):
+            formula, expected = generate(rng)
+            path = str(workdir / ("spec%d.txt" % number))
+            with open(path, "w") as output:
+                output.write(spec(formula))
+            for use_mmap in (False, True):
+                result = compilerdesign.compile_stream(path, use_mmap)
+                assert result.ok and sexp(result.tree) == expected
+    finally:
+        compilerdesign.STREAM_CHUNK = chunk
+
+def test_locate_sections_blocks():
+    rng = random.Random(2)
+    chunk = compilerdesign.STREAM_CHUNK
+    try:
+        for _ in range(1000):
+            compilerdesign.STREAM_CHUNK = rng.choice([1, 2, 3, 5, 64])
+            parts = []
+            for _ in range(rng.randint(0, 6)):
+                header = rng.choice(compilerdesign.definitions + ["formu", "form:"])
+                parts.append(rng.choice(["", " ", "\t  ", "x "]) + header + rng.choice(["", " a b", "  formula: q"]) + "\n" * rng.randint(0, 2) + " " * rng.randint(0, 5))
+            data = "".join(parts).encode()
+            assert list(compilerdesign.locate_sections(io.BytesIO(data), False)) == list(compilerdesign.locate_sections(data, True))
+    finally:
+        compilerdesign.STREAM_CHUNK = chunk
+
+def write_specs(directory, formulas):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, formula in formulas.items():
+        (directory / (name + ".txt")).write_text(spec(formula))
+
+def test_batch_directory(workdir):
+    write_specs(workdir / "specs", {"good": "( Q(x) AND P(x,y) )", "bad": "( Q(x) AND )"})
+    write_specs(workdir / "specs" / "nested", {"deep": "E x Q(x)"})
+    records = compilerdesign.run_batch(str(workdir / "specs"), str(workdir / "out"), str(workdir / "summary.jsonl"), workers=2, exports=("json",))
+    assert sorted(os.path.basename(status["file"]) for status in records) == ["bad.txt", "good.txt"]
+    status = {os.path.basename(status["file"]): status for status in records}
+    assert status["good.txt"]["ok"] and status["good.txt"]["nodes"] == 24
+    assert not status["bad.txt"]["ok"] and status["bad.txt"]["errors"]
+    assert (workdir / "out" / "good-outputgrammar.txt").exists()
+    assert (workdir / "out" / "good-outputparsetree.dot").read_text().startswith("digraph")
+    assert (workdir / "out" / "good-outputparsetree.json").exists()
+    assert not (workdir / "out" / "bad-outputgrammar.txt").exists()
+    summary = [json.loads(line) for line in (workdir / "summary.jsonl").read_text().splitlines()]
+    assert sorted(record["file"] for record in summary) == sorted(record["file"] for record in records)
+
+def test_batch_manifest(workdir, capsys):
+    write_specs(workdir / "specs" / "nested", {"one": "Q(x)", "two": "A y Q(y)"})
+    (workdir / "manifest.txt").write_text("#specs to compile\nspecs/nested/one.txt\n\nspecs/nested/two.txt\n")
+    assert compilerdesign.main(["batch", str(workdir / "manifest.txt"), "--out", str(workdir / "out"), "--workers", "1", "--render", "none"]) == 0
+    assert "Compiled 2 specs, 0 failed" in capsys.readouterr().out
+    assert (workdir / "out" / "specs" / "nested" / "two-outputgrammar.txt").exists()
+    assert not (workdir / "out" / "specs" / "nested" / "two-outputparsetree.dot").exists()
+    assert len((workdir / "out" / "summary.jsonl").read_text().splitlines()) == 2
+
+def log_records(path):
+    return [json.loads(line) for line in open(path)]
+
+def test_log_writer_batches_in_order(workdir):
+    path = str(workdir / "test.log")
+    writer = compilerdesign.LogWriter(path, interval=60)
+    for number in range(10):
+        writer.write((0.0, "spec", "OK", str(number)))
+    assert os.path.getsize(path) == 0
+    writer.flush()
+    assert [record["message"] for record in log_records(path)] == [str(number) for number in range(10)]
+    writer.write((0.0, "spec", "ERR", "last"))
+    writer.close()
+    record = log_records(path)[-1]
+    assert (record["source"], record["status"], record["message"], record["pid"]) == ("spec", "ERR", "last", os.getpid())
+
+def test_log_writer_bounds_pending_records(workdir):
+    path = str(workdir / "test.log")
+    writer = compilerdesign.LogWriter(path, capacity=50, batch=10**6, interval=60)
+    for number in range(120):
+        writer.write((0.0, "", "OK", str(number)))
+        assert len(writer.pending) < 50
+    assert len(log_records(path)) == 100
+    writer.close()
+
+def test_log_writer_concurrent_threads(workdir):
+    path = str(workdir / "test.log")
+    writer = compilerdesign.LogWriter(path, batch=7, interval=0.01)
+    def log(thread):
+        for number in range(500):
+            writer.write((0.0, str(thread), "OK", str(number)))
+    threads = [compilerdesign.threading.Thread(target=log, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    records = log_records(path)
+    assert len(records) == 4000
+    for thread in range(8):
+        assert [record["message"] for record in records if record["source"] == str(thread)] == [str(number) for number in range(500)]
+
+def test_append_log_records_the_spec(workdir):
+    compilerdesign.compile_spec(spec("( Q(x) AND )"), source="broken.txt", verbose=False)
+    compilerdesign.flush_log()
+    records = [record for record in log_records(workdir / "logfile.log") if record["source"] == "broken.txt"]
+    assert records and records[-1]["status"] == "ERR"
+
+def test_cache_hits_and_misses(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    first = compilerdesign.compile_cached(spec("( Q(x) AND P(x,y) )"), cache, "first.txt")
+    assert first.ok and not first.cached
+    #Layout and comments do not change the key
+    second = compilerdesign.compile_cached(spec("(  Q(x)\n AND P(x,y) )"), cache, "second.txt")
+    assert second.ok and second.cached and second.cache_key == first.cache_key
+    assert arrays(second.tree) == arrays(first.tree)
+    assert second.grammar == first.grammar.replace("first.txt", "second.txt")
+    other = compilerdesign.compile_cached(spec("( Q(y) AND P(x,y) )"), cache)
+    assert not other.cached and other.cache_key != first.cache_key
+    failed = compilerdesign.compile_cached(spec("( Q(x) AND )"), cache)
+    again = compilerdesign.compile_cached(spec("( Q(x) AND )"), cache)
+    assert again.cached and not again.ok and again.errors == failed.errors
+    compilerdesign.flush_log()
+
+#A hit is answered from the entry alone; the spec is tokenized only once its tokens or diagnostics are read
+def test_cache_hits_do_not_tokenize(workdir, monkeypatch):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    for formula in ("( Q(x) AND P(x,y) )", "( Q(x) AND )"):
+        compilerdesign.compile_cached(spec(formula), cache)
+    full = compilerdesign.compile_spec(spec("( Q(x)\n AND P(x,y) )"))
+    lines, scopes = full.parsed[8], compilerdesign.scope_diagnostics(full)
+    located = compilerdesign.compile_spec(spec("( Q(x) AND )")).diagnostics
+    parse_input = compilerdesign.parse_input
+    def tokenize(text):
+        tokenize.calls += 1
+        return parse_input(text)
+    tokenize.calls = 0
+    monkeypatch.setattr(compilerdesign, "parse_input", tokenize)
+    good = compilerdesign.compile_cached(spec("( Q(x)\n AND P(x,y) )"), cache)
+    bad = compilerdesign.compile_cached(spec("( Q(x) AND )"), cache)
+    assert good.cached and good.ok and good.grammar and len(good.tree) == 24
+    assert bad.cached and not bad.ok and bad.errors
+    assert tokenize.calls == 0 and "tokenize" not in good.timings
+    assert good.parsed[8] == lines and good.parsed[9] != None
+    assert bad.diagnostics == located and located[0].line != None
+    assert tokenize.calls == 2 and "tokenize" in good.timings
+    assert compilerdesign.scope_diagnostics(good) == scopes and scopes[0].line == 7
+
+def test_cache_renders(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    result = compilerdesign.compile_cached(spec("Q(x)"), cache)
+    cache.add_render(result.cache_key, "png", b"\x89PNG")
+    assert compilerdesign.compile_cached(spec("Q(x)"), cache).renders == {"png": b"\x89PNG"}
+
+def test_cache_evicts_least_recently_used(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    keys = [compilerdesign.compile_cached(spec("( Q(x) AND " * number + "Q(y)" + " )" * number), cache).cache_key for number in range(12)]
+    sizes = {key: os.path.getsize(cache.path(key)) for key in keys}
+    assert cache.size == sum(sizes.values())
+    #Entries used in the order of keys, except that the first was used last
+    for number, key in enumerate(keys[1:] + keys[:1]):
+        os.utime(cache.path(key), (1000000 + number, 1000000 + number))
+    cache.max_bytes = sum(sizes.values()) // 2
+    compilerdesign.compile_cached(spec("Q(z)"), cache)
+    kept = [key for key in keys if cache.get(key) != None]
+    assert keys[0] in kept and keys[-1] in kept and keys[1] not in kept
+    assert kept == [keys[0]] + keys[12 - len(kept) + 1:]
+    assert cache.size == sum(size for mtime, size, path in cache.entries()) <= cache.max_bytes * 0.9
+
+def test_cache_concurrent_writers(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"), max_bytes=2000)
+    failures = []
+    def compile_all(thread):
+        try:
+            for number in range(100):
+                result = compilerdesign.compile_cached(spec("( Q(x) AND P(x,y) )" if number % 2 else "Q(%s)" % "xyz"[thread % 3]), cache)
+                assert result.ok
+                cache.add_render(result.cache_key, "dot", b"digraph {}")
+        except Exception as error:
+            failures.append(error)
+    threads = [compilerdesign.threading.Thread(target=compile_all, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+    assert not [name for name in os.listdir(cache.directory) if name.endswith(".tmp")]
+
+def test_render_pipeline(workdir):
+    small = compilerdesign.compile_spec(spec("( Q(x) AND P(x,y) )")).tree
+    large = compilerdesign.compile_spec(spec("( Q(x) AND " * 10 + "Q(y)" + " )" * 10)).tree
+    finished = []
+    pipeline = compilerdesign.RenderPipeline(2, "dot", done=finished.append)
+    pipeline.submit({"errors": []}, str(workdir / "small.dot"), str(workdir / "small.png"), tree=small)
+    records = pipeline.close()
+    assert finished == records and records[0]["parsetree"] == str(workdir / "small.dot")
+    assert "render_wait" in records[0]["timings"] and "picture" not in records[0]
+    assert (workdir / "small.dot").read_text().count("[label=") == len(small)
+    #Trees above max_nodes get no image, and no temporary DOT text either
+    pipeline = compilerdesign.RenderPipeline(1, "png", max_nodes=len(large) - 1)
+    pipeline.submit({"errors": []}, None, str(workdir / "large.png"), tree=large)
+    status = pipeline.close()[0]
+    assert status["render"].startswith("skipped") and not os.path.exists(workdir / "large.png")
+    pipeline = compilerdesign.RenderPipeline(1, "none")
+    pipeline.submit({"errors": []}, str(workdir / "none.dot"), str(workdir / "none.png"), tree=small)
+    assert "parsetree" not in pipeline.close()[0] and not os.path.exists(workdir / "none.dot")
+
+def test_render_failure_is_recorded(workdir, monkeypatch):
+    monkeypatch.setenv("PATH", str(workdir))
+    tree = compilerdesign.compile_spec(spec("Q(x)")).tree
+    pipeline = compilerdesign.RenderPipeline(1, "png")
+    pipeline.submit({"ok": True, "errors": []}, str(workdir / "tree.dot"), str(workdir / "tree.png"), tree=tree)
+    status = pipeline.close()[0]
+    assert not status["ok"] and status["errors"][0].startswith("Failed to render parse tree")
+    assert status["parsetree"] == str(workdir / "tree.dot") and "picture" not in status
+
+#Nested (label, children) of node index of a ParseTree. Labels hold backslashes doubled; JSON and S-expressions write them single
+def nested(tree, index=0):
+    return tree.label(index).replace("\\\\", "\\"), [nested(tree, child) for child in tree.children(index)]
+
+def from_json(node):
+    return node["label"], [from_json(child) for child in node.get("children", [])]
+
+SERIALIZER_SIGNATURE = 'variables: x y\nconstants: a"b c\\d\npredicates: P[2] Q[1]\nequality: =\nconnectives: AND OR IMPLIES IFF NOT\nquantifiers: E A\n'
+
+@pytest.fixture
+def serialized_tree():
+    result = compilerdesign.compile_spec(SERIALIZER_SIGNATURE + 'formula: E x ( ( x = a"b ) AND NOT ( P(x,y) OR ( c\\d = y ) ) )\n')
+    assert result.ok, result.errors
+    return result.tree
+
+def test_json_serializer(serialized_tree, monkeypatch):
+    output = io.StringIO()
+    serialized_tree.write_json(output)
+    assert from_json(json.loads(output.getvalue())) == nested(serialized_tree)
+    #Blocks flushed part way through give the same text
+    monkeypatch.setattr(compilerdesign, "SERIALIZE_BLOCK", 3)
+    blocked = io.StringIO()
+    serialized_tree.write_json(blocked)
+    assert blocked.getvalue() == output.getvalue()
+
+def test_dot_serializer(serialized_tree, monkeypatch):
+    output = io.StringIO()
+    serialized_tree.write_dot(output)
+    text = output.getvalue()
+    assert text.startswith("digraph tree {\n") and text.endswith("}\n")
+    name = r'"((?:[^"\\]|\\.)*)_(\d+)"'
+    labels = {}
+    for label, index, attribute in re.findall("^    " + name + r' \[label="((?:[^"\\]|\\.)*)"\];$', text, re.M):
+        labels[int(index)] = attribute.replace('\\"', '"')
+    assert labels == {index: serialized_tree.label(index) for index in range(len(serialized_tree))}
+    edges = [(int(parent), int(child)) for _, parent, _, child in re.findall("^    " + name + " -> " + name + ";$", text, re.M)]
+    assert edges == [(index, child) for index in range(len(serialized_tree)) for child in serialized_tree.children(index)]
+    monkeypatch.setattr(compilerdesign, "SERIALIZE_BLOCK", 2)
+    blocked = io.StringIO()
+    serialized_tree.write_dot(blocked)
+    assert blocked.getvalue() == text
+
+def test_export_formats(serialized_tree, workdir):
+    for fmt in compilerdesign.TREE_FORMATS:
+        compilerdesign.export_tree(serialized_tree, str(workdir / ("tree." + fmt)), fmt)
+    assert from_json(json.loads((workdir / "tree.json").read_text())) == nested(serialized_tree)
+    assert (workdir / "tree.sexp").read_text() == sexp(serialized_tree) + "\n"
+    assert (workdir / "tree.dot").read_text().count(" -> ") == len(serialized_tree) - 1
+
+@pytest.fixture
+def profiling():
+    yield
+    compilerdesign.disable_profiling()
+
+def test_profiler_records_phases(profiling, workdir):
+    profiler = compilerdesign.enable_profiling()
+    for _ in range(3):
+        result = compilerdesign.compile_spec(spec("( Q(x) AND P(x,y) )"))
+    phases = profiler.phases
+    assert {"tokenize", "validate", "parse"} <= set(phases)
+    assert phases["parse"]["calls"] == 3 and phases["parse"]["items"] == 3 * len(result.tree)
+    assert phases["tokenize"]["items"] == 3 * 13
+    assert all(phase["wall"] >= 0 and phase["peak"] > 0 for phase in phases.values())
+    assert profiler.table().splitlines()[0].split()[:3] == ["phase", "calls", "wall"]
+    profiler.write(str(workdir / "metrics.json"))
+    metrics = json.loads((workdir / "metrics.json").read_text())
+    assert metrics["memory"] == "maxrss" and metrics["phases"] == json.loads(json.dumps(phases))
+    compilerdesign.disable_profiling()
+    compilerdesign.compile_spec(spec("Q(x)"))
+    assert phases["parse"]["calls"] == 3
+
+def test_profiler_memory_and_merge(profiling):
+    profiler = compilerdesign.enable_profiling(memory=True)
+    compilerdesign.compile_spec(spec("( Q(x) AND " * 200 + "Q(y)" + " )" * 200))
+    assert profiler.phases["parse"]["peak"] > 0
+    other = compilerdesign.Profiler()
+    other.record("parse", 1.0, 0.5, 10, 1 << 40)
+    other.record("export", 2.0, 1.0, None, None)
+    calls = profiler.phases["parse"]["calls"]
+    profiler.merge(other.phases)
+    assert profiler.phases["parse"]["calls"] == calls + 1 and profiler.phases["parse"]["peak"] == 1 << 40
+    assert profiler.phases["export"] == {"calls": 1, "wall": 2.0, "cpu": 1.0, "items": 0, "peak": 0}
+
+def test_batch_profile(profiling, workdir, capsys):
+    write_specs(workdir / "specs", {"one": "Q(x)", "two": "( Q(x) AND Q(y) )"})
+    assert compilerdesign.main(["batch", str(workdir / "specs"), "--out", str(workdir / "out"), "--workers", "2", "--profile", str(workdir / "metrics.json")]) == 0
+    assert "Metrics written to" in capsys.readouterr().out
+    phases = json.loads((workdir / "metrics.json").read_text())["phases"]
+    assert phases["parse"]["calls"] == 2 and phases["dot"]["calls"] == 2
+
+def test_serve_stdio(monkeypatch, capsys):
+    requests = [
+        {"id": 1, "op": "ping"},
+        {"id": 2, "spec": spec("( Q(x) AND P(x,y) )"), "tree": "sexp", "grammar": False},
+        {"id": 3, "spec": spec("( Q(x) AND )")},
+        {"id": 4, "spec": spec("Q(x)"), "tree": "xml"},
+        {"id": 5, "op": "launch"},
+        {"id": 6, "spec": spec("Q(x)"), "tree": None},
+    ]
+    lines = [json.dumps(request) + "\n" for request in requests] + ["\n", "[1, 2]\n", "{not json\n"]
+    monkeypatch.setattr(compilerdesign.sys, "stdin", io.StringIO("".join(lines)))
+    assert compilerdesign.serve_stdio(3) == 0
+    responses = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(responses) == 8
+    by_id = {response["id"]: response for response in responses if response["id"] != None}
+    assert by_id[1]["ok"]
+    assert by_id[2]["ok"] and by_id[2]["tree"].startswith("(F* ") and "grammar" not in by_id[2]
+    assert not by_id[3]["ok"] and by_id[3]["diagnostics"][0]["line"] == 7
+    assert by_id[4]["errors"] == ["Unknown parse tree format: xml"]
+    assert by_id[5]["errors"] == ["Unknown request: launch"]
+    assert by_id[6]["ok"] and "tree" not in by_id[6] and by_id[6]["grammar"]
+    invalid = [response for response in responses if response["id"] == None]
+    assert len(invalid) == 2 and all(response["errors"][0].startswith("Invalid request") for response in invalid)
+
+def test_serve_sessions(monkeypatch, capsys):
+    edits = ["( Q(x)\n AND\n P(x,y) )", "( Q(x)\n AND\n P(y,y) )", "( Q(x)\n AND\n P(y,y) OR )"]
+    lines = [json.dumps({"id": number, "session": "test_serve_sessions", "spec": spec(edit), "tree": "sexp"}) + "\n" for number, edit in enumerate(edits)]
+    monkeypatch.setattr(compilerdesign.sys, "stdin", io.StringIO("".join(lines)))
+    assert compilerdesign.serve_stdio(1) == 0
+    responses = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [response["ok"] for response in responses] == [True, True, False]
+    assert "reparse" not in responses[0]["timings"] and "reparse" in responses[1]["timings"]
+    assert responses[1]["tree"] == sexp(compilerdesign.compile_spec(spec(edits[1])).tree) + "\n"
+    assert responses[2]["diagnostics"]
+
+#Send each request over a connection to the socket server at path; returns the responses
+def ask(path, *requests):
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        replies = connection.makefile("r")
+        responses = []
+        for request in requests:
+            connection.sendall((json.dumps(request) + "\n").encode())
+            responses.append(json.loads(replies.readline()))
+        return responses
+
+def test_serve_socket(workdir):
+    path = str(workdir / "compile.sock")
+    #A socket left behind by a server that is gone is replaced
+    import socket
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    server = compilerdesign.threading.Thread(target=compilerdesign.serve_socket, args=(path, cache))
+    server.start()
+    for _ in range(500):
+        if compilerdesign.socket_in_use(path):
+            break
+        time.sleep(0.01)
+    #A second server does not take over the socket
+    assert compilerdesign.serve_socket(path) == 1
+    first, second = ask(path, {"id": "a", "spec": spec("A x Q(x)"), "tree": "json"}, {"id": "b", "spec": spec("A x  Q(x)")})
+    assert first["id"] == "a" and first["ok"] and json.loads(first["tree"])["label"] == "F*"
+    assert second["ok"] and second["tree"] == first["tree"]
+    assert ask(path, {"op": "stats"})[0]["signatures"] >= 1
+    assert ask(path, {"id": "stop", "op": "shutdown"})[0] == {"id": "stop", "ok": True, "errors": []}
+    server.join(10)
+    assert not server.is_alive() and not os.path.exists(path)
+
+def test_serve_socket_keeps_other_files(workdir):
+    path = workdir / "compile.sock"
+    path.write_text("not a socket")
+    assert compilerdesign.serve_socket(str(path)) == 1
+    assert path.read_text() == "not a socket"
+
+MULTI = SIGNATURE + "formula: ( Q(x) AND\n  P(x,y) )\nformulas:\n  E x Q(x)\n\n  ( Q(x) AND )\n  A y R(x,y,z)\nformula: NOT Q(y)\n"
+
+def test_multi_formula_spec():
+    results = list(compilerdesign.compile_formulas(MULTI, "multi.txt"))
+    assert [result.source for result in results] == ["multi.txt:7", "multi.txt:10", "multi.txt:12", "multi.txt:13", "multi.txt:14"]
+    assert [result.ok for result in results] == [True, True, False, True, True]
+    assert sexp(results[1].tree) == sexp(compilerdesign.compile_spec(spec("E x Q(x)")).tree)
+    assert (results[2].diagnostics[0].line, results[2].diagnostics[0].col) == (12, 14)
+    #Every formula shares the grammar of the spec
+    assert len({result.grammar for result in results if result.ok}) == 1 and "multi.txt" in results[0].grammar
+    assert results[0].grammar == compilerdesign.compile_spec(spec("Q(x)"), "multi.txt").grammar
+
+def test_multi_formula_invalid_signature():
+    results = list(compilerdesign.compile_formulas("variables: x\nformulas:\n  Q(x)\n  Q(x)\n", "bad.txt"))
+    assert len(results) == 1 and results[0].source == "bad.txt" and not results[0].ok and results[0].errors
+
+def test_multi_formula_cli(workdir, capsys):
+    (workdir / "multi.txt").write_text(MULTI)
+    assert compilerdesign.main([str(workdir / "multi.txt"), "--multi", "--export", "sexp"]) == 1
+    out = capsys.readouterr().out
+    assert "Checked 5 formulas, 1 failed" in out and ":12: " in out
+    results = list(workdir.glob("*multi-outputformulas.jsonl"))
+    records = [json.loads(line) for line in results[0].read_text().splitlines()]
+    assert [record["ok"] for record in records] == [True, True, False, True, True]
+    assert records[3]["sexp"].startswith("(F* (Q* A) (V* y)")
+    assert len(list(workdir.glob("*multi-outputgrammar.txt"))) == 1
+
+#Token-level edit of a formula, often leaving it malformed
+def mutate(rng, formula):
+    tokens = formula.split(" ")
+    index = rng.randrange(len(tokens))
+    choice = rng.random()
+    if choice < 0.3:
+        del tokens[index]
+    elif choice < 0.6:
+        tokens.insert(index, rng.choice(["(", ")", "AND", "NOT", "x", "C", "P(x)", "==", ",", "E", "Q", "NOT Q(y)"]))
+    else:
+        tokens[index] = rng.choice(["(", ")", "AND", "x", "C", "==", "Q(x)", "E", "P(x,y)"])
+    return " ".join(tokens)
+
+def test_recovery_reports_every_error():
+    result = compilerdesign.compile_spec(spec("( ( Q(x) AND U(y) ) OR\n  ( P(x,y) AND ( x == ) ) )"))
+    assert not result.ok
+    assert [diagnostic.code for diagnostic in result.diagnostics] == ["undeclared", "syntax"]
+    assert (result.diagnostics[0].line, result.diagnostics[0].col) == (7, 23)
+    assert result.diagnostics[1].line == 8
+
+def test_malformed_formulas_fail_with_diagnostics():
+    rng = random.Random(3)
+    for _ in range(300):
+        formula = mutate(rng, generate(rng)[0])
+        result = compilerdesign.compile_spec(spec(formula))
+        assert result.ok == (not result.errors), formula
+        assert result.ok == (not result.diagnostics), formula
+
+def test_cached_diagnostics_follow_layout(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    for formula in ("( Q(x) AND U(y) )", "\n\n\n   (\n Q(x)\n   AND\n      U(y) )"):
+        cached = compilerdesign.compile_cached(spec(formula), cache)
+        assert cached.diagnostics == compilerdesign.compile_spec(spec(formula)).diagnostics
+
+def test_recovery_from_many_nested_errors():
+    depth = 3000
+    result = compilerdesign.compile_spec(spec("( ( Q(x) AND U ) AND " * depth + "Q(y)" + " )" * depth))
+    assert [diagnostic.code for diagnostic in result.diagnostics] == ["undeclared"] * depth
+    parser = compilerdesign.Parser(list(result.parsed[6]), *result.parsed[0:2], result.parsed[4], [predicate[0] for predicate in result.parsed[2]], result.parsed[5], result.parsed[3])
+    assert len(parser.diagnostics) == depth
+    #Every synchronizing action has been popped along with its recorded stack index
+    assert not any(parser.syncs.values())
+
+#Formula broken over lines, so reparse reuses some of them
+def layout(formula):
+    rng = random.Random(len(formula))
+    return "".join(rng.choice(["\n", "\n\n  ", " ", " "]) if character == " " else character for character in formula)
+
+def test_reparse_matches_full_compile():
+    rng = random.Random(4)
+    for _ in range(60):
+        formula = layout(generate(rng)[0])
+        previous = compilerdesign.compile_spec(spec(formula))
+        for _ in range(6):
+            edited = layout(mutate(rng, formula))
+            full = compilerdesign.compile_spec(spec(edited))
+            incremental = compilerdesign.reparse(previous, spec(edited))
+            assert full.ok == incremental.ok, edited
+            if full.ok:
+                assert arrays(full.tree) == arrays(incremental.tree)
+                assert full.parsed[6] == incremental.parsed[6] and full.parsed[8] == incremental.parsed[8]
+                previous = incremental
+                formula = edited
+            else:
+                assert full.errors == incremental.errors
+
+def test_reparse_hands_over_the_tree():
+    previous = compilerdesign.compile_spec(spec("( Q(x)\n AND\n P(x,y) )"))
+    edited = compilerdesign.reparse(previous, "\n" + spec("( Q(x)\n AND\n\n Q(y) )"))
+    assert edited.ok and "reparse" in edited.timings and previous.tree == None
+    assert edited.diagnostics == [] and edited.parsed[8][-1][0] == 11
+    failed = compilerdesign.reparse(edited, spec("( Q(x) AND )"))
+    assert not failed.ok and edited.tree != None
+
+def test_reparse_from_cached_result(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    compilerdesign.compile_cached(spec("( Q(x)\n AND\n P(x,y) )"), cache, "cached.txt")
+    previous = compilerdesign.compile_cached(spec("( Q(x)\n AND\n P(x,y) )"), cache, "cached.txt")
+    assert previous.cached
+    edited = compilerdesign.reparse(previous, spec("( Q(x)\n AND\n P(y,y) )"))
+    assert edited.ok and edited.source == "cached.txt"
+    assert arrays(edited.tree) == arrays(compilerdesign.compile_spec(spec("( Q(x)\n AND\n P(y,y) )")).tree)
+    #The next edit is reparsed from the tree of the first
+    again = compilerdesign.reparse(edited, spec("( Q(y)\n AND\n P(y,y) )"))
+    assert again.ok and "reparse" in again.timings
+    #A result without tokens, such as one whose file could not be read, is compiled in full
+    unread = compilerdesign.compile_file(str(workdir / "missing.txt"))
+    assert unread.parsed == None
+    assert compilerdesign.reparse(unread, spec("Q(x)")).ok
+
+def test_serve_sessions_with_cache(workdir):
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    compilerdesign.compile_cached(spec("( Q(x) AND P(x,y) )"), cache)
+    for number, formula in enumerate(["( Q(x) AND P(x,y) )", "( Q(x) AND P(y,y) )", "( Q(x) AND P(y,y) OR )"]):
+        response = compilerdesign.handle_request({"session": "test_serve_sessions_with_cache", "spec": spec(formula), "tree": "sexp"}, cache)
+        assert response["ok"] == (number < 2), response["errors"]
+        if number == 1:
+            assert response["tree"] == sexp(compilerdesign.compile_spec(spec(formula)).tree) + "\n"
+
+def test_dag_shares_and_releases():
+    rng = random.Random(5)
+    formulas = [generate(rng, 2)[0] for _ in range(200)]
+    text = SIGNATURE + "formulas:\n" + "\n".join(formulas + formulas[:50]) + "\n"
+    dag = compilerdesign.FormulaDAG()
+    shared = list(compilerdesign.compile_formulas(text, dag=dag))
+    trees = list(compilerdesign.compile_formulas(text))
+    assert all(result.ok for result in shared)
+    for result, tree in zip(shared, trees):
+        assert sexp(dag.tree(result.root)) == sexp(tree.tree)
+    assert [result.root for result in shared[200:]] == [result.root for result in shared[:50]]
+    for result in shared:
+        dag.release(result.root)
+    assert len(dag) == 0
+
+def test_scopes():
+    result = compilerdesign.compile_spec(spec("( E x A x Q(x) AND A y P(x,z) )"))
+    codes = sorted(code for code, message, start, end in compilerdesign.check_scopes(result.tree))
+    assert codes == ["free", "free", "shadow", "unused", "unused"]
+
+def test_scopes_of_cached_spec(workdir, capsys):
+    (workdir / "free.txt").write_text(SIGNATURE + "formula: ( E x Q(x)\n  AND Q(y) )\n")
+    outputs = []
+    for _ in range(2):
+        assert compilerdesign.main([str(workdir / "free.txt"), "--cache", str(workdir / "cache"), "--render", "none", "--scopes"]) == 0
+        outputs.append([line for line in capsys.readouterr().out.splitlines() if "Variable" in line])
+    assert outputs[0] == outputs[1] == [str(workdir / "free.txt") + ":8:9: Variable y is not bound by any quantifier"]
+    cache = compilerdesign.CompileCache(str(workdir / "cache"))
+    cached = compilerdesign.compile_cached((workdir / "free.txt").read_text(), cache)
+    assert cached.cached and compilerdesign.scope_diagnostics(cached) == compilerdesign.scope_diagnostics(compilerdesign.compile_file(str(workdir / "free.txt")))
+
+#Truth of the subformula of node of a normalforms.Formula in a model over domain, env mapping binders to elements
+def evaluate(formula, node, model, env, domain):
+    op = formula.op[node]
+    if op == normalforms.ATOM:
+        symbol, terms = formula.atoms[formula.left[node]]
+        values = tuple(env[term] if term.__class__ == int else model[term] for term in terms)
+        if symbol == formula.equality:
+            return values[0] == values[1]
+        return model[symbol][values]
+    if op == normalforms.NOT:
+        return not evaluate(formula, formula.left[node], model, env, domain)
+    if op >= normalforms.EXISTS:
+        values = (evaluate(formula, formula.right[node], model, env | {formula.left[node]: element}, domain) for element in domain)
+        return any(values) if op == normalforms.EXISTS else all(values)
+    left = evaluate(formula, formula.left[node], model, env, domain)
+    right = evaluate(formula, formula.right[node], model, env, domain)
+    return (left and right, left or right, not left or right, left == right)[op]
+
+def test_normal_forms_are_equivalent():
+    rng = random.Random(6)
+    domain = (0, 1)
+    checked = 0
+    for _ in range(150):
+        formula = generate(rng, 1)[0]
+        result = compilerdesign.compile_spec(spec(formula))
+        original = normalforms.Formula(result.parsed)
+        root = original.add_tree(result.tree)
+        for form in ("nnf", "prenex"):
+            output = io.StringIO()
+            try:
+                normalforms.normalize(result, form, output, max_size=2000)
+            except ValueError:
+                continue
+            converted = compilerdesign.compile_spec(output.getvalue())
+            assert converted.ok, output.getvalue()
+            normal = normalforms.Formula(converted.parsed)
+            node = normal.add_tree(converted.tree)
+            if form == "prenex":
+                while normal.op[node] >= normalforms.EXISTS:
+                    node = normal.right[node]
+                assert not normal.quantified[node]
+                node = normal.add_tree(converted.tree)
+            if len(normal.binders) > 8:
+                continue
+            for _ in range(3):
+                model = {name: rng.choice(domain) for name in ("C", "D", "x", "y", "z")}
+                for name, arity in ARITIES.items():
+                    model[name] = {values: rng.random() < 0.5 for values in itertools.product(domain, repeat=arity)}
+                assert evaluate(original, root, model, {}, domain) == evaluate(normal, node, model, {}, domain), (form, formula)
+            checked += 1
+    assert checked > 100
+
+def test_cnf_is_equisatisfiable():
+    rng = random.Random(7)
+    checked = 0
+    for _ in range(150):
+        formula = generate(rng, 2)[0]
+        result = compilerdesign.compile_spec(spec(formula))
+        output = io.StringIO()
+        normalforms.normalize(result, "cnf", output)
+        lines = output.getvalue().splitlines()
+        header = [line for line in lines if line.startswith("p ")][0].split()
+        clauses = [[int(literal) for literal in line.split()[:-1]] for line in lines if not line.startswith(("c", "p"))]
+        assert len(clauses) == int(header[3])
+        variables = int(header[2])
+        if variables > 14:
+            continue
+        #The Tseitin encoding of the matrix is satisfiable exactly when the matrix is, atoms taken as propositions
+        converted = normalforms.Formula(result.parsed)
+        prefix, matrix = converted.prenex(converted.nnf(converted.name_iffs(converted.add_tree(result.tree)), split=True, iff=True))
+        numbers = {}
+        list(converted.clauses(matrix, numbers))
+        atoms = [node for node in numbers if converted.op[node] == normalforms.ATOM]
+        satisfiable = any(all(any((literal > 0) == values[abs(literal) - 1] for literal in clause) for clause in clauses) for values in itertools.product((False, True), repeat=variables))
+        assert satisfiable == any(propositional(converted, matrix, dict(zip(atoms, values))) for values in itertools.product((False, True), repeat=len(atoms)))
+        checked += 1
+    assert checked > 50
+
+def propositional(formula, node, values):
+    op = formula.op[node]
+    if op == normalforms.ATOM:
+        return values[node]
+    if op == normalforms.NOT:
+        return not propositional(formula, formula.left[node], values)
+    left = propositional(formula, formula.left[node], values)
+    right = propositional(formula, formula.right[node], values)
+    return (left and right, left or right, not left or right, left == right)[op]
+
+def test_nnf_size_matches_the_rewrite():
+    rng = random.Random(8)
+    for _ in range(200):
+        result = compilerdesign.compile_spec(spec(generate(rng, 1)[0]))
+        formula = normalforms.Formula(result.parsed)
+        root = formula.add_tree(result.tree)
+        assert formula.nnf_size(root) == formula.size(formula.nnf(root))
+        prefix, matrix = formula.prenex(formula.nnf(root, split=True))
+        assert formula.nnf_size(root) == formula.size(matrix) + len(prefix)
+
+#Operators used in the subformula of node, with NOT applied to anything but an atom counted as None
+def operators(formula, node):
+    found = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        op = formula.op[node]
+        if op == normalforms.NOT and formula.op[formula.left[node]] != normalforms.ATOM:
+            found.add(None)
+        found.add(op)
+        if op >= normalforms.EXISTS:
+            pending.append(formula.right[node])
+        elif op != normalforms.ATOM:
+            pending.extend(operand for operand in (formula.left[node], formula.right[node]) if operand >= 0)
+    return found
+
+def test_nnf_has_no_iff_or_implies():
+    rng = random.Random(9)
+    formulas = ["NOT ( Q(x) IFF ( Q(y) IMPLIES E z Q(z) ) )"] + [generate(rng, 1)[0] for _ in range(100)]
+    for formula in formulas:
+        result = compilerdesign.compile_spec(spec(formula))
+        for form in ("nnf", "prenex"):
+            output = io.StringIO()
+            try:
+                normalforms.normalize(result, form, output, max_size=2000)
+            except ValueError:
+                continue
+            converted = compilerdesign.compile_spec(output.getvalue())
+            normal = normalforms.Formula(converted.parsed)
+            found = operators(normal, normal.add_tree(converted.tree))
+            assert not found & {normalforms.IFF, normalforms.IMPLIES, None}, (form, output.getvalue())
+    output = io.StringIO()
+    normalforms.normalize(compilerdesign.compile_spec(spec(formulas[0])), "nnf", output)
+    assert output.getvalue().splitlines()[-1] == "formula: ( ( NOT Q(x) OR ( Q(y) AND A z NOT Q(z) ) ) AND ( Q(x) OR ( NOT Q(y) OR E z Q(z) ) ) )"
+
+def test_max_size_is_checked_before_expanding(monkeypatch):
+    depth = 40
+    result = compilerdesign.compile_spec(spec("( E x Q(x) IFF " * depth + "A y Q(y)" + " )" * depth))
+    def rename(*args):
+        raise AssertionError("renamed copies made for a formula over max_size")
+    monkeypatch.setattr(normalforms.Formula, "rename", rename)
+    with pytest.raises(ValueError, match="more than 1000"):
+        normalforms.normalize(result, "prenex", io.StringIO(), max_size=1000)
+
+#File object recording each write
+class Writes():
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+def test_write_spec_streams_the_formula(monkeypatch):
+    monkeypatch.setattr(normalforms, "WRITE_BLOCK", 8)
+    result = compilerdesign.compile_spec(spec("( E x ( Q(x) IFF A y P(x,y) ) AND ( E x Q(x) OR A x A z R(x,y,z) ) )"))
+    output = Writes()
+    #The formula is generated only once the header is out, rather than held until then
+    started = []
+    write = normalforms.Formula.write
+    def record(self, out, node, prefix=()):
+        started.append(list(output.writes))
+        return write(self, out, node, prefix)
+    monkeypatch.setattr(normalforms.Formula, "write", record)
+    normalforms.normalize(result, "prenex", output)
+    text = "".join(output.writes)
+    formula = output.writes.index("formula: ")
+    assert started == [output.writes[:formula + 1]]
+    assert len(output.writes) - formula > 4 and max(len(write) for write in output.writes[formula:]) < 100
+    #Renamed binders are declared ahead of the formula
+    converted = compilerdesign.compile_spec(text)
+    assert converted.ok, text
+    assert text.splitlines()[0].split()[1:4] == ["x", "y", "z"] and len(text.splitlines()[0].split()) > 4
+
+def test_token_positions():
+    text = SIGNATURE + "formula:   ( Q(x)\n\t  AND\n\n    P(x,y) )\n"
+    parsed = compilerdesign.parse_input(text)
+    tokens = parsed[6]
+    assert tokens == ["(", "Q", "(", "x", ")", "AND", "P", "(", "x", ",", "y", ")", ")"]
+    lines = text.split("\n")
+    for index, token in enumerate(tokens):
+        line, col = compilerdesign.token_position(parsed, index)
+        assert lines[line - 1][col - 1:col - 1 + len(token)] == token
+    assert compilerdesign.token_position(parsed, 0) == (7, 12)
+    assert compilerdesign.token_position(parsed, 5) == (8, 4)
+    assert compilerdesign.token_position(parsed, 10) == (10, 9)
+    located = compilerdesign.locate_tokens(parsed, [12, 6, 13, 1])
+    assert located[6] == ("P", 10, 5) and located[1] == ("Q", 7, 14)
+    #The past-the-end index is an empty token just after the last one
+    assert located[13] == ("", 10, 13) and located[12] == (")", 10, 12)
+
+def test_every_signature_conflict_is_reported(capsys):
+    text = "variables: x y x (\nconstants: C x\npredicates: P[1] C[2]\nequality: =\nconnectives: AND OR IMPLIES IFF NOT\nquantifiers: E A\nformula: P(y)\n"
+    assert compilerdesign.check_validity(compilerdesign.parse_input(text)) == False
+    assert capsys.readouterr().out.splitlines() == [
+        "Detected duplicate variables.",
+        "Found a duplicate in variables and constants: x",
+        "Found a duplicate in constants and predicate symbols: C",
+        "Variable cannot be one of '(', ')', or ',' ",
+    ]
+
+def test_node_names_are_deterministic(workdir):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example1a.txt")
+    for run in range(2):
+        compilerdesign.export_tree(compilerdesign.compile_file(path).tree, str(workdir / ("run%d.dot" % run)))
+    assert (workdir / "run0.dot").read_bytes() == (workdir / "run1.dot").read_bytes()
+    names = re.findall(r'^    "(.*)" \[label=', (workdir / "run0.dot").read_text(), re.M)
+    tree = compilerdesign.compile_file(path).tree
+    assert names == [tree.label(index).replace("\\", "\\\\").replace('"', '\\"') + "_" + str(index) for index in range(len(tree))]
+
+def test_anytree_names_are_deterministic():
+    pytest.importorskip("anytree")
+    from anytree import PreOrderIter
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example1.txt")
+    runs = [[(node.name, node.id) for node in PreOrderIter(compilerdesign.compile_file(path).tree.to_anytree())] for _ in range(2)]
+    assert runs[0] == runs[1]
+    assert runs[0][:3] == [("F*_0", "F*"), ("Q*_1", "Q*"), ("A_2", "A")]
+
+#The Parser checks arity and parentheses in place of check_formula and reports the same message
+@pytest.mark.parametrize("formula", ["P(x)", "Q(x,y)", "A x R(x,y", "( Q(x) AND Q(y)", "( Q(x) AND Q(y) ) )", "Q(x) )", "( Q(x) AND Q )", "Q", "E x Q"])
+def test_parser_reports_check_formula_messages(formula, capsys):
+    parsed = compilerdesign.parse_input(spec(formula))
+    compilerdesign.check_signature(parsed)
+    capsys.readouterr()
+    assert compilerdesign.check_formula(parsed) == False
+    expected = capsys.readouterr().out.strip()
+    result = compilerdesign.compile_spec(spec(formula))
+    assert not result.ok
+    assert result.errors[0] == expected
+
+#Outputs stay under --out for manifest entries outside the manifest's directory, and same-named specs do not collide
+def test_batch_manifest_outside_entries(workdir):
+    write_specs(workdir / "elsewhere", {"one": "Q(x)"})
+    write_specs(workdir / "other", {"one": "E x Q(x)"})
+    (workdir / "lists").mkdir()
+    (workdir / "lists" / "manifest.txt").write_text("../elsewhere/one.txt\n" + str(workdir / "other" / "one.txt") + "\n")
+    records = compilerdesign.run_batch(str(workdir / "lists" / "manifest.txt"), str(workdir / "out"), str(workdir / "summary.jsonl"), workers=1)
+    assert len(records) == 2 and all(status["ok"] for status in records)
+    outputs = sorted(os.listdir(workdir / "out"))
+    assert len(outputs) == 4 and all(name.startswith("one-") for name in outputs)
+    assert len(set(name.split("-")[1] for name in outputs)) == 2
+    assert sorted(os.listdir(workdir)) == ["elsewhere", "lists", "logfile.log", "other", "out", "summary.jsonl"]
+    assert sorted(os.listdir(workdir / "elsewhere")) == ["one.txt"]